@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: stream frames into gif or animated png files
+
+Frames are written as soon as they are added so that only the last
+frame is kept in memory. Every frame is indexed with one palette
+that is chosen from the colors of the first frame, since the frames
+of a time series share the colors of a few classes. After the first
+frame only the rectangle of pixels that changed is written and pixels
+that did not change within it are transparent.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import zlib
+import struct
+import numpy as np
+
+# palette index of transparent pixels
+transparent = 255
+
+def quantize(image):
+    """index the colors of an image in a grid of 32 levels for each channel"""
+
+    image = np.asarray(image, dtype=np.int64)
+    return (image[..., 0] >> 3) << 10 | (image[..., 1] >> 3) << 5 | (image[..., 2] >> 3)
+
+def build_palette(image):
+    """choose a palette from the most common colors of an image"""
+
+    # average the colors of pixels in each level of the grid
+    levels = quantize(image).ravel()
+    pixels = np.asarray(image, dtype=np.float64).reshape(-1, 3)
+    counts = np.bincount(levels, minlength=32768)
+    common = np.argsort(counts)[::-1][:transparent]
+    common = common[counts[common] > 0]
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    for channel in range(3):
+        sums = np.bincount(levels, weights=pixels[:, channel], minlength=32768)
+        palette[:len(common), channel] = np.round(sums[common] / counts[common])
+
+    # look up the nearest palette color for every level of the grid
+    grid = np.arange(32768)
+    centers = np.column_stack([(grid >> 10) & 31, (grid >> 5) & 31, grid & 31]) * 8 + 4
+    distances = ((centers[:, None, :] - palette[None, :len(common), :].astype(np.int64)) ** 2).sum(axis=2)
+    lookup = np.argmin(distances, axis=1).astype(np.uint8)
+    return palette, lookup
+
+def difference(indices, previous):
+    """find the rectangle of changed pixels with unchanged pixels transparent"""
+
+    if previous is None:
+        return 0, 0, indices
+    changed = indices != previous
+    if not changed.any():
+        return 0, 0, np.full((1, 1), transparent, dtype=np.uint8)
+    rows = np.nonzero(changed.any(axis=1))[0]
+    cols = np.nonzero(changed.any(axis=0))[0]
+    window = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+    return cols[0], rows[0], np.where(changed[window], indices[window], transparent).astype(np.uint8)
+
+def lzw(indices, minimum=8):
+    """compress palette indices with variable length codes for gif"""
+
+    clear = 1 << minimum
+    end = clear + 1
+    output = bytearray()
+    buffer = clear
+    bits = minimum + 1
+    table = {}
+    next_code = end + 1
+    size = minimum + 1
+
+    pixels = bytearray(np.ascontiguousarray(indices, dtype=np.uint8).tobytes())
+    prefix = pixels[0]
+    for index in pixels[1:]:
+        key = prefix << 8 | index
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        # write the longest known sequence
+        buffer |= prefix << bits
+        bits += size
+        while bits >= 8:
+            output.append(buffer & 255)
+            buffer >>= 8
+            bits -= 8
+
+        # add a code for the sequence and the next pixel
+        # or start over when all codes are used
+        if next_code < 4096:
+            table[key] = next_code
+            if next_code == 1 << size:
+                size += 1
+            next_code += 1
+        else:
+            buffer |= clear << bits
+            bits += size
+            table = {}
+            next_code = end + 1
+            size = minimum + 1
+        prefix = index
+
+    # write the last sequence and the end code
+    for code in (prefix, end):
+        buffer |= code << bits
+        bits += size
+        while bits >= 8:
+            output.append(buffer & 255)
+            buffer >>= 8
+            bits -= 8
+    if bits:
+        output.append(buffer & 255)
+    return bytes(output)
+
+class Animation(object):
+    """write frames to an animation file as they are added"""
+
+    def __init__(self, path, count, delay):
+        self.path = path
+        self.count = count
+        self.delay = delay
+        self.file = open(path + '.tmp', 'wb')
+        self.palette = None
+        self.lookup = None
+        self.previous = None
+
+    def add(self, image):
+        """index an RGB frame and write what changed since the last frame"""
+
+        if self.palette is None:
+            self.palette, self.lookup = build_palette(image)
+            self.start(image.shape[1], image.shape[0])
+        indices = self.lookup[quantize(image)]
+        left, top, pixels = difference(indices, self.previous)
+        self.write(left, top, pixels)
+        self.previous = indices
+
+    def close(self):
+        """finish the file and move it into place"""
+
+        self.finish()
+        self.file.close()
+        os.rename(self.path + '.tmp', self.path)
+
+class Gif(Animation):
+    """write frames to a looping gif"""
+
+    def start(self, width, height):
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0xF7, 0, 0))
+        self.file.write(self.palette.tobytes())
+        self.file.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', 0) + b'\x00')
+
+    def write(self, left, top, pixels):
+        # keep the last frame under transparent pixels
+        self.file.write(b'\x21\xF9\x04' + struct.pack('<BHBB', 0x05, self.delay, transparent, 0))
+        self.file.write(b'\x2C' + struct.pack('<HHHHB', left, top, pixels.shape[1], pixels.shape[0], 0))
+        data = lzw(pixels)
+        self.file.write(b'\x08')
+        for position in range(0, len(data), 255):
+            block = data[position:position + 255]
+            self.file.write(struct.pack('<B', len(block)) + block)
+        self.file.write(b'\x00')
+
+    def finish(self):
+        self.file.write(b'\x3B')
+
+class AnimatedPng(Animation):
+    """write frames to a looping animated png"""
+
+    def chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def start(self, width, height):
+        self.sequence = 0
+        alpha = np.full(256, 255, dtype=np.uint8)
+        alpha[transparent] = 0
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+        self.chunk(b'acTL', struct.pack('>II', self.count, 0))
+        self.chunk(b'PLTE', self.palette.tobytes())
+        self.chunk(b'tRNS', alpha.tobytes())
+
+    def write(self, left, top, pixels):
+        # replace the first frame and draw later frames over the last frame
+        first = self.previous is None
+        self.chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence,
+            pixels.shape[1], pixels.shape[0], left, top, self.delay, 100,
+            0, 0 if first else 1))
+        self.sequence += 1
+        rows = np.column_stack([np.zeros(len(pixels), dtype=np.uint8), pixels])
+        data = zlib.compress(rows.tobytes())
+        if first:
+            self.chunk(b'IDAT', data)
+        else:
+            self.chunk(b'fdAT', struct.pack('>I', self.sequence) + data)
+            self.sequence += 1
+
+    def finish(self):
+        self.chunk(b'IEND', b'')
+
+def writer(path, count, delay):
+    """open an animation for a gif or png file with a delay in hundredths of a second"""
+
+    if path.endswith('.png'):
+        return AnimatedPng(path, count, delay)
+    return Gif(path, count, delay)
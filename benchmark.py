@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: benchmark the stages of the analysis on synthetic data
+
+Generate synthetic elevation models, landcover time series, and stream
+gage stations at several sizes and numbers of basins, run each stage of
+panama_analysis.py on them, and record throughput and memory. Results
+are compared with a stored baseline so that performance regressions can
+be detected. Run in a temporary location, for example:
+
+    grass --tmp-location EPSG:32617 --exec python benchmark.py --sizes 1000 5000
+
+or without GRASS GIS on the numpy backend for the stages that it supports:
+
+    PANAMA_BACKEND=numpy python benchmark.py --stages landcover_analysis
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import itertools
+import multiprocessing
+
+# run modules on numpy arrays in this process if requested
+if os.environ.get('PANAMA_BACKEND') == 'numpy':
+    import numpy_backend
+    numpy_backend.install()
+
+import grass.script as gscript
+import panama_analysis as analysis
+
+# stages to benchmark in the order that they run
+stages = ['topographic_analysis',
+    'hydrological_modeling',
+    'landcover_analysis',
+    'extract_basins',
+    'basin_topographic_analysis',
+    'basin_hydrologic_analysis',
+    'basin_landcover_analysis',
+    'stats',
+    'landcover_transitions']
+
+# stages that process each basin
+basin_stages = ['extract_basins',
+    'basin_topographic_analysis',
+    'basin_hydrologic_analysis',
+    'basin_landcover_analysis',
+    'stats',
+    'landcover_transitions']
+
+# synthetic data parameters
+res = 30
+start = 2000
+relief = 30
+landcover_classes = 9
+
+def main():
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description='benchmark the stages '
+        'of the analysis on synthetic data')
+    parser.add_argument('--sizes',
+        nargs='+',
+        type=int,
+        default=[1000, 5000],
+        help='number of rows and columns of the synthetic rasters')
+    parser.add_argument('--basins',
+        nargs='+',
+        type=int,
+        default=[2, 20],
+        help='number of basins')
+    parser.add_argument('--years',
+        type=int,
+        default=2,
+        help='number of years of landcover')
+    parser.add_argument('--stages',
+        nargs='+',
+        default=stages,
+        choices=stages,
+        help='stages to benchmark')
+    parser.add_argument('--output',
+        default='benchmark.json',
+        help='file for the results')
+    parser.add_argument('--baseline',
+        default='benchmark_baseline.json',
+        help='file with baseline results to compare with')
+    parser.add_argument('--tolerance',
+        type=float,
+        default=0.2,
+        help='allowed fraction of slowdown or memory growth')
+    parser.add_argument('--save-baseline',
+        action='store_true',
+        help='save the results as the new baseline')
+    args = parser.parse_args()
+
+    # benchmark each case
+    results = {}
+    for size, basin_count in itertools.product(args.sizes, args.basins):
+        case = '{size}x{size}_{basins}_basins'.format(size=size,
+            basins=basin_count)
+        gscript.message('Benchmarking {case}'.format(case=case))
+        results[case] = benchmark(size, basin_count, args.years, args.stages)
+
+    # write results
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    if args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        return 0
+
+    # compare with baseline
+    if not os.path.isfile(args.baseline):
+        gscript.warning('No baseline to compare with: {baseline}'.format(
+            baseline=args.baseline))
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        gscript.warning(regression)
+    return 1 if regressions else 0
+
+def benchmark(size, basin_count, years, selected_stages):
+    """generate synthetic data and time each stage"""
+
+    workspace = tempfile.mkdtemp()
+    try:
+        configure(size, basin_count, years, workspace)
+        generate(size, basin_count, years, workspace)
+        measurements = {}
+        for stage in stages:
+            if stage not in selected_stages:
+                continue
+            measurement = measure(stage)
+            measurement['cells_per_second'] = size * size / measurement['wall_time']
+            if stage in basin_stages:
+                measurement['basins_per_second'] = basin_count / measurement['wall_time']
+            measurements[stage] = measurement
+            gscript.message('{stage}: {time:.1f} s'.format(stage=stage,
+                time=measurement['wall_time']))
+        return measurements
+    finally:
+        shutil.rmtree(workspace)
+
+def configure(size, basin_count, years, workspace):
+    """point the analysis at the synthetic data"""
+
+    analysis.n = size * res
+    analysis.s = 0
+    analysis.e = size * res
+    analysis.w = 0
+    analysis.res = res
+    analysis.srtm = 'synthetic_srtm'
+    analysis.alos_gdsm = 'synthetic_alos'
+    analysis.reference_stations = 'synthetic_stations'
+    analysis.rivers = ['Basin {index}'.format(index=index)
+        for index in range(basin_count)]
+    analysis.river_mapnames = ['basin_{index}'.format(index=index)
+        for index in range(basin_count)]
+    analysis.start = start
+    analysis.end = start + years
+    analysis.results = workspace
+    analysis.landcover_recode = os.path.join(workspace, 'landcover_recode.txt')
+    analysis.landcover_color = os.path.join(workspace, 'landcover_color.txt')
+    analysis.landcover_categories = os.path.join(workspace, 'landcover_categories.txt')
+
+def generate(size, basin_count, years, workspace):
+    """generate synthetic rasters, stations, and rules"""
+
+    env = analysis.study_area_environment()
+    spacing = float(size * res) / basin_count
+
+    # parallel valleys draining south with small deterministic noise
+    # and gaps in the higher resolution model
+    dem = ('0.02 * y() + {relief} * (1 + cos(x() / {spacing} * 360))'
+        ' + 2 * sin(x() * 0.7) * cos(y() * 1.3)').format(relief=relief,
+            spacing=spacing)
+    gscript.write_command('r.mapcalc',
+        file='-',
+        stdin='{srtm} = {dem}\n'
+            '{alos} = if((row() + col()) % 97 == 0, null(), {dem})\n'.format(
+                srtm=analysis.srtm,
+                alos=analysis.alos_gdsm,
+                dem=dem),
+        overwrite=True,
+        env=env)
+
+    # landcover in esa cci style codes that change each year
+    gscript.write_command('r.mapcalc',
+        file='-',
+        stdin=''.join('landcover_{year} = 10 * (1 + (row() / 37 + col() / 53 + {index}) % {classes})\n'.format(
+            year=year,
+            index=index,
+            classes=landcover_classes)
+            for index, year in enumerate(range(start, start + years))),
+        overwrite=True,
+        env=env)
+
+    # stream gage stations at the outlet of each valley
+    points = ''.join('{x}|{y}|{cat}|{name}\n'.format(x=(index + 0.5) * spacing,
+        y=0.1 * size * res,
+        cat=index + 1,
+        name=river)
+        for index, river in enumerate(analysis.rivers))
+    gscript.write_command('v.in.ascii',
+        input='-',
+        output=analysis.reference_stations,
+        format='point',
+        separator='pipe',
+        x=1,
+        y=2,
+        cat=3,
+        columns='x double precision, y double precision, cat integer, str_1 varchar(40)',
+        stdin=points,
+        overwrite=True,
+        env=env)
+
+    # write rules
+    with open(analysis.landcover_recode, 'w') as rules:
+        rules.write('10:{high}:1:{classes}\n'.format(high=10 * landcover_classes,
+            classes=landcover_classes))
+    with open(analysis.landcover_color, 'w') as rules:
+        rules.write('1 0:100:0\n{classes} 255:255:255\n'.format(
+            classes=landcover_classes))
+    with open(analysis.landcover_categories, 'w') as rules:
+        rules.write(''.join('{value}|class {value}\n'.format(value=value)
+            for value in range(1, landcover_classes + 1)))
+
+def measure(stage):
+    """run a stage in a child process and measure time and memory"""
+
+    queue = multiprocessing.Queue()
+    if getattr(gscript, 'in_process', False):
+        # maps held in memory must stay in this process for later stages
+        run_stage(stage, queue, in_process=True)
+        measurement = queue.get()
+    else:
+        process = multiprocessing.Process(target=run_stage, args=(stage, queue))
+        process.start()
+        measurement = queue.get()
+        process.join()
+    if 'error' in measurement:
+        raise RuntimeError('{stage} failed: {error}'.format(stage=stage,
+            error=measurement['error']))
+    return measurement
+
+def cpu_time():
+    """sum the processor time of this process and its children"""
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    return children.ru_utime + children.ru_stime + own.ru_utime + own.ru_stime
+
+def run_stage(stage, queue, in_process=False):
+    """run a stage and report its time and memory"""
+
+    try:
+        begin = time.time()
+        cpu_begin = cpu_time()
+        getattr(analysis, stage)()
+        wall_time = time.time() - begin
+        measurement = dict(wall_time=wall_time,
+            cpu_time=cpu_time() - cpu_begin)
+
+        # peak memory is only that of the stage in its own process
+        if in_process:
+            measurement['max_rss_mb'] = None
+        else:
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            measurement['max_rss_mb'] = max(children.ru_maxrss, own.ru_maxrss) / 1024.0
+        queue.put(measurement)
+    except Exception as error:
+        queue.put(dict(error=str(error)))
+
+def compare(results, baseline, tolerance):
+    """find throughput and memory regressions"""
+
+    regressions = []
+    for case, measurements in sorted(results.items()):
+        for stage, measurement in sorted(measurements.items()):
+            reference = baseline.get(case, {}).get(stage)
+            if reference is None:
+                continue
+            for metric in ['cells_per_second', 'basins_per_second']:
+                if metric in measurement and metric in reference \
+                    and measurement[metric] < reference[metric] * (1 - tolerance):
+                    regressions.append('{case} {stage}: {metric} fell from '
+                        '{reference:.0f} to {value:.0f}'.format(case=case,
+                            stage=stage,
+                            metric=metric,
+                            reference=reference[metric],
+                            value=measurement[metric]))
+            if measurement.get('max_rss_mb') is None \
+                or reference.get('max_rss_mb') is None:
+                continue
+            if measurement['max_rss_mb'] > reference['max_rss_mb'] * (1 + tolerance):
+                regressions.append('{case} {stage}: memory rose from '
+                    '{reference:.0f} MB to {value:.0f} MB'.format(case=case,
+                        stage=stage,
+                        reference=reference['max_rss_mb'],
+                        value=measurement['max_rss_mb']))
+    return regressions
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: area weighted means of coarse climate grids for each basin
+
+The fraction of each basin that falls in each cell of a climate grid
+is computed once as a sparse matrix of weights, stored as the zone,
+grid cell and weight of each overlap. The mean of a basin for a month
+is then the weighted sum of the grid cells that it overlaps,
+so a series of months costs one small read and one sparse product each.
+Weights are cached on disk with a digest of the zones and the grid.
+GDAL is only imported when grids are read so that the analysis can
+run without it.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import json
+import hashlib
+import datetime
+import numpy as np
+import zonal
+
+def geographic(x, y, wkt):
+    """transform coordinates from a projection to longitude and latitude"""
+
+    from osgeo import osr
+    source = osr.SpatialReference()
+    source.ImportFromWkt(wkt)
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(4326)
+    for reference in (source, target):
+        if hasattr(reference, 'SetAxisMappingStrategy'):
+            reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(source, target)
+    points = np.array(transform.TransformPoints(
+        np.column_stack([x, y]).tolist()))
+    return points[:, 0], points[:, 1]
+
+def overlap_weights(zones, longitude, latitude, ids, geotransform, shape):
+    """compute the fraction of each zone in each cell of a grid"""
+
+    # find the grid cell of each sample
+    x0, dx, _, y0, _, dy = geotransform
+    longitude = np.where(longitude < x0, longitude + 360, longitude)
+    columns = np.floor((longitude - x0) / dx).astype(np.int64)
+    rows = np.floor((latitude - y0) / dy).astype(np.int64)
+    index = zonal.zone_index(zones, ids)
+    valid = (index >= 0) & (rows >= 0) & (rows < shape[0]) \
+        & (columns >= 0) & (columns < shape[1])
+
+    # count samples of each zone in each cell
+    cell_count = shape[0] * shape[1]
+    pairs, counts = np.unique(index[valid] * cell_count
+        + rows[valid] * shape[1] + columns[valid], return_counts=True)
+    zone_positions = pairs // cell_count
+    totals = np.bincount(zone_positions, weights=counts, minlength=len(ids))
+    return dict(zones=zone_positions,
+        cells=pairs % cell_count,
+        weights=counts / totals[zone_positions])
+
+def weights_digest(*parts):
+    """identify the inputs of a set of weights"""
+
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_weights(path, digest):
+    """load cached weights if they were built from the same inputs"""
+
+    if not os.path.isfile(path):
+        return None
+    cached = np.load(path)
+    if str(cached['digest']) != digest:
+        return None
+    return dict(zones=cached['zones'],
+        cells=cached['cells'],
+        weights=cached['weights'])
+
+def save_weights(path, digest, weights):
+    """cache weights on disk"""
+
+    temporary = path + '.tmp.npz'
+    np.savez(temporary, digest=digest, **weights)
+    os.rename(temporary, path)
+
+def band_months(dataset):
+    """find the month of each band from the netcdf time dimension"""
+
+    # parse units such as days since 1800-1-1 00:00:00
+    units = dataset.GetMetadata().get('time#units', '')
+    unit, _, origin = units.partition(' since ')
+    origin = [int(part) for part in origin.split()[0].split('-')] if origin else None
+    seconds = {'days': 86400, 'hours': 3600, 'minutes': 60, 'seconds': 1}
+    if origin is None or unit not in seconds:
+        raise ValueError('dataset has no netcdf time dimension')
+
+    months = []
+    for index in range(1, dataset.RasterCount + 1):
+        value = dataset.GetRasterBand(index).GetMetadata().get('NETCDF_DIM_time')
+        if value is None:
+            raise ValueError('bands have no netcdf time dimension')
+        time = datetime.datetime(*origin) \
+            + datetime.timedelta(seconds=float(value) * seconds[unit])
+        months.append((datetime.date(time.year, time.month, 1), index))
+    return months
+
+def zone_means(dataset, weights, count):
+    """compute the weighted mean of each zone for each band of a dataset"""
+
+    # read only the window of cells that zones overlap
+    columns = weights['cells'] % dataset.RasterXSize
+    rows = weights['cells'] // dataset.RasterXSize
+    left, top = int(columns.min()), int(rows.min())
+    width = int(columns.max()) - left + 1
+    height = int(rows.max()) - top + 1
+    positions = (rows - top) * width + (columns - left)
+
+    for month, index in band_months(dataset):
+        values = read_band(dataset.GetRasterBand(index), left, top, width, height)
+
+        # weighted sum over cells with data
+        sample = values.ravel()[positions]
+        valid = ~np.isnan(sample)
+        sums = np.bincount(weights['zones'][valid],
+            weights=weights['weights'][valid] * sample[valid],
+            minlength=count)
+        totals = np.bincount(weights['zones'][valid],
+            weights=weights['weights'][valid],
+            minlength=count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            yield month, sums / totals
+
+def read_band(band, left, top, width, height):
+    """read a window of a band as unpacked values with nodata as nan"""
+
+    values = band.ReadAsArray(left, top, width, height).astype(np.float64)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        values[values == nodata] = np.nan
+
+    # unpack values stored with a netcdf scale factor and offset
+    return values * (band.GetScale() or 1.0) + (band.GetOffset() or 0.0)
+
+def open_dataset(path):
+    """open a netcdf dataset"""
+
+    from osgeo import gdal
+    dataset = gdal.Open(path)
+    if dataset is None:
+        raise IOError('cannot open {path}'.format(path=path))
+    return dataset
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: composite rendered layers and colored rasters into frames
+
+Layers that do not change between the frames of an animation are
+rendered once as a transparent image and kept as an RGBA array.
+Each frame is then a colored raster sampled onto the frame like
+d.rast with the cached layers blended over it. Rasters are fit to the
+frame like the display library, keeping their aspect and centering
+them, and sampled at the nearest cell to the center of each pixel.
+GDAL is only imported when images are read or written.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import numpy as np
+
+# color of the frame behind the rasters
+background = (255, 255, 255)
+
+def read_ppm(path):
+    """read a binary ppm image as an array of rows, columns and channels"""
+
+    with open(path, 'rb') as ppm_file:
+        data = ppm_file.read()
+
+    # parse the header while skipping comments
+    fields = []
+    position = 0
+    while len(fields) < 4:
+        while data[position:position + 1].isspace():
+            position += 1
+        if data[position:position + 1] == b'#':
+            position = data.index(b'\n', position) + 1
+            continue
+        end = position
+        while not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[position:end])
+        position = end
+    if fields[0] != b'P6':
+        raise ValueError('{path} is not a binary ppm image'.format(path=path))
+    cols, rows = int(fields[1]), int(fields[2])
+    pixels = np.frombuffer(data, dtype=np.uint8, count=rows * cols * 3,
+        offset=position + 1)
+    return pixels.reshape(rows, cols, 3)
+
+def read_png(path):
+    """read an image as an RGBA array"""
+
+    from osgeo import gdal
+    dataset = gdal.Open(path)
+    if dataset is None:
+        raise IOError('cannot open {path}'.format(path=path))
+    image = np.dstack([dataset.GetRasterBand(band).ReadAsArray()
+        for band in range(1, dataset.RasterCount + 1)]).astype(np.uint8)
+    if image.shape[2] == 3:
+        image = np.dstack([image, np.full(image.shape[:2], 255, dtype=np.uint8)])
+    return image
+
+def write_png(path, image):
+    """write an RGB array as a png image"""
+
+    from osgeo import gdal
+    rows, cols, channels = image.shape
+    memory = gdal.GetDriverByName('MEM').Create('', cols, rows, channels, gdal.GDT_Byte)
+    for band in range(channels):
+        memory.GetRasterBand(band + 1).WriteArray(image[:, :, band])
+    gdal.GetDriverByName('PNG').CreateCopy(path, memory)
+    memory = None
+
+def frame_window(region, width, height):
+    """find where a region is drawn in a frame as left, top and scale"""
+
+    # fit the region to the frame keeping its aspect like the display library
+    scale = min(width / (region['e'] - region['w']),
+        height / (region['n'] - region['s']))
+    left = (width - (region['e'] - region['w']) * scale) / 2.0
+    top = (height - (region['n'] - region['s']) * scale) / 2.0
+    return left, top, scale
+
+def sample(rgb, null, region, width, height):
+    """sample a colored raster at the center of each pixel of a frame"""
+
+    left, top, scale = frame_window(region, width, height)
+    rows, cols = null.shape
+
+    # find the cell under each pixel
+    x = (np.arange(width) + 0.5 - left) / scale * cols / (region['e'] - region['w'])
+    y = (np.arange(height) + 0.5 - top) / scale * rows / (region['n'] - region['s'])
+    columns = np.floor(x).astype(np.int64)
+    lines = np.floor(y).astype(np.int64)
+    inside_columns = (columns >= 0) & (columns < cols)
+    inside_lines = (lines >= 0) & (lines < rows)
+    columns = np.clip(columns, 0, cols - 1)
+    lines = np.clip(lines, 0, rows - 1)
+
+    # pixels outside the region or on null cells are left empty
+    image = rgb[lines[:, None], columns[None, :]]
+    empty = null[lines[:, None], columns[None, :]] \
+        | ~(inside_lines[:, None] & inside_columns[None, :])
+    return image, empty
+
+def shade(color, intensity, brighten):
+    """modulate colors by the brightened intensity of a shade like d.shade"""
+
+    factor = np.mean(intensity, axis=-1, keepdims=True) / 255.0
+    factor = np.clip(factor * (100 + brighten) / 100.0, 0, 1)
+    return np.clip(np.round(color * factor), 0, 255).astype(np.uint8)
+
+def composite(image, empty, overlay):
+    """blend cached layers over a sampled raster on the frame background"""
+
+    base = np.where(empty[..., None], np.array(background, dtype=np.float64),
+        image.astype(np.float64))
+    alpha = overlay[..., 3:4] / 255.0
+    blended = overlay[..., :3] * alpha + base * (1 - alpha)
+    return np.clip(np.round(blended), 0, 255).astype(np.uint8)
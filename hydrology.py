@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: D8 flow direction and flow accumulation on numpy arrays
+
+Directions are coded like r.watershed counter clockwise from east,
+so 1 is northeast and 8 is east, and are negative where flow leaves
+the region or reaches null cells. Each cell drains to the neighbor
+with the steepest descent. Flat areas drain to their outlets along
+the shortest path and cells in depressions are left as sinks with
+a direction of 0, so elevation should be conditioned first.
+
+Cells are sorted once into levels so that every cell comes after all
+the cells that drain into it. Flow is then accumulated one level at a
+time with a vectorized sum for all cells of a level. Elevation and
+directions are read in strips of rows so they can be memory mapped.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import hashlib
+import numpy as np
+import zonal
+
+# offsets in rows and columns for each direction code
+offsets = [(1, -1, 1),
+    (2, -1, 0),
+    (3, -1, -1),
+    (4, 0, -1),
+    (5, 1, -1),
+    (6, 1, 0),
+    (7, 1, 1),
+    (8, 0, 1)]
+
+# number of rows processed at a time
+strip = 256
+
+def flow_direction(elevation, direction, nsres, ewres):
+    """compute the direction of steepest descent of each cell"""
+
+    rows, cols = elevation.shape
+    diagonal = np.hypot(nsres, ewres)
+    flats = []
+
+    for top in range(0, rows, strip):
+        bottom = min(top + strip, rows)
+
+        # read the strip with a border of neighbors
+        # where cells outside the region are null
+        block = np.full((bottom - top + 2, cols + 2), np.nan)
+        first = max(top - 1, 0)
+        last = min(bottom + 1, rows)
+        block[first - top + 1:last - top + 1, 1:-1] = elevation[first:last]
+        center = block[1:-1, 1:-1]
+        valid = ~np.isnan(center)
+
+        # find the steepest descent to a neighbor
+        steepest = np.zeros(center.shape)
+        codes = np.zeros(center.shape, dtype=np.int8)
+        outlet = np.zeros(center.shape, dtype=np.int8)
+        for code, row_offset, col_offset in offsets:
+            neighbor = block[1 + row_offset:block.shape[0] - 1 + row_offset,
+                1 + col_offset:block.shape[1] - 1 + col_offset]
+            distance = diagonal if row_offset and col_offset \
+                else (nsres if row_offset else ewres)
+            with np.errstate(invalid='ignore'):
+                slope = (center - neighbor) / distance
+                steeper = slope > steepest
+            steepest = np.where(steeper, slope, steepest)
+            codes = np.where(steeper, code, codes)
+            outlet = np.where((outlet == 0) & np.isnan(neighbor), code, outlet)
+
+        # cells on the edge without a lower neighbor drain out of the region
+        codes = np.where((codes == 0) & (outlet > 0), -outlet, codes)
+        codes[~valid] = 0
+        direction[top:bottom] = codes
+
+        # remember cells on flats or in depressions
+        flats.append(np.flatnonzero(valid & (codes == 0)) + top * cols)
+
+    resolve_flats(elevation, direction, np.concatenate(flats))
+    return direction
+
+def resolve_flats(elevation, direction, pending):
+    """drain flat cells to neighbors of equal elevation that already drain"""
+
+    rows, cols = elevation.shape
+    flat_elevation = elevation.reshape(-1)
+    flat_direction = direction.reshape(-1)
+
+    # assign directions in waves spreading out from the outlets of flats
+    while pending.size:
+        pending_rows, pending_cols = np.divmod(pending, cols)
+        heights = flat_elevation[pending]
+        assigned = np.zeros(pending.size, dtype=bool)
+        codes = np.zeros(pending.size, dtype=np.int8)
+        for code, row_offset, col_offset in offsets:
+            neighbor_rows = pending_rows + row_offset
+            neighbor_cols = pending_cols + col_offset
+            inside = (neighbor_rows >= 0) & (neighbor_rows < rows) \
+                & (neighbor_cols >= 0) & (neighbor_cols < cols)
+            neighbors = np.where(inside, neighbor_rows * cols + neighbor_cols, 0)
+            found = ~assigned & inside \
+                & (flat_elevation[neighbors] == heights) \
+                & (flat_direction[neighbors] != 0)
+            codes[found] = code
+            assigned |= found
+
+        # cells that cannot reach an outlet are sinks
+        if not assigned.any():
+            break
+        flat_direction[pending[assigned]] = codes[assigned]
+        pending = pending[~assigned]
+
+def receivers(direction, out=None):
+    """find the index of the cell that each cell drains to, or -1"""
+
+    rows, cols = direction.shape
+    receiver = np.empty(rows * cols, dtype=np.int32) if out is None else out
+    for top in range(0, rows, strip):
+        bottom = min(top + strip, rows)
+        codes = np.asarray(direction[top:bottom])
+        index = np.arange(top * cols, bottom * cols, dtype=np.int64).reshape(codes.shape)
+        target = np.full(codes.shape, -1, dtype=np.int64)
+        for code, row_offset, col_offset in offsets:
+            target = np.where(codes == code, index + row_offset * cols + col_offset, target)
+        receiver[top * cols:bottom * cols] = target.ravel()
+    return receiver
+
+def topological_order(receiver):
+    """sort cells into levels that come after every cell draining into them"""
+
+    count = receiver.size
+    draining = receiver[receiver >= 0]
+    indegree = np.bincount(draining, minlength=count).astype(np.uint8)
+    order = np.empty(count, dtype=np.int32)
+    levels = [0]
+
+    # peel off cells whose upstream cells are all sorted
+    frontier = np.flatnonzero(indegree == 0)
+    while frontier.size:
+        order[levels[-1]:levels[-1] + frontier.size] = frontier
+        levels.append(levels[-1] + frontier.size)
+        downstream = receiver[frontier]
+        cells, counts = np.unique(downstream[downstream >= 0], return_counts=True)
+        indegree[cells] -= counts.astype(np.uint8)
+        frontier = cells[indegree[cells] == 0]
+    return order[:levels[-1]], np.array(levels, dtype=np.int64)
+
+def flow_accumulation(receiver, order, levels, weights, edge=None):
+    """accumulate weights downstream one level at a time
+
+    Accumulation is negative for cells that edge cells drain into
+    since flow from outside of the region may be missing.
+    """
+
+    accumulation = np.array(weights, dtype=np.float64).ravel()
+    outside = None if edge is None else np.array(edge, dtype=bool).ravel()
+    for level in range(len(levels) - 1):
+        cells = order[levels[level]:levels[level + 1]]
+        downstream = receiver[cells]
+        draining = downstream >= 0
+        cells = cells[draining]
+        if not cells.size:
+            continue
+        targets, inverse = np.unique(downstream[draining], return_inverse=True)
+        accumulation[targets] += np.bincount(inverse,
+            weights=accumulation[cells],
+            minlength=targets.size)
+        if outside is not None:
+            outside[targets] |= np.bincount(inverse,
+                weights=outside[cells],
+                minlength=targets.size) > 0
+    if outside is not None:
+        accumulation[outside] *= -1
+    return accumulation
+
+def edge_cells(elevation):
+    """find cells next to nulls or the edge of the region"""
+
+    rows, cols = elevation.shape
+    edge = np.zeros((rows, cols), dtype=bool)
+    for top in range(0, rows, strip):
+        bottom = min(top + strip, rows)
+        block = np.full((bottom - top + 2, cols + 2), np.nan)
+        first = max(top - 1, 0)
+        last = min(bottom + 1, rows)
+        block[first - top + 1:last - top + 1, 1:-1] = elevation[first:last]
+        valid = ~np.isnan(block[1:-1, 1:-1])
+        near_null = np.zeros(valid.shape, dtype=bool)
+        for code, row_offset, col_offset in offsets:
+            near_null |= np.isnan(block[1 + row_offset:block.shape[0] - 1 + row_offset,
+                1 + col_offset:block.shape[1] - 1 + col_offset])
+        edge[top:bottom] = valid & near_null
+    return edge
+
+def direction_digest(direction):
+    """identify a direction raster"""
+
+    sha = hashlib.sha1(str(direction.shape).encode('utf-8'))
+    for top in range(0, direction.shape[0], strip):
+        sha.update(np.ascontiguousarray(direction[top:top + strip]).tobytes())
+    return sha.hexdigest()
+
+def load_order(path, digest):
+    """load a cached order if it was computed from the same directions"""
+
+    if not os.path.isfile(path):
+        return None
+    cached = np.load(path)
+    if str(cached['digest']) != digest:
+        return None
+    return cached['order'], cached['levels']
+
+def save_order(path, digest, order, levels):
+    """cache an order on disk"""
+
+    temporary = path + '.tmp.npz'
+    np.savez(temporary, digest=digest, order=order, levels=levels)
+    os.rename(temporary, path)
+
+def threshold_sweep(direction, accumulation, zones, ids, thresholds, nsres, ewres):
+    """measure the streams of several accumulation thresholds in one pass
+
+    Returns the number of thresholds that each cell is a stream for,
+    the cells in each zone, and the stream cells and stream length
+    in each zone for each threshold in ascending order.
+    """
+
+    # count the thresholds that the flow of each cell reaches
+    thresholds = np.sort(np.asarray(thresholds, dtype=np.float64))
+    flow = np.abs(np.asarray(accumulation, dtype=np.float64))
+    levels = np.searchsorted(thresholds,
+        np.where(np.isnan(flow), -np.inf, flow),
+        side='right')
+
+    # length of the flow path through each cell
+    codes = np.abs(np.asarray(direction, dtype=np.int64))
+    length = np.where(codes % 2 == 1, np.hypot(nsres, ewres),
+        np.where((codes == 2) | (codes == 6), nsres,
+            np.where(codes > 0, ewres, 0.0)))
+
+    # sum by zone and level
+    index = zonal.zone_index(zones, ids).ravel()
+    valid = index >= 0
+    count = len(ids)
+    keys = index[valid] * (thresholds.size + 1) + levels.ravel()[valid]
+    shape = (count, thresholds.size + 1)
+    cells = np.bincount(keys, minlength=count * shape[1]).reshape(shape)
+    lengths = np.bincount(keys,
+        weights=length.ravel()[valid],
+        minlength=count * shape[1]).reshape(shape)
+
+    # a cell is a stream for every threshold up to its level
+    stream_cells = np.cumsum(cells[:, ::-1], axis=1)[:, ::-1]
+    stream_lengths = np.cumsum(lengths[:, ::-1], axis=1)[:, ::-1]
+    return levels, stream_cells[:, 0], stream_cells[:, 1:], stream_lengths[:, 1:]
+
+def delineate(receiver, order, levels, outlets):
+    """label the area draining to each outlet in one pass upstream
+
+    Outlets are cell indices. Each cell is labeled with the position of
+    the nearest outlet downstream counting from 1, so catchments of
+    outlets upstream of other outlets are cut out of them as interbasins.
+    Returns the labels of cells, the label of each outlet, and for each
+    label the label that its outlet drains to or 0 if there is none.
+    """
+
+    outlets = np.asarray(outlets, dtype=np.int64)
+    labels = np.zeros(receiver.size, dtype=np.int32)
+    labels[outlets] = np.arange(1, outlets.size + 1)
+
+    # label cells from downstream levels to upstream levels
+    for level in reversed(range(len(levels) - 1)):
+        cells = order[levels[level]:levels[level + 1]]
+        cells = cells[labels[cells] == 0]
+        downstream = receiver[cells]
+        draining = downstream >= 0
+        labels[cells[draining]] = labels[downstream[draining]]
+
+    # outlets in the same cell share the label of the last one
+    outlet_labels = labels[outlets]
+    downstream = receiver[outlets]
+    parents = np.where(downstream >= 0, labels[np.maximum(downstream, 0)], 0)
+    parents[outlet_labels != np.arange(1, outlets.size + 1)] = 0
+    return labels, outlet_labels, parents
+
+def nested_cells(cells, parents):
+    """add the cells of interbasins to every outlet downstream of them"""
+
+    # depth of each outlet in the hierarchy of outlets
+    depth = np.zeros(len(parents), dtype=np.int64)
+    for position in range(len(parents)):
+        parent = parents[position]
+        while parent:
+            depth[position] += 1
+            parent = parents[parent - 1]
+
+    # sum from the deepest outlets down
+    nested = np.array(cells, dtype=np.int64)
+    for position in np.argsort(-depth, kind='mergesort'):
+        if parents[position]:
+            nested[parents[position] - 1] += nested[position]
+    return nested
@@ -0,0 +1,1452 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: in-process numpy stand-in for the GRASS GIS modules of the analysis
+
+Executes the subset of GRASS GIS modules that the analysis calls on numpy
+arrays held in memory, so that stages can run without a GRASS session or
+subprocesses. Install the backend before grass.script is imported,
+for example by setting PANAMA_BACKEND=numpy for panama_analysis.py,
+and every later import of grass.script gets this module instead.
+
+Rasters are stored as float arrays with nan for null cells together with
+their region, type, color rules and categories. Reads are resampled to
+the current region by nearest neighbour and masked by MASK as in GRASS.
+Area vectors are stored as rasters of categories and point vectors as
+lists of coordinates, each with an attribute table.
+
+Supported modules:
+    g.region, g.remove, g.copy, g.rename, g.list, g.findfile, g.proj,
+    r.mapcalc, r.mask, r.recode, r.colors, r.category,
+    r.univar, r.report, r.slope.aspect, r.relief, r.shade,
+    r.to.vect, v.to.rast, v.extract, v.db.join, v.db.select, v.in.ascii
+
+and grass.script.array for reading and writing rasters as arrays.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import re
+import sys
+import math
+import types
+import fnmatch
+import tempfile as _tempfile
+import threading
+import numpy as np
+
+# modules run in this process rather than in subprocesses
+in_process = True
+
+# session state
+gis = dict(GISDBASE=os.getcwd(), LOCATION_NAME='location', MAPSET='PERMANENT')
+projection = dict(wkt='')
+region_state = dict(current=None, saved={})
+rasters = {}
+vectors = {}
+lock = threading.RLock()
+
+class CalledModuleError(Exception):
+    """raised when a module fails"""
+
+    def __init__(self, module, code='', returncode=1, errors=None):
+        self.module = module
+        self.code = code
+        self.returncode = returncode
+        self.errors = errors
+        Exception.__init__(self, 'Module run {module} {code} ended with error: '
+            '{errors}'.format(module=module, code=code, errors=errors))
+
+def install(gisdbase=None, location=None, mapset=None, region=None, wkt=None):
+    """use this backend for every import of grass.script"""
+
+    if gisdbase:
+        gis['GISDBASE'] = gisdbase
+    if location:
+        gis['LOCATION_NAME'] = location
+    if mapset:
+        gis['MAPSET'] = mapset
+    if wkt:
+        projection['wkt'] = wkt
+    region_state['current'] = region or region_state['current'] \
+        or make_region(1, 0, 1, 0, 1, 1)
+
+    # register as the grass packages
+    exceptions = types.ModuleType('grass.exceptions')
+    exceptions.CalledModuleError = CalledModuleError
+    package = sys.modules.get('grass') or types.ModuleType('grass')
+    package.script = sys.modules[__name__]
+    package.exceptions = exceptions
+    sys.modules['grass'] = package
+    sys.modules['grass.script'] = sys.modules[__name__]
+    sys.modules['grass.script.core'] = sys.modules[__name__]
+    sys.modules['grass.exceptions'] = exceptions
+    sys.modules['grass.script.array'] = array
+
+# grass.script api
+
+def gisenv(env=None):
+    """return the session variables"""
+
+    return dict(gis)
+
+def use_temp_region():
+    """regions are held in memory so there is nothing to restore"""
+
+def del_temp_region():
+    """regions are held in memory so there is nothing to restore"""
+
+def message(msg, flag=None):
+    sys.stderr.write(str(msg) + '\n')
+
+def info(msg):
+    message(msg)
+
+def verbose(msg):
+    if os.environ.get('GRASS_VERBOSE', '1') not in ('0', '-1', 'False'):
+        message(msg)
+
+def debug(msg, debug=1):
+    pass
+
+def warning(msg):
+    message('WARNING: ' + str(msg))
+
+def error(msg):
+    message('ERROR: ' + str(msg))
+
+def fatal(msg):
+    error(msg)
+    raise CalledModuleError('fatal', errors=msg)
+
+def tempfile(create=True):
+    """create a temporary file"""
+
+    descriptor, path = _tempfile.mkstemp()
+    os.close(descriptor)
+    if not create:
+        os.remove(path)
+    return path
+
+def run_command(*args, **kwargs):
+    """run a module"""
+
+    dispatch(*args, **kwargs)
+    return 0
+
+def read_command(*args, **kwargs):
+    """run a module and return its output"""
+
+    return dispatch(*args, **kwargs) or ''
+
+def write_command(*args, **kwargs):
+    """run a module with input from stdin"""
+
+    dispatch(*args, **kwargs)
+    return 0
+
+def parse_command(*args, **kwargs):
+    """run a module and parse its key=value output"""
+
+    parse = kwargs.pop('parse', None)
+    delimiter = kwargs.pop('delimiter', None)
+    output = read_command(*args, **kwargs)
+    if parse:
+        return parse[0](output, **parse[1])
+    return parse_key_val(output, sep=delimiter or '=')
+
+def parse_key_val(s, sep='=', dflt=None, val_type=None, vsep=None):
+    """parse key=value lines"""
+
+    result = {}
+    for line in s.splitlines():
+        if not line.strip():
+            continue
+        if sep in line:
+            key, value = line.split(sep, 1)
+        else:
+            key, value = line, dflt
+        key = key.strip()
+        value = value.strip() if value is not None else value
+        result[key] = val_type(value) if val_type and value is not None else value
+    return result
+
+def region(region3d=False, complete=False, env=None):
+    """return the current region"""
+
+    current = active_region(env)
+    return dict(n=current['n'],
+        s=current['s'],
+        e=current['e'],
+        w=current['w'],
+        nsres=current['nsres'],
+        ewres=current['ewres'],
+        rows=current['rows'],
+        cols=current['cols'],
+        cells=current['rows'] * current['cols'])
+
+def region_env(region3d=False, flags=None, env=None, **kwargs):
+    """return a region as a string for GRASS_REGION"""
+
+    with lock:
+        adjusted = adjust_region(active_region(env), **kwargs)
+    return ';'.join('{key}:{value}'.format(key=key, value=adjusted[name])
+        for key, name in [('north', 'n'),
+            ('south', 's'),
+            ('east', 'e'),
+            ('west', 'w'),
+            ('rows', 'rows'),
+            ('cols', 'cols')]) + ';'
+
+def find_file(name, element='cell', mapset=None):
+    """find a map; maps are held in memory so no file is returned"""
+
+    store = vectors if element == 'vector' else rasters
+    with lock:
+        key = resolve(name, store, required=False)
+    if key is None:
+        return dict(name='', mapset='', fullname='', file='')
+    base, map_mapset = key.split('@')
+    return dict(name=base, mapset=map_mapset, fullname=key, file='')
+
+def list_strings(type, pattern=None, mapset=None, exclude=None, flag=''):
+    """list maps as name@mapset"""
+
+    types_ = type if isinstance(type, (list, tuple)) else type.split(',')
+    names = []
+    with lock:
+        for maptype in types_:
+            store = vectors if maptype == 'vector' else rasters
+            for key in sorted(store):
+                base, map_mapset = key.split('@')
+                if mapset not in (None, '', '*') and map_mapset != mapset:
+                    continue
+                if pattern and not fnmatch.fnmatch(base, pattern):
+                    continue
+                if exclude and fnmatch.fnmatch(base, exclude):
+                    continue
+                names.append(key)
+    return names
+
+def list_grouped(type, pattern=None, check_search_path=True, exclude=None, flag=''):
+    """list maps grouped by mapset"""
+
+    grouped = {}
+    for key in list_strings(type, pattern=pattern, exclude=exclude):
+        base, map_mapset = key.split('@')
+        grouped.setdefault(map_mapset, []).append(base)
+    return grouped
+
+# arrays
+
+def write_array(name, array, region=None, integer=None, mapset=None):
+    """store a numpy array as a raster with nan for null cells"""
+
+    array = np.asarray(array)
+    if integer is None:
+        integer = np.issubdtype(array.dtype, np.integer)
+    with lock:
+        region = dict(region or active_region())
+        if array.shape != (region['rows'], region['cols']):
+            raise ValueError('array shape {shape} does not match region'.format(
+                shape=array.shape))
+        store_raster(name, array.astype(np.float64), region, integer, mapset)
+
+def read_array(name, env=None):
+    """read a raster in the current region as a numpy array"""
+
+    with lock:
+        return read_raster(name, active_region(env))
+
+class RasterArray(np.ndarray):
+    """raster in the current region as an array like grass.script.array"""
+
+    def __new__(cls, mapname=None, null=None, dtype=np.double, env=None):
+        current = active_region(env)
+        self = np.zeros((current['rows'], current['cols']), dtype=dtype).view(cls)
+        if mapname:
+            self.read(mapname, null, env=env)
+        return self
+
+    def read(self, mapname, null=None, env=None):
+        """read a raster with null cells set to null or zero"""
+
+        values = read_array(mapname, env=env)
+        self[...] = np.where(np.isnan(values), 0 if null is None else null, values)
+        return 0
+
+    def write(self, mapname, title=None, null=None, overwrite=None):
+        """write the array as a raster with cells equal to null set to null"""
+
+        values = np.asarray(self, dtype=np.float64)
+        if null is not None:
+            values = np.where(values == null, np.nan, values)
+        write_array(mapname, values, integer=self.dtype.kind in 'iu')
+        return 0
+
+# grass.script.array
+array = types.ModuleType('grass.script.array')
+array.array = RasterArray
+
+# regions
+
+def make_region(n, s, e, w, nsres, ewres):
+    """make a region with rows and columns that fit its extent"""
+
+    rows = max(int(round((n - s) / float(nsres))), 1)
+    cols = max(int(round((e - w) / float(ewres))), 1)
+    return dict(n=float(n),
+        s=float(s),
+        e=float(e),
+        w=float(w),
+        rows=rows,
+        cols=cols,
+        nsres=(n - s) / float(rows),
+        ewres=(e - w) / float(cols))
+
+def parse_region(text):
+    """parse a region from GRASS_REGION"""
+
+    values = {}
+    for item in text.split(';'):
+        if ':' in item:
+            key, value = item.split(':', 1)
+            values[key.strip()] = value.strip()
+    n = float(values['north'])
+    s = float(values['south'])
+    e = float(values['east'])
+    w = float(values['west'])
+    if 'rows' in values:
+        return make_region(n, s, e, w,
+            (n - s) / float(values['rows']),
+            (e - w) / float(values['cols']))
+    return make_region(n, s, e, w,
+        float(values['n-s resol']),
+        float(values['e-w resol']))
+
+def active_region(env=None):
+    """return the region set by GRASS_REGION or the current region"""
+
+    env = env if env is not None else os.environ
+    if env.get('GRASS_REGION'):
+        return parse_region(env['GRASS_REGION'])
+    return region_state['current']
+
+def adjust_region(current, **kwargs):
+    """compute a region like g.region"""
+
+    n, s, e, w = current['n'], current['s'], current['e'], current['w']
+    nsres, ewres = current['nsres'], current['ewres']
+    flags = kwargs.get('flags') or ''
+
+    # start from a saved region, a raster, or a vector
+    if kwargs.get('region'):
+        saved = region_state['saved'][kwargs['region']]
+        n, s, e, w = saved['n'], saved['s'], saved['e'], saved['w']
+        nsres, ewres = saved['nsres'], saved['ewres']
+    if kwargs.get('raster'):
+        extent = rasters[resolve(split_names(kwargs['raster'])[0], rasters)]['region']
+        n, s, e, w = extent['n'], extent['s'], extent['e'], extent['w']
+        nsres, ewres = extent['nsres'], extent['ewres']
+    if kwargs.get('vector'):
+        n, s, e, w = vector_extent(split_names(kwargs['vector'])[0])
+
+    # set extent and resolution
+    n = float(kwargs.get('n', n))
+    s = float(kwargs.get('s', s))
+    e = float(kwargs.get('e', e))
+    w = float(kwargs.get('w', w))
+    if 'res' in kwargs:
+        nsres = ewres = float(kwargs['res'])
+    nsres = float(kwargs.get('nsres', nsres))
+    ewres = float(kwargs.get('ewres', ewres))
+
+    # align extent to resolution
+    if 'a' in flags:
+        n = math.ceil(n / nsres) * nsres
+        s = math.floor(s / nsres) * nsres
+        e = math.ceil(e / ewres) * ewres
+        w = math.floor(w / ewres) * ewres
+    if n <= s or e <= w:
+        n, e = max(n, s + nsres), max(e, w + ewres)
+    return make_region(n, s, e, w, nsres, ewres)
+
+def cell_centers(current):
+    """compute the coordinates of cell centers"""
+
+    x = current['w'] + (np.arange(current['cols']) + 0.5) * current['ewres']
+    y = current['n'] - (np.arange(current['rows']) + 0.5) * current['nsres']
+    return x, y
+
+def shell_region(current):
+    """format a region like g.region -g"""
+
+    return ''.join('{key}={value}\n'.format(key=key, value=value)
+        for key, value in [('n', current['n']),
+            ('s', current['s']),
+            ('w', current['w']),
+            ('e', current['e']),
+            ('nsres', current['nsres']),
+            ('ewres', current['ewres']),
+            ('rows', current['rows']),
+            ('cols', current['cols']),
+            ('cells', current['rows'] * current['cols'])])
+
+# maps
+
+def split_names(value):
+    """split a list option"""
+
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return [item for item in str(value).split(',') if item]
+
+def resolve(name, store, required=True):
+    """find a map in the current mapset or PERMANENT"""
+
+    if '@' in name:
+        key = name
+    else:
+        key = None
+        for search in [gis['MAPSET'], 'PERMANENT']:
+            if name + '@' + search in store:
+                key = name + '@' + search
+                break
+    if key in store:
+        return key
+    if required:
+        raise CalledModuleError('g.findfile',
+            errors='map <{name}> not found'.format(name=name))
+    return None
+
+def output_key(name):
+    """name a map written to the current mapset"""
+
+    if '@' in name:
+        raise CalledModuleError('g.findfile',
+            errors='<{name}> is not a legal output name'.format(name=name))
+    return name + '@' + gis['MAPSET']
+
+def store_raster(name, array, current, integer, mapset=None, overwrite=True):
+    """store a raster in the current mapset"""
+
+    key = name + '@' + mapset if mapset else output_key(name)
+    if key in rasters and not overwrite:
+        raise CalledModuleError('r.mapcalc',
+            errors='<{name}> already exists'.format(name=name))
+    if integer:
+        array = np.where(np.isnan(array), np.nan, np.trunc(array))
+    rasters[key] = dict(array=array,
+        region=dict(current),
+        integer=bool(integer),
+        colors=None,
+        categories={},
+        rgb=None)
+    return rasters[key]
+
+def read_raster(name, current, masked=True):
+    """read a raster resampled to a region by nearest neighbour"""
+
+    record = rasters[resolve(name, rasters)]
+    source = record['region']
+    x, y = cell_centers(current)
+    columns = np.floor((x - source['w']) / source['ewres']).astype(int)
+    rows = np.floor((source['n'] - y) / source['nsres']).astype(int)
+    valid_columns = (columns >= 0) & (columns < source['cols'])
+    valid_rows = (rows >= 0) & (rows < source['rows'])
+    array = record['array'][np.clip(rows, 0, source['rows'] - 1)[:, None],
+        np.clip(columns, 0, source['cols'] - 1)[None, :]]
+    array = np.where(valid_rows[:, None] & valid_columns[None, :], array, np.nan)
+
+    # apply mask
+    mask_key = 'MASK@' + gis['MAPSET']
+    if masked and mask_key in rasters and resolve(name, rasters) != mask_key:
+        mask = read_raster(mask_key, current, masked=False)
+        array = np.where(np.isnan(mask) | (mask == 0), np.nan, array)
+    return array
+
+def raster_record(name):
+    """return the stored record of a raster"""
+
+    return rasters[resolve(name, rasters)]
+
+def vector_extent(name):
+    """compute the extent of a vector"""
+
+    record = vectors[resolve(name, vectors)]
+    if record['kind'] == 'point':
+        xs = [point[0] for point in record['points']]
+        ys = [point[1] for point in record['points']]
+        return max(ys), min(ys), max(xs), min(xs)
+    current = record['region']
+    filled = ~np.isnan(record['array'])
+    if not filled.any():
+        raise CalledModuleError('g.region',
+            errors='vector <{name}> is empty'.format(name=name))
+    rows = np.where(filled.any(axis=1))[0]
+    columns = np.where(filled.any(axis=0))[0]
+    return (current['n'] - rows[0] * current['nsres'],
+        current['n'] - (rows[-1] + 1) * current['nsres'],
+        current['w'] + (columns[-1] + 1) * current['ewres'],
+        current['w'] + columns[0] * current['ewres'])
+
+# raster map algebra
+
+class Value(object):
+    """raster values with null as nan and grass integer semantics"""
+
+    def __init__(self, data, integer):
+        self.data = np.asarray(data, dtype=np.float64)
+        self.integer = integer
+
+    def binary(self, other, function, integer=None):
+        other = value(other)
+        if integer is None:
+            integer = self.integer and other.integer
+        with np.errstate(all='ignore'):
+            return Value(function(self.data, other.data), integer)
+
+    def compare(self, other, function):
+        other = value(other)
+        with np.errstate(invalid='ignore'):
+            result = np.where(np.isnan(self.data + other.data), np.nan,
+                function(self.data, other.data))
+        return Value(result, True)
+
+    def __add__(self, other):
+        return self.binary(other, np.add)
+
+    def __radd__(self, other):
+        return value(other) + self
+
+    def __sub__(self, other):
+        return self.binary(other, np.subtract)
+
+    def __rsub__(self, other):
+        return value(other) - self
+
+    def __mul__(self, other):
+        return self.binary(other, np.multiply)
+
+    def __rmul__(self, other):
+        return value(other) * self
+
+    def __truediv__(self, other):
+        other = value(other)
+        if self.integer and other.integer:
+            # integer division truncates toward zero
+            return self.binary(other, lambda a, b: np.where(b == 0, np.nan, np.trunc(a / b)))
+        return self.binary(other, lambda a, b: np.where(b == 0, np.nan, a / b))
+
+    __div__ = __truediv__
+
+    def __rtruediv__(self, other):
+        return value(other) / self
+
+    __rdiv__ = __rtruediv__
+
+    def __mod__(self, other):
+        return self.binary(other, lambda a, b: np.where(b == 0, np.nan, np.fmod(a, b)))
+
+    def __rmod__(self, other):
+        return value(other) % self
+
+    def __pow__(self, other):
+        return self.binary(other, np.power)
+
+    def __rpow__(self, other):
+        return value(other) ** self
+
+    def __neg__(self):
+        return Value(-self.data, self.integer)
+
+    def __pos__(self):
+        return self
+
+    def __invert__(self):
+        return Value(np.where(np.isnan(self.data), np.nan, self.data == 0), True)
+
+    def __and__(self, other):
+        return self.compare(other, lambda a, b: (a != 0) & (b != 0))
+
+    def __or__(self, other):
+        return self.compare(other, lambda a, b: (a != 0) | (b != 0))
+
+    def __eq__(self, other):
+        return self.compare(other, np.equal)
+
+    def __ne__(self, other):
+        return self.compare(other, np.not_equal)
+
+    def __lt__(self, other):
+        return self.compare(other, np.less)
+
+    def __le__(self, other):
+        return self.compare(other, np.less_equal)
+
+    def __gt__(self, other):
+        return self.compare(other, np.greater)
+
+    def __ge__(self, other):
+        return self.compare(other, np.greater_equal)
+
+    __hash__ = None
+
+def value(item):
+    """wrap a number as a raster value"""
+
+    if isinstance(item, Value):
+        return item
+    return Value(item, isinstance(item, int) and not isinstance(item, bool))
+
+def bitwise(function):
+    """apply a bitwise operation to the integer parts of raster values"""
+
+    def operation(a, b):
+        a, b = value(a), value(b)
+        null = np.isnan(a.data + b.data)
+        result = function(np.trunc(np.where(null, 0, a.data)).astype(np.int64),
+            np.trunc(np.where(null, 0, b.data)).astype(np.int64))
+        return Value(np.where(null, np.nan, result), True)
+    return operation
+
+def mapcalc_functions(current):
+    """functions available in map algebra"""
+
+    x, y = cell_centers(current)
+    shape = (current['rows'], current['cols'])
+
+    def condition(test, then=1, otherwise=0, negative=None):
+        test, then, otherwise = value(test), value(then), value(otherwise)
+        result = np.where(test.data != 0, then.data, otherwise.data)
+        integer = then.integer and otherwise.integer
+        if negative is not None:
+            negative = value(negative)
+            result = np.where(test.data < 0, negative.data, result)
+            integer = integer and negative.integer
+        result = np.where(np.isnan(test.data), np.nan, result)
+        return Value(result, integer)
+
+    def unary(function, integer=False):
+        return lambda item: Value(function(value(item).data), integer)
+
+    def extreme(function):
+        return lambda *items: Value(function([np.broadcast_to(value(item).data, shape)
+            for item in items], axis=0),
+            all(value(item).integer for item in items))
+
+    def arctangent(a, b=None):
+        if b is None:
+            return Value(np.degrees(np.arctan(value(a).data)), False)
+        angle = np.degrees(np.arctan2(value(b).data, value(a).data))
+        return Value(np.where(angle < 0, angle + 360, angle), False)
+
+    return {
+        'if': condition,
+        'isnull': lambda item: Value(np.isnan(np.broadcast_to(value(item).data, shape)), True),
+        'null': lambda: Value(np.full(shape, np.nan), True),
+        'row': lambda: Value(np.broadcast_to(np.arange(1, shape[0] + 1)[:, None], shape), True),
+        'col': lambda: Value(np.broadcast_to(np.arange(1, shape[1] + 1)[None, :], shape), True),
+        'x': lambda: Value(np.broadcast_to(x[None, :], shape), False),
+        'y': lambda: Value(np.broadcast_to(y[:, None], shape), False),
+        'nrows': lambda: Value(shape[0], True),
+        'ncols': lambda: Value(shape[1], True),
+        'ewres': lambda: Value(current['ewres'], False),
+        'nsres': lambda: Value(current['nsres'], False),
+        'sin': unary(lambda a: np.sin(np.radians(a))),
+        'cos': unary(lambda a: np.cos(np.radians(a))),
+        'tan': unary(lambda a: np.tan(np.radians(a))),
+        'atan': arctangent,
+        'sqrt': unary(np.sqrt),
+        'exp': unary(np.exp),
+        'log': unary(np.log),
+        'abs': lambda item: Value(np.abs(value(item).data), value(item).integer),
+        'int': unary(np.trunc, integer=True),
+        'round': unary(lambda a: np.sign(a) * np.floor(np.abs(a) + 0.5), integer=True),
+        'float': unary(lambda a: a),
+        'double': unary(lambda a: a),
+        'min': extreme(np.min),
+        'max': extreme(np.max),
+        'pow': lambda a, b: value(a) ** value(b),
+        }
+
+token_pattern = re.compile(r'\s*(?:'
+    r'(?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)'
+    r'|(?P<name>[A-Za-z_][\w.]*(?:@[\w.]+)?)'
+    r'|(?P<string>"[^"]*")'
+    r'|(?P<op>&&|\|\||==|!=|<=|>=|[-+*/%()<>!,^&|]))')
+
+# binary operators of map algebra from the lowest precedence to the highest
+# with the python operators or functions of raster values
+binary_operators = [{'||': '|'},
+    {'&&': '&'},
+    {'|': '_bitwise_or'},
+    {'&': '_bitwise_and'},
+    {'==': '==', '!=': '!='},
+    {'<': '<', '<=': '<=', '>': '>', '>=': '>='},
+    {'+': '+', '-': '-'},
+    {'*': '*', '/': '/', '%': '%'},
+    {'^': '**'}]
+
+# unary operators which bind tighter than any binary operator
+unary_operators = {'-': '-', '+': '+', '!': '~'}
+
+def translate(expression):
+    """translate a map algebra expression to python
+
+    Every operation is parenthesized so that map algebra precedence is
+    kept where it differs from python, as for && and || which become
+    the bitwise operators of raster values.
+    """
+
+    expression = expression.strip()
+
+    def syntax_error():
+        return CalledModuleError('r.mapcalc',
+            errors='syntax error in {expression}'.format(expression=expression))
+
+    tokens = []
+    position = 0
+    while position < len(expression):
+        match = token_pattern.match(expression, position)
+        if not match or match.end() == position:
+            raise syntax_error()
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    tokens.append(('end', None))
+
+    def binary(position, level):
+        if level == len(binary_operators):
+            return unary(position)
+        operators = binary_operators[level]
+        left, position = binary(position, level + 1)
+        while tokens[position][0] == 'op' and tokens[position][1] in operators:
+            operator = operators[tokens[position][1]]
+            # exponents are right associative
+            right, position = binary(position + 1,
+                level if operator == '**' else level + 1)
+            # bitwise operators are functions of raster values
+            template = '{operator}({left}, {right})' if operator.startswith('_') \
+                else '({left} {operator} {right})'
+            left = template.format(left=left,
+                operator=operator,
+                right=right)
+        return left, position
+
+    def unary(position):
+        kind, text = tokens[position]
+        if kind == 'op' and text in unary_operators:
+            operand, position = unary(position + 1)
+            return '({operator}{operand})'.format(operator=unary_operators[text],
+                operand=operand), position
+        return primary(position)
+
+    def primary(position):
+        kind, text = tokens[position]
+        if kind == 'number':
+            return '_value({text})'.format(text=text), position + 1
+        if kind == 'string':
+            raise CalledModuleError('r.mapcalc',
+                errors='strings are not supported in map algebra')
+        if kind == 'name' and tokens[position + 1][1] == '(':
+            arguments = []
+            position += 2
+            if tokens[position][1] != ')':
+                while True:
+                    argument, position = binary(position, 0)
+                    arguments.append(argument)
+                    if tokens[position][1] != ',':
+                        break
+                    position += 1
+            if tokens[position][1] != ')':
+                raise syntax_error()
+            return '_function_{name}({arguments})'.format(name=text,
+                arguments=', '.join(arguments)), position + 1
+        if kind == 'name':
+            return '_map({name!r})'.format(name=text), position + 1
+        if text == '(':
+            inner, position = binary(position + 1, 0)
+            if tokens[position][1] != ')':
+                raise syntax_error()
+            return inner, position + 1
+        raise syntax_error()
+
+    python, position = binary(0, 0)
+    if tokens[position][0] != 'end':
+        raise syntax_error()
+    return python
+
+def mapcalc(statements, overwrite=True, env=None):
+    """evaluate map algebra statements in one pass"""
+
+    current = active_region(env)
+    namespace = dict(('_function_' + name, function)
+        for name, function in mapcalc_functions(current).items())
+    namespace['_value'] = value
+    namespace['_bitwise_and'] = bitwise(np.bitwise_and)
+    namespace['_bitwise_or'] = bitwise(np.bitwise_or)
+    namespace['_map'] = lambda name: Value(read_raster(name, current),
+        raster_record(name)['integer'])
+
+    # evaluate every statement before writing outputs
+    results = []
+    for statement in statements:
+        if '=' not in statement:
+            raise CalledModuleError('r.mapcalc',
+                errors='expected name = expression: {statement}'.format(
+                    statement=statement))
+        name, expression = statement.split('=', 1)
+        try:
+            result = eval(translate(expression), {'__builtins__': {}}, namespace)
+        except (SyntaxError, TypeError, NameError) as error:
+            raise CalledModuleError('r.mapcalc', errors=str(error))
+        result = value(result)
+        array = np.broadcast_to(result.data, (current['rows'], current['cols']))
+        results.append((name.strip(), np.array(array), result.integer))
+    for name, array, integer in results:
+        store_raster(name, array, current, integer, overwrite=overwrite)
+
+def split_statements(text):
+    """split map algebra into statements"""
+
+    return [statement.strip() for statement in re.split(r'[;\n]', text)
+        if statement.strip() and not statement.strip().startswith('#')]
+
+# colors and categories
+
+named_colors = {
+    'white': (255, 255, 255),
+    'black': (0, 0, 0),
+    'red': (255, 0, 0),
+    'green': (0, 255, 0),
+    'blue': (0, 0, 255),
+    'yellow': (255, 255, 0),
+    'cyan': (0, 255, 255),
+    'aqua': (100, 128, 255),
+    'magenta': (255, 0, 255),
+    'orange': (255, 128, 0),
+    'brown': (180, 77, 25),
+    'purple': (128, 0, 255),
+    'violet': (255, 0, 255),
+    'indigo': (0, 128, 255),
+    'grey': (128, 128, 128),
+    'gray': (128, 128, 128),
+    }
+
+# color tables as (percent, color) rules
+color_tables = {
+    'grey': [(0, (0, 0, 0)), (100, (255, 255, 255))],
+    'gray': [(0, (0, 0, 0)), (100, (255, 255, 255))],
+    'elevation': [(0, (0, 191, 191)),
+        (20, (0, 255, 0)),
+        (40, (255, 255, 0)),
+        (60, (255, 127, 0)),
+        (80, (191, 127, 63)),
+        (100, (200, 200, 200))],
+    'water': [(0, (240, 255, 255)), (100, (0, 0, 255))],
+    }
+
+def parse_color(text):
+    """parse a color as r:g:b or a name"""
+
+    text = text.strip()
+    if text in named_colors:
+        return named_colors[text]
+    parts = re.split(r'[:\s]+', text)
+    return tuple(int(part) for part in parts[:3])
+
+def parse_color_rules(lines):
+    """parse color rules into (value or percent, is percent, color) rules"""
+
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or line == 'end':
+            continue
+        key, color = line.split(None, 1)
+        if key in ('nv', 'default'):
+            continue
+        if key.endswith('%'):
+            rules.append((float(key[:-1]), True, parse_color(color)))
+        else:
+            rules.append((float(key), False, parse_color(color)))
+    return rules
+
+def color_rules(record):
+    """return the color rules of a raster as (value, color) pairs"""
+
+    rules = record['colors']
+    if rules is None:
+        rules = [(percent, True, color) for percent, color in color_tables['grey']]
+    data = record['array'][~np.isnan(record['array'])]
+    low, high = (data.min(), data.max()) if data.size else (0.0, 1.0)
+    resolved = []
+    for key, is_percent, color in rules:
+        if is_percent:
+            key = low + (high - low) * key / 100.0
+        resolved.append((key, color))
+    return sorted(resolved)
+
+def colorize(record, array):
+    """look up the colors of raster values as rgb arrays"""
+
+    rules = color_rules(record)
+    keys = np.array([rule[0] for rule in rules])
+    channels = [np.interp(array, keys, np.array([rule[1][channel] for rule in rules]))
+        for channel in range(3)]
+    rgb = np.stack(channels, axis=-1)
+    rgb[np.isnan(array)] = np.nan
+    return rgb
+
+def parse_categories(lines, separator):
+    """parse category rules"""
+
+    categories = {}
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        key, label = line.split(separator, 1)
+        categories[int(float(key.split(':')[0]))] = label.strip()
+    return categories
+
+def separator_character(name):
+    """convert a separator option to a character"""
+
+    return {'pipe': '|',
+        'comma': ',',
+        'space': ' ',
+        'tab': '\t',
+        'newline': '\n'}.get(name, name)
+
+def read_rules(rules, stdin=None):
+    """read rules from a file or stdin"""
+
+    if rules == '-':
+        return (stdin or '').splitlines()
+    with open(rules) as rules_file:
+        return rules_file.read().splitlines()
+
+# terrain
+
+def neighbours(array):
+    """return the 3x3 neighbours of each cell with nan at the edges"""
+
+    padded = np.pad(array, 1, mode='constant', constant_values=np.nan)
+    rows, columns = array.shape
+    return [padded[row:row + rows, column:column + columns]
+        for row in range(3) for column in range(3)]
+
+def horn_gradient(array, current, zscale=1.0):
+    """compute east and north differences with horn's method like grass"""
+
+    c1, c2, c3, c4, c5, c6, c7, c8, c9 = neighbours(array * zscale)
+    dx = ((c1 + c4 + c4 + c7) - (c3 + c6 + c6 + c9)) / (8 * current['ewres'])
+    dy = ((c7 + c8 + c8 + c9) - (c1 + c2 + c2 + c3)) / (8 * current['nsres'])
+    return dx, dy
+
+# modules
+
+def module_g_region(options, env, stdin):
+    flags = options.get('flags') or ''
+    adjusted = adjust_region(active_region(env), **options)
+    if options.get('save'):
+        region_state['saved'][options['save']] = adjusted
+    if 'u' not in flags and not env.get('GRASS_REGION'):
+        region_state['current'] = adjusted
+    if 'g' in flags or 'p' in flags:
+        return shell_region(adjusted)
+
+def module_g_remove(options, env, stdin):
+    store = vectors if options.get('type') == 'vector' else rasters
+    for name in split_names(options.get('name', '')):
+        key = resolve(name, store, required=False)
+        if key is not None:
+            del store[key]
+
+def module_g_copy(options, env, stdin):
+    for maptype, store in [('raster', rasters), ('vector', vectors)]:
+        if options.get(maptype):
+            source, target = split_names(options[maptype])
+            key = output_key(target)
+            if key in store and not options.get('overwrite'):
+                raise CalledModuleError('g.copy',
+                    errors='<{name}> exists'.format(name=target))
+            store[key] = copy_record(store[resolve(source, store)])
+
+def module_g_rename(options, env, stdin):
+    for maptype, store in [('raster', rasters), ('vector', vectors)]:
+        if options.get(maptype):
+            source, target = split_names(options[maptype])
+            store[output_key(target)] = store.pop(resolve(source, store))
+
+def module_g_list(options, env, stdin):
+    names = list_strings(options.get('type', 'raster'),
+        pattern=options.get('pattern'),
+        mapset=options.get('mapset'))
+    if 'm' not in (options.get('flags') or ''):
+        names = [name.split('@')[0] for name in names]
+    return '\n'.join(names) + ('\n' if names else '')
+
+def module_g_findfile(options, env, stdin):
+    found = find_file(options['file'], element=options.get('element', 'cell'))
+    return ''.join('{key}={value}\n'.format(key=key, value=found[key])
+        for key in ['name', 'mapset', 'fullname', 'file'])
+
+def module_g_proj(options, env, stdin):
+    if 'w' not in (options.get('flags') or ''):
+        raise CalledModuleError('g.proj', errors='only wkt output is supported')
+    return projection['wkt'] + '\n'
+
+def module_r_mapcalc(options, env, stdin):
+    if options.get('file'):
+        text = stdin if options['file'] == '-' else open(options['file']).read()
+    else:
+        text = options['expression']
+    mapcalc(split_statements(text or ''),
+        overwrite=options.get('overwrite', True),
+        env=env)
+
+def module_r_mask(options, env, stdin):
+    flags = options.get('flags') or ''
+    mask_key = 'MASK@' + gis['MAPSET']
+    if 'r' in flags:
+        if mask_key not in rasters:
+            raise CalledModuleError('r.mask', errors='no existing MASK to remove')
+        del rasters[mask_key]
+        return
+    current = active_region(env)
+    if options.get('vector'):
+        array = rasterize(options['vector'], current)
+    else:
+        array = read_raster(options['raster'], current, masked=False)
+    mask = np.where(np.isnan(array), np.nan, 1.0)
+    if 'i' in flags:
+        mask = np.where(np.isnan(mask), 1.0, np.nan)
+    store_raster('MASK', mask, current, True)
+
+def module_r_recode(options, env, stdin):
+    current = active_region(env)
+    array = read_raster(options['input'], current)
+    output = np.full(array.shape, np.nan)
+    integer = 'd' not in (options.get('flags') or '')
+    for line in read_rules(options['rules'], stdin):
+        line = line.strip()
+        if not line or line.startswith('#') or line == 'end':
+            continue
+        parts = [float(part) if part != '*' else None for part in line.split(':')]
+        low, high = parts[0], parts[1]
+        new_low = parts[2]
+        new_high = parts[3] if len(parts) > 3 else new_low
+        low = np.nanmin(array) if low is None else low
+        high = np.nanmax(array) if high is None else high
+        within = (array >= low) & (array <= high) & np.isnan(output)
+        if high == low:
+            recoded = np.full(array.shape, new_low)
+        else:
+            recoded = new_low + (array - low) * (new_high - new_low) / (high - low)
+        output = np.where(within, recoded, output)
+    store_raster(options['output'], output, current, integer)
+
+def module_r_colors(options, env, stdin):
+    flags = options.get('flags') or ''
+    for name in split_names(options['map']):
+        record = raster_record(name)
+        if 'r' in flags:
+            record['colors'] = None
+        elif options.get('raster'):
+            record['colors'] = raster_record(options['raster'])['colors']
+        elif options.get('rules'):
+            record['colors'] = parse_color_rules(read_rules(options['rules'], stdin))
+        elif options.get('color'):
+            record['colors'] = [(percent, True, color)
+                for percent, color in color_tables[options['color']]]
+
+def module_r_category(options, env, stdin):
+    record = raster_record(options['map'])
+    if options.get('raster'):
+        record['categories'] = dict(raster_record(options['raster'])['categories'])
+    elif options.get('rules'):
+        record['categories'] = parse_categories(read_rules(options['rules'], stdin),
+            separator_character(options.get('separator', 'tab')))
+    else:
+        array = record['array']
+        values = np.unique(array[~np.isnan(array)]).astype(int)
+        separator = separator_character(options.get('separator', 'tab'))
+        return ''.join('{value}{separator}{label}\n'.format(value=item,
+            separator=separator,
+            label=record['categories'].get(item, '')) for item in values)
+
+def module_r_univar(options, env, stdin):
+    current = active_region(env)
+    values = np.concatenate([read_raster(name, current).ravel()
+        for name in split_names(options['map'])])
+    cells = values.size
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return 'n=0\nnull_cells={cells}\ncells={cells}\n'.format(cells=cells)
+    mean = values.mean()
+    variance = values.var()
+    statistics = [('n', values.size),
+        ('null_cells', cells - values.size),
+        ('cells', cells),
+        ('min', values.min()),
+        ('max', values.max()),
+        ('range', values.max() - values.min()),
+        ('mean', mean),
+        ('mean_of_abs', np.abs(values).mean()),
+        ('stddev', math.sqrt(variance)),
+        ('variance', variance),
+        ('coeff_var', 100 * math.sqrt(variance) / mean if mean else float('nan')),
+        ('sum', values.sum())]
+    if 'e' in (options.get('flags') or ''):
+        statistics.extend([('first_quartile', np.percentile(values, 25)),
+            ('median', np.median(values)),
+            ('third_quartile', np.percentile(values, 75))])
+    return ''.join('{key}={value}\n'.format(key=key, value=repr(float(item))
+        if not isinstance(item, int) else item) for key, item in statistics)
+
+def module_r_report(options, env, stdin):
+    current = active_region(env)
+    name = split_names(options['map'])[0]
+    record = raster_record(name)
+    array = read_raster(name, current)
+    units = split_names(options.get('units', 'me,p'))
+    cell_area = current['nsres'] * current['ewres']
+    nulls = 'n' not in (options.get('flags') or '')
+
+    # count cells in each category
+    values = array[~np.isnan(array)].astype(int)
+    categories, counts = np.unique(values, return_counts=True)
+    rows = [(str(category), record['categories'].get(category, ''), count)
+        for category, count in zip(categories, counts)]
+    null_count = int(np.isnan(array).sum())
+    if nulls and null_count:
+        rows.append(('*', 'no data', null_count))
+    total = sum(row[2] for row in rows)
+
+    # format table
+    columns = {'me': 'square meters',
+        'k': 'square kilometers',
+        'h': 'hectares',
+        'c': 'cell counts',
+        'p': '%'}
+    header = ['#', 'description'] + [columns.get(unit, unit) for unit in units]
+    lines = ['|'.join([''] + header + [''])]
+    for category, label, count in rows + [('', 'TOTAL', total)]:
+        cells = [category, label]
+        for unit in units:
+            cells.append({'me': '{0:.6f}'.format(count * cell_area),
+                'k': '{0:.6f}'.format(count * cell_area / 1e6),
+                'h': '{0:.6f}'.format(count * cell_area / 1e4),
+                'c': str(count),
+                'p': '{0:.2f}'.format(100.0 * count / total if total else 0)}.get(unit, ''))
+        lines.append('|'.join([''] + cells + ['']))
+    report = 'RASTER MAP CATEGORY REPORT\nLAYER: {name}\n'.format(name=name) \
+        + '\n'.join(lines) + '\n'
+    if options.get('output'):
+        with open(options['output'], 'w') as output:
+            output.write(report)
+        return
+    return report
+
+def module_r_slope_aspect(options, env, stdin):
+    current = active_region(env)
+    elevation = read_raster(options['elevation'], current)
+    dx, dy = horn_gradient(elevation, current, float(options.get('zscale', 1)))
+    key = dx * dx + dy * dy
+    if options.get('slope'):
+        if options.get('format') == 'percent':
+            slope = 100 * np.sqrt(key)
+        else:
+            slope = np.degrees(np.arctan(np.sqrt(key)))
+        store_raster(options['slope'], slope, current, False)
+    if options.get('aspect'):
+        with np.errstate(invalid='ignore'):
+            aspect = np.degrees(np.arctan2(dy, dx))
+        aspect = np.where(aspect <= 0, aspect + 360, aspect)
+        aspect = np.where(dx == 0, np.where(dy > 0, 90.0, 270.0), aspect)
+        aspect = np.where(key == 0, 0.0, aspect)
+        aspect[np.isnan(key)] = np.nan
+        store_raster(options['aspect'], aspect, current, False)
+
+def module_r_relief(options, env, stdin):
+    current = active_region(env)
+    elevation = read_raster(options['input'], current)
+    altitude = math.radians(float(options.get('altitude', 30)))
+    azimuth = math.radians(float(options.get('azimuth', 270)))
+    scale = float(options.get('scale', 1))
+    dx, dy = horn_gradient(elevation, current, float(options.get('zscale', 1)) / scale)
+
+    # illuminate with the sun at an azimuth clockwise from north
+    slope = np.pi / 2 - np.arctan(np.sqrt(dx * dx + dy * dy))
+    aspect = np.arctan2(dy, dx)
+    sun = np.pi / 2 - azimuth
+    illumination = np.sin(altitude) * np.sin(slope) \
+        + np.cos(altitude) * np.cos(slope) * np.cos(sun - aspect)
+    relief = np.clip(np.floor(255 * illumination), 0, 255)
+    record = store_raster(options['output'], relief, current, True)
+    record['colors'] = [(0, False, (0, 0, 0)), (255, False, (255, 255, 255))]
+
+def module_r_shade(options, env, stdin):
+    current = active_region(env)
+    shade_record = raster_record(options['shade'])
+    color_record = raster_record(options['color'])
+    shade = colorize(shade_record, read_raster(options['shade'], current))
+    color = colorize(color_record, read_raster(options['color'], current))
+
+    # modulate color by the brightened intensity of the shade
+    brighten = float(options.get('brighten', 0))
+    intensity = np.mean(shade, axis=-1, keepdims=True) / 255.0
+    intensity = np.clip(intensity * (100 + brighten) / 100.0, 0, 1)
+    rgb = np.clip(np.round(color * intensity), 0, 255)
+    null = np.isnan(rgb).any(axis=-1)
+    packed = np.where(null, np.nan,
+        np.nan_to_num(rgb[..., 0]) * 65536
+        + np.nan_to_num(rgb[..., 1]) * 256
+        + np.nan_to_num(rgb[..., 2]))
+    record = store_raster(options['output'], packed, current, True)
+    record['rgb'] = np.where(null[..., None], 0, np.nan_to_num(rgb)).astype(np.uint8)
+
+def module_r_to_vect(options, env, stdin):
+    if options.get('type', 'point') != 'area':
+        raise CalledModuleError('r.to.vect', errors='only areas are supported')
+    current = active_region(env)
+    record = raster_record(options['input'])
+    array = read_raster(options['input'], current)
+    values = np.unique(array[~np.isnan(array)]).astype(int)
+    table = dict((int(item), dict(cat=int(item),
+        value=int(item),
+        label=record['categories'].get(int(item), ''))) for item in values)
+    vectors[output_key(options['output'])] = dict(kind='area',
+        array=np.where(np.isnan(array), np.nan, np.trunc(array)),
+        region=dict(current),
+        table=table)
+
+def module_v_to_rast(options, env, stdin):
+    current = active_region(env)
+    array = rasterize(options['input'], current,
+        use=options.get('use', 'attr'),
+        value_=float(options.get('value', 1)),
+        column=options.get('attribute_column'))
+    store_raster(options['output'], array, current, True)
+
+def module_v_extract(options, env, stdin):
+    record = vectors[resolve(options['input'], vectors)]
+    cats = set(record['table'])
+    if options.get('cats'):
+        cats &= set(expand_cats(options['cats']))
+    if options.get('where'):
+        cats &= set(select_where(record['table'], options['where']))
+    extracted = copy_record(record)
+    extracted['table'] = dict((cat, dict(record['table'][cat])) for cat in cats)
+    if record['kind'] == 'area':
+        extracted['array'] = np.where(np.isin(record['array'], list(cats)),
+            record['array'], np.nan)
+    else:
+        extracted['points'] = [point for point in record['points'] if point[2] in cats]
+    vectors[output_key(options['output'])] = extracted
+
+def module_v_db_join(options, env, stdin):
+    record = vectors[resolve(options['map'], vectors)]
+    other = vectors[resolve(options['other_table'], vectors)]['table']
+    lookup = dict((row[options['other_column']], row) for row in other.values())
+    subset = split_names(options['subset_columns']) if options.get('subset_columns') else None
+    for row in record['table'].values():
+        match = lookup.get(row.get(options['column']))
+        for column, item in (match or {}).items():
+            if column == options['other_column'] or (subset and column not in subset):
+                continue
+            row[column] = item
+
+def module_v_db_select(options, env, stdin):
+    record = vectors[resolve(options['map'], vectors)]
+    separator = separator_character(options.get('separator', 'pipe'))
+    rows = [record['table'][cat] for cat in sorted(record['table'])]
+    if options.get('where'):
+        cats = set(select_where(record['table'], options['where']))
+        rows = [row for row in rows if row['cat'] in cats]
+    if options.get('columns'):
+        columns = split_names(options['columns'])
+    else:
+        columns = sorted(set(column for row in rows for column in row))
+    lines = [] if 'c' in (options.get('flags') or '') else [separator.join(columns)]
+    lines.extend(separator.join(str(row.get(column, '')) for column in columns)
+        for row in rows)
+    return '\n'.join(lines) + '\n'
+
+def module_v_in_ascii(options, env, stdin):
+    if options.get('format', 'point') != 'point':
+        raise CalledModuleError('v.in.ascii', errors='only points are supported')
+    text = stdin if options.get('input', '-') == '-' else open(options['input']).read()
+    separator = separator_character(options.get('separator', 'pipe'))
+    x_column = int(options.get('x', 1)) - 1
+    y_column = int(options.get('y', 2)) - 1
+    cat_column = int(options.get('cat', 0)) - 1
+    names = [column.strip().split()[0]
+        for column in options.get('columns', '').split(',') if column.strip()]
+    points = []
+    table = {}
+    for index, line in enumerate(text.splitlines()):
+        if not line.strip():
+            continue
+        fields = line.split(separator)
+        cat = int(fields[cat_column]) if cat_column >= 0 else index + 1
+        points.append((float(fields[x_column]), float(fields[y_column]), cat))
+        row = dict(cat=cat)
+        for name, field in zip(names, fields):
+            row[name] = convert(field)
+        row['cat'] = cat
+        table[cat] = row
+    vectors[output_key(options['output'])] = dict(kind='point',
+        points=points,
+        table=table)
+
+def rasterize(name, current, use='val', value_=1.0, column=None):
+    """rasterize a vector in a region"""
+
+    record = vectors[resolve(name, vectors)]
+    if record['kind'] == 'area':
+        source = dict(record, integer=True)
+        saved = rasters.get('__rasterize__@' + gis['MAPSET'])
+        rasters['__rasterize__@' + gis['MAPSET']] = source
+        try:
+            cats = read_raster('__rasterize__', current, masked=False)
+        finally:
+            if saved is None:
+                del rasters['__rasterize__@' + gis['MAPSET']]
+            else:
+                rasters['__rasterize__@' + gis['MAPSET']] = saved
+    else:
+        cats = np.full((current['rows'], current['cols']), np.nan)
+        for x, y, cat in record['points']:
+            row = int((current['n'] - y) // current['nsres'])
+            column_ = int((x - current['w']) // current['ewres'])
+            if 0 <= row < current['rows'] and 0 <= column_ < current['cols']:
+                cats[row, column_] = cat
+    if use == 'cat':
+        return cats
+    if use == 'attr' and column:
+        values = dict((cat, row.get(column)) for cat, row in record['table'].items())
+        return np.vectorize(lambda cat: np.nan if np.isnan(cat)
+            else float(values.get(int(cat), np.nan)), otypes=[float])(cats)
+    return np.where(np.isnan(cats), np.nan, value_)
+
+def select_where(table, where):
+    """select categories with a simple sql condition"""
+
+    match = re.match(r'\s*(\w+)\s*(=|==|!=|<>|<=|>=|<|>)\s*(.+?)\s*$', where)
+    if not match:
+        raise CalledModuleError('v.extract',
+            errors='unsupported where clause: {where}'.format(where=where))
+    column, operator, literal = match.groups()
+    literal = convert(literal.strip('\'"'))
+    compare = {'=': lambda a, b: a == b,
+        '==': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+        '<>': lambda a, b: a != b,
+        '<': lambda a, b: a < b,
+        '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b,
+        '>=': lambda a, b: a >= b}[operator]
+    return [cat for cat, row in table.items()
+        if column in row and row[column] is not None and compare(row[column], literal)]
+
+def expand_cats(cats):
+    """expand a list of categories and ranges"""
+
+    expanded = []
+    for item in split_names(cats):
+        if '-' in item:
+            low, high = item.split('-')
+            expanded.extend(range(int(low), int(high) + 1))
+        else:
+            expanded.append(int(item))
+    return expanded
+
+def convert(text):
+    """convert an attribute to a number if possible"""
+
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+def copy_record(record):
+    """copy a stored map"""
+
+    copied = dict(record)
+    for key in ('array', 'rgb'):
+        if copied.get(key) is not None:
+            copied[key] = np.array(copied[key])
+    if 'table' in copied:
+        copied['table'] = dict((cat, dict(row)) for cat, row in copied['table'].items())
+    if 'categories' in copied:
+        copied['categories'] = dict(copied['categories'])
+    if 'points' in copied:
+        copied['points'] = list(copied['points'])
+    return copied
+
+# module dispatch
+
+modules = {
+    'g.region': module_g_region,
+    'g.remove': module_g_remove,
+    'g.copy': module_g_copy,
+    'g.rename': module_g_rename,
+    'g.list': module_g_list,
+    'g.findfile': module_g_findfile,
+    'g.proj': module_g_proj,
+    'r.mapcalc': module_r_mapcalc,
+    'r.mask': module_r_mask,
+    'r.recode': module_r_recode,
+    'r.colors': module_r_colors,
+    'r.category': module_r_category,
+    'r.univar': module_r_univar,
+    'r.report': module_r_report,
+    'r.slope.aspect': module_r_slope_aspect,
+    'r.relief': module_r_relief,
+    'r.shade': module_r_shade,
+    'r.to.vect': module_r_to_vect,
+    'v.to.rast': module_v_to_rast,
+    'v.extract': module_v_extract,
+    'v.db.join': module_v_db_join,
+    'v.db.select': module_v_db_select,
+    'v.in.ascii': module_v_in_ascii,
+    }
+
+# options that control how modules run rather than what they compute
+control_options = ['env', 'stdin', 'stdout', 'stderr', 'quiet', 'verbose',
+    'superquiet', 'errors']
+
+def dispatch(*args, **kwargs):
+    """run a module on arrays held in memory"""
+
+    module = args[0] if args else kwargs.pop('prog')
+    env = kwargs.get('env')
+    env = env if env is not None else os.environ
+    stdin = kwargs.get('stdin')
+    if isinstance(stdin, bytes):
+        stdin = stdin.decode('utf-8')
+    options = dict((key, item) for key, item in kwargs.items()
+        if key not in control_options)
+    if options.get('overwrite') is None:
+        options['overwrite'] = env.get('GRASS_OVERWRITE', '1') not in ('0', 'False')
+    if module not in modules:
+        raise CalledModuleError(module,
+            errors='{module} is not supported by the numpy backend'.format(
+                module=module))
+    with lock:
+        try:
+            return modules[module](options, env, stdin)
+        except CalledModuleError:
+            raise
+        except (KeyError, ValueError, IOError, OSError) as error:
+            raise CalledModuleError(module, errors=repr(error))
@@ -13,9 +13,31 @@ This program is free software under the GNU General Public License
 import os
 import sys
 import csv
+import json
 import atexit
+import hashlib
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+# run modules on numpy arrays in this process if requested
+if os.environ.get('PANAMA_BACKEND') == 'numpy':
+    import numpy_backend
+    numpy_backend.install()
+
+import numpy as np
 import grass.script as gscript
+from grass.script import array as garray
 from grass.exceptions import CalledModuleError
+import pipeline
+import zonal
+import climate
+import compositor
+import animation
+import tiles
+import hydrology
+import snapping
 
 # set graphics driver
 driver = "cairo"
@@ -39,6 +61,8 @@ landcover_recode = os.path.join(gisdbase, location, 'landcover_recode.txt')
 landcover_color = os.path.join(gisdbase, location, 'landcover_color.txt')
 landcover_categories = os.path.join(gisdbase, location, 'landcover_categories.txt')
 results = os.path.join(gisdbase, location, 'results')
+precipitation_data = os.path.join(gisdbase, 'climate_data', 'precip.mon.mean.nc')
+temperature_data = os.path.join(gisdbase, 'climate_data', 'air.mon.mean.nc')
 
 # create lists of river names
 rivers = ['Rio Trinidad',
@@ -65,11 +89,17 @@ e = 694000
 w = 574000
 res = 30
 memory = 12000 # adjust based on your system's RAM
+workers = 1 # number of processes for basin analyses
+render_workers = 4 # number of processes for rendering frames
+tile_workers = 4 # number of threads for writing the tiles of a layer
+views = False # read basin layers from study area maps instead of clipped copies
+climate_resolution = 300 # resolution for sampling basins on climate grids
 elevation = 'elevation'
 conditioned_elevation = 'conditioned_elevation'
 srtm = 'panama_90m_dem@PERMANENT'
 alos_gdsm = 'panama_30m_dem@PERMANENT'
 relief = 'relief'
+slope = 'slope'
 zscale = 1.5
 shaded_relief = 'shaded_relief'
 brighten = 36
@@ -82,9 +112,21 @@ reference_stations = 'stations@PERMANENT'
 stations = 'stations'
 snapped_stations = 'snapped_stations'
 threshold = 1000
+# flow accumulation engine: 'grass' for r.watershed with multiple flow directions,
+# 'grass_d8' for r.watershed with single flow directions, or 'numpy' for the
+# single flow direction engine in hydrology.py; single flow directions
+# change the streams that r.stream.extract finds
+flow_engine = 'grass'
+null_value = -9999 # null value for exchanging rasters as binary files
+thresholds = [250, 500, 1000, 2000, 4000] # accumulation thresholds to compare stream networks for
+stream_sweep = 'stream_sweep'
+sample_sites = 'sample_sites@PERMANENT'
+site_basins = 'site_basins'
+snap_radius = 300 # meters around points to search for streams
 streams = 'streams'
 direction = 'direction'
 basins = 'basins'
+basins_named = 'basins_named'
 step = 50
 start = 1998
 end = 2016
@@ -94,84 +136,288 @@ width = 1500
 height = 1000
 fontsize = 16
 legend_coord = (2, 42, 2, 4)
+frame_delay = 50 # hundredths of a second between animation frames
+animation_format = 'gif' # gif or png for animated png
 
 def main():
 
-    # dependencies()
-
-    # topographic_analysis()
-
-    # hydrological_modeling()
-
-    # landcover_analysis()
-
-    # climate_analysis()
-
-    extract_basins()
-
-    basin_topographic_analysis()
-
-    basin_hydrologic_analysis()
-
-    basin_landcover_analysis()
-
-    # basin_climate_analysis()
-
-    # basin_morphometric_analysis()
-
-    render()
-
-    render_basins()
-
-    stats()
+    # parse arguments
+    parser = argparse.ArgumentParser(description='geospatial analysis '
+        'for study of riverine geochemistry in panama')
+    parser.add_argument('targets',
+        nargs='*',
+        help='stages to build with the stages they depend on '
+            '(default: all stages)')
+    parser.add_argument('--jobs',
+        type=int,
+        default=1,
+        help='number of stages to run concurrently')
+    parser.add_argument('--resume',
+        action='store_true',
+        help='skip units of work completed by the last run')
+    args = parser.parse_args()
+
+    # record completed units of work
+    pipeline.start_manifest(os.path.join(results, 'manifest.jsonl'),
+        resume=args.resume)
+
+    # run stages that are out of date
+    pipeline.run(tasks(),
+        os.path.join(results, 'pipeline.json'),
+        targets=args.targets,
+        jobs=args.jobs)
 
     atexit.register(cleanup)
     sys.exit(0)
 
+def tasks():
+    """declare the stages of the analysis with their inputs and outputs"""
+
+    years = range(start,end)
+    region = [n, s, e, w, res]
+    masks = [river + '_mask' for river in river_mapnames]
+    landcover = ['landcover_' + str(year) for year in years]
+
+    def local(*suffixes):
+        """name maps for each basin"""
+        return [river + suffix for river in river_mapnames for suffix in suffixes]
+
+    def local_landcover(*prefixes):
+        """name landcover maps for each basin and year"""
+        return [river + prefix + str(year)
+            for river in river_mapnames for prefix in prefixes for year in years]
+
+    def result(names, extension):
+        """name result files"""
+        return [os.path.join(results, name + extension) for name in names]
+
+    # basin landcover is read from the study area maps in view mode
+    copies = [] if views else local_landcover('_landcover_')
+    basin_landcover = landcover + masks if views else copies
+
+    return [
+        pipeline.task(topographic_analysis,
+            inputs=pipeline.rasters(srtm, alos_gdsm),
+            outputs=pipeline.rasters(elevation,
+                conditioned_elevation,
+                slope,
+                relief,
+                shaded_relief,
+                skyview,
+                colorized_skyview,
+                shaded_skyview),
+            parameters=dict(region=region,
+                zscale=zscale,
+                brighten=brighten,
+                skyview_brighten=skyview_brighten)),
+        pipeline.task(hydrological_modeling,
+            inputs=pipeline.rasters(conditioned_elevation, elevation)
+                + pipeline.vectors(reference_stations),
+            outputs=pipeline.rasters(accumulation, streams, direction, basins)
+                + pipeline.vectors(stations, streams, snapped_stations, basins)
+                + pipeline.files(os.path.join(results, 'snapped_stations.csv')),
+            parameters=dict(region=region,
+                threshold=threshold,
+                flow_engine=flow_engine,
+                snap_radius=snap_radius)),
+        pipeline.task(landcover_analysis,
+            inputs=pipeline.rasters(*[name + '@PERMANENT' for name in landcover])
+                + pipeline.files(landcover_recode,
+                    landcover_color,
+                    landcover_categories),
+            outputs=pipeline.rasters(*landcover),
+            parameters=dict(region=region)),
+        pipeline.task(extract_basins,
+            inputs=pipeline.vectors(basins, stations),
+            outputs=pipeline.vectors(basins_named, *river_mapnames)
+                + pipeline.rasters(*masks),
+            parameters=dict(rivers=rivers,
+                river_mapnames=river_mapnames,
+                res=res)),
+        pipeline.task(basin_topographic_analysis,
+            inputs=pipeline.rasters(elevation, *masks)
+                + pipeline.vectors(*river_mapnames),
+            outputs=pipeline.rasters(*local('_elevation',
+                    '_slope',
+                    '_aspect',
+                    '_relief',
+                    '_shaded_relief',
+                    '_skyview',
+                    '_colorized_skyview',
+                    '_shaded_skyview'))
+                + pipeline.vectors(*local('_contours')),
+            parameters=dict(res=res,
+                step=step,
+                zscale=zscale,
+                brighten=brighten,
+                skyview_brighten=skyview_brighten)),
+        pipeline.task(basin_hydrologic_analysis,
+            inputs=pipeline.rasters(accumulation, *(masks + local('_elevation')))
+                + pipeline.vectors(*river_mapnames),
+            outputs=pipeline.rasters(*(local('_streams',
+                    '_direction',
+                    '_distance',
+                    '_difference',
+                    '_order')
+                + ([] if views else local('_accumulation'))))
+                + pipeline.vectors(*local('_streams', '_attributes'))
+                + pipeline.files(*result(local('_stats'), '.csv')),
+            parameters=dict(res=res,
+                threshold=threshold,
+                views=views)),
+        pipeline.task(basin_landcover_analysis,
+            inputs=pipeline.rasters(*(landcover + masks + local('_shaded_skyview')))
+                + pipeline.files(landcover_color, landcover_categories)
+                + pipeline.vectors(*river_mapnames),
+            outputs=pipeline.rasters(*(local_landcover('_shaded_landcover_')
+                + copies)),
+            parameters=dict(res=res,
+                skyview_brighten=skyview_brighten,
+                views=views)),
+        pipeline.task(basin_climate_analysis,
+            inputs=pipeline.rasters(basins)
+                + pipeline.vectors(basins_named, *river_mapnames)
+                + pipeline.files(precipitation_data, temperature_data),
+            outputs=pipeline.files(*result(['precipitation_basins',
+                'temperature_basins'], '.csv')),
+            parameters=dict(rivers=rivers,
+                region=region,
+                climate_resolution=climate_resolution),
+            resources=['region']),
+        pipeline.task(render,
+            inputs=pipeline.rasters(shaded_relief, elevation, relief, *landcover)
+                + pipeline.vectors(streams, snapped_stations),
+            outputs=pipeline.files(*result([shaded_relief] + landcover, '.png')),
+            parameters=dict(region=region,
+                width=width,
+                height=height,
+                fontsize=fontsize,
+                legend_coord=legend_coord,
+                brighten=brighten)),
+        pipeline.task(render_basins,
+            inputs=pipeline.rasters(*(local('_shaded_skyview', '_order', '_elevation')
+                + local_landcover('_shaded_landcover_')
+                + basin_landcover))
+                + pipeline.vectors(snapped_stations, *river_mapnames),
+            outputs=pipeline.files(*result(local('_streams')
+                + local_landcover('_landcover_'), '.png')),
+            parameters=dict(res=res,
+                width=width,
+                height=height,
+                fontsize=fontsize,
+                legend_coord=legend_coord,
+                views=views)),
+        pipeline.task(animate,
+            inputs=pipeline.rasters(*([relief] + landcover
+                + local('_order')
+                + local_landcover('_shaded_landcover_')
+                + basin_landcover))
+                + pipeline.vectors(streams, snapped_stations, *river_mapnames),
+            outputs=pipeline.files(*result(['landcover'] + local('_landcover'),
+                '.' + animation_format)),
+            parameters=dict(region=region,
+                res=res,
+                width=width,
+                height=height,
+                fontsize=fontsize,
+                legend_coord=legend_coord,
+                brighten=brighten,
+                frame_delay=frame_delay,
+                views=views)),
+        pipeline.task(export_tiles,
+            inputs=pipeline.rasters(shaded_skyview, shaded_relief, *landcover),
+            outputs=pipeline.files(*[os.path.join(results, 'tiles', name, 'tilemap.json')
+                for name in [shaded_skyview, shaded_relief] + landcover]),
+            parameters=dict(region=region,
+                tile_size=tiles.size)),
+        pipeline.task(stats,
+            inputs=pipeline.rasters(elevation, slope, basins, *landcover)
+                + pipeline.vectors(basins_named, *river_mapnames),
+            outputs=pipeline.files(os.path.join(results, 'topograhic_stats.csv'),
+                os.path.join(results, 'topographic_stats_extended.csv'),
+                os.path.join(results, 'landcover_stats.csv')),
+            parameters=dict(rivers=rivers,
+                region=region),
+            resources=['region']),
+        pipeline.task(delineate_sites,
+            inputs=pipeline.rasters(direction, streams, accumulation)
+                + pipeline.vectors(sample_sites),
+            outputs=pipeline.rasters(site_basins)
+                + pipeline.files(os.path.join(results, 'site_basins.csv'),
+                    os.path.join(results, 'snapped_sites.csv')),
+            parameters=dict(region=region,
+                snap_radius=snap_radius),
+            resources=['region']),
+        pipeline.task(threshold_sweep,
+            inputs=pipeline.rasters(direction, accumulation, basins)
+                + pipeline.vectors(basins_named),
+            outputs=pipeline.rasters(stream_sweep)
+                + pipeline.files(os.path.join(results, 'threshold_sweep.csv')),
+            parameters=dict(rivers=rivers,
+                region=region,
+                thresholds=thresholds),
+            resources=['region']),
+        pipeline.task(landcover_transitions,
+            inputs=pipeline.rasters(basins, *landcover)
+                + pipeline.vectors(basins_named, *river_mapnames),
+            outputs=pipeline.files(os.path.join(results, 'landcover_transitions.csv'),
+                os.path.join(results, 'landcover_change.csv')),
+            parameters=dict(rivers=rivers,
+                region=region),
+            resources=['region']),
+        ]
+
 def topographic_analysis():
     """compute hydrologically conditioned elevation and and shaded relief"""
 
     # set region
-    gscript.run_command('g.region',
-        n=n,
-        s=s,
-        e=e,
-        w=w,
-        res=res)
+    env = study_area_environment()
 
     # patch holes in higher resolution digital surface model
     gscript.run_command('r.mapcalc',
         expression='{composite} = if(isnull({dem_1}), {dem_2}, {dem_1})'.format(composite=elevation,
             dem_1=alos_gdsm,
             dem_2=srtm),
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
 
     # hydrologically condition digital surface model
     gscript.run_command('r.hydrodem',
         input=elevation,
         output=conditioned_elevation,
         memory=memory,
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
+
+    # compute slope for zonal statistics
+    gscript.run_command('r.slope.aspect',
+        elevation=elevation,
+        slope=slope,
+        overwrite=overwrite,
+        env=env)
 
     # compute relief
     gscript.run_command('r.relief',
         input=elevation,
         output=relief,
         zscale=zscale,
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
     gscript.run_command('r.shade',
         shade=relief,
         color=elevation,
         output=shaded_relief,
         brighten=brighten,
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
 
     # compute skyview factor
     gscript.run_command('r.skyview',
         input=elevation,
         output=skyview,
         colorized_output=colorized_skyview,
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
 
     # compute shaded skyview factor
     gscript.run_command('r.shade',
@@ -179,31 +425,32 @@ def topographic_analysis():
         color=colorized_skyview,
         output=shaded_skyview,
         brighten=skyview_brighten,
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
 
 def hydrological_modeling():
     """compute stream network and basins"""
 
     # set region
-    gscript.run_command('g.region',
-        n=n,
-        s=s,
-        e=e,
-        w=w,
-        res=res)
+    env = study_area_environment()
 
     try:
         gscript.run_command('g.copy',
-            vector=[reference_stations,stations])
+            vector=[reference_stations,stations],
+            env=env)
     except CalledModuleError:
         pass
 
     # compute flow accumulation
-    gscript.run_command('r.watershed',
-        elevation=conditioned_elevation,
-        accumulation=accumulation,
-        flags='b',
-        overwrite=overwrite)
+    if flow_engine == 'numpy':
+        numpy_flow_accumulation(env)
+    else:
+        gscript.run_command('r.watershed',
+            elevation=conditioned_elevation,
+            accumulation=accumulation,
+            flags='sb' if flow_engine == 'grass_d8' else 'b',
+            overwrite=overwrite,
+            env=env)
 
     # extract stream network
     gscript.run_command('r.stream.extract',
@@ -214,16 +461,13 @@ def hydrological_modeling():
         stream_raster=streams,
         stream_vector=streams,
         direction=direction,
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
 
     # snap stream gage stations to raster stream network
-    gscript.run_command('r.stream.snap',
-        input=stations,
-        output=snapped_stations,
-        stream_rast=streams,
-        accumulation=accumulation,
-        memory=memory,
-        overwrite=overwrite)
+    snapped = snap_points(read_points(stations), env)
+    write_points(snapped, snapped_stations, env)
+    write_snapping(snapped, os.path.join(results, 'snapped_stations.csv'))
 
     # compute basins with outlets at stream gages
     gscript.run_command('r.stream.basins',
@@ -232,7 +476,8 @@ def hydrological_modeling():
         basins=basins,
         memory=memory,
         flags='l',
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
 
     # convert basins from raster to vector
     gscript.run_command('r.to.vect',
@@ -240,58 +485,260 @@ def hydrological_modeling():
         output=basins,
         type='area',
         flags='s',
-        overwrite=overwrite)
+        overwrite=overwrite,
+        env=env)
+
+def numpy_flow_accumulation(env):
+    """compute flow accumulation with the numpy engine on memory mapped rasters"""
+
+    workspace = tempfile.mkdtemp(dir=results)
+    try:
+        current = gscript.region(env=env)
+        elevation_array = read_memmap(conditioned_elevation,
+            os.path.join(workspace, 'elevation.bin'),
+            env)
+        direction_array = np.memmap(os.path.join(workspace, 'direction.bin'),
+            dtype=np.int8,
+            mode='w+',
+            shape=elevation_array.shape)
+        hydrology.flow_direction(elevation_array,
+            direction_array,
+            current['nsres'],
+            current['ewres'])
+
+        # sort cells once for this set of directions
+        receiver = hydrology.receivers(direction_array)
+        order, levels = flow_order(conditioned_elevation + '_direction',
+            direction_array,
+            receiver)
+
+        # accumulate cells with data
+        edge = hydrology.edge_cells(elevation_array)
+        null = np.isnan(elevation_array).ravel()
+        flow = hydrology.flow_accumulation(receiver,
+            order,
+            levels,
+            ~null,
+            edge)
+        flow[null] = 0
+        write_binary(flow.reshape(elevation_array.shape),
+            os.path.join(workspace, 'accumulation.bin'),
+            accumulation,
+            env)
+    finally:
+        shutil.rmtree(workspace)
+
+def flow_order(name, direction_array, receiver):
+    """sort cells by flow or load the order cached for the same directions"""
+
+    # cache each set of directions separately
+    order_path = os.path.join(results, name + '_order.npz')
+    digest = hydrology.direction_digest(direction_array)
+    cached = hydrology.load_order(order_path, digest)
+    if cached is None:
+        cached = hydrology.topological_order(receiver)
+        hydrology.save_order(order_path, digest, *cached)
+    return cached
+
+def read_memmap(raster, path, env):
+    """export a raster to a binary file and memory map it with nulls as nan"""
+
+    gscript.run_command('r.out.bin',
+        input=raster,
+        output=path,
+        bytes=4,
+        null=null_value,
+        flags='f',
+        overwrite=overwrite,
+        env=env)
+    current = gscript.region(env=env)
+    array = np.memmap(path,
+        dtype=np.float32,
+        mode='r+',
+        shape=(int(current['rows']), int(current['cols'])))
+    for top in range(0, array.shape[0], hydrology.strip):
+        block = array[top:top + hydrology.strip]
+        block[block == null_value] = np.nan
+    return array
+
+def write_binary(array, path, raster, env):
+    """import an array as a raster through a binary file with 0 as null"""
+
+    np.asarray(array, dtype=np.float64).tofile(path)
+    current = gscript.region(env=env)
+    gscript.run_command('r.in.bin',
+        input=path,
+        output=raster,
+        bytes=8,
+        north=current['n'],
+        south=current['s'],
+        east=current['e'],
+        west=current['w'],
+        rows=current['rows'],
+        cols=current['cols'],
+        anull=0,
+        flags='d',
+        overwrite=overwrite,
+        env=env)
+
+def stream_index(env):
+    """index stream cells for snapping or load the index cached for the streams"""
+
+    index_path = os.path.join(results, 'streams_index.npz')
+    digest = hashlib.sha1(json.dumps([pipeline.content_hash('raster', streams),
+        pipeline.content_hash('raster', accumulation),
+        snap_radius]).encode('utf-8')).hexdigest()
+    index = snapping.load_index(index_path, digest)
+    if index is None:
+        current = gscript.region(env=env)
+        stream_cells = np.flatnonzero(~np.isnan(garray.array(mapname=streams,
+            null=np.nan,
+            env=env)).ravel())
+        rows, cols = np.divmod(stream_cells, int(current['cols']))
+        index = snapping.build_index(current['w'] + (cols + 0.5) * current['ewres'],
+            current['n'] - (rows + 0.5) * current['nsres'],
+            garray.array(mapname=accumulation, null=0, env=env).ravel()[stream_cells],
+            snap_radius)
+        snapping.save_index(index_path, digest, index)
+    return index
+
+def snap_points(points, env):
+    """snap points to the stream cell with the most flow within the radius"""
+
+    index = stream_index(env)
+    cells, distances = snapping.snap(index,
+        [point[1] for point in points],
+        [point[2] for point in points],
+        snap_radius)
+    snapped = []
+    for point, cell, distance in zip(points, cells, distances):
+        category, x, y = point
+        if cell < 0:
+            gscript.warning('No stream within {radius} m of point {category}'.format(
+                radius=snap_radius,
+                category=category))
+            snapped.append((category, x, y, x, y, None, None))
+            continue
+        snapped.append((category, x, y,
+            index['x'][cell],
+            index['y'][cell],
+            distance,
+            index['accumulation'][cell]))
+    return snapped
+
+def read_points(vector):
+    """read the category and coordinates of each point"""
+
+    points = []
+    table = gscript.read_command('v.out.ascii',
+        input=vector,
+        format='point',
+        separator='pipe')
+    for line in table.splitlines():
+        fields = line.split('|')
+        if len(fields) >= 3:
+            points.append((int(fields[-1]), float(fields[0]), float(fields[1])))
+    return points
+
+def write_points(snapped, vector, env):
+    """write snapped points as a vector with their categories"""
+
+    gscript.write_command('v.in.ascii',
+        input='-',
+        output=vector,
+        format='point',
+        separator='pipe',
+        x=1,
+        y=2,
+        cat=3,
+        columns='x double precision, y double precision, cat integer',
+        stdin=''.join('{x}|{y}|{category}\n'.format(x=point[3],
+            y=point[4],
+            category=point[0]) for point in snapped),
+        overwrite=overwrite,
+        env=env)
+
+def write_snapping(snapped, path):
+    """write how far each point moved and the flow where it landed"""
+
+    with open_csv(path) as csvfile:
+        snap_writer = csv.writer(csvfile,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL)
+        snap_writer.writerow(['Category',
+            'X',
+            'Y',
+            'Snapped X',
+            'Snapped Y',
+            'Distance (meters)',
+            'Accumulation (cells)'])
+        for point in snapped:
+            snap_writer.writerow(['' if value is None else value for value in point])
 
 def landcover_analysis():
     """process landcover data"""
 
     # set region
-    gscript.run_command('g.region',
-        n=n,
-        s=s,
-        e=e,
-        w=w,
-        res=res)
+    env = study_area_environment()
 
     # loop through landcover time series
     for index, year in enumerate(range(start,end)):
 
+        # skip years completed by a previous run
+        if pipeline.completed('landcover_analysis', year=year):
+            continue
+
         # recode landcover
         gscript.run_command('r.recode',
             input='landcover_'+str(year)+'@PERMANENT',
             output='temporary',
             rules=landcover_recode,
-            overwrite=overwrite)
+            overwrite=overwrite,
+            env=env)
 
         # update landcover raster
         gscript.run_command('r.mapcalc',
             expression='{updated} = {temporary}'.format(updated='landcover_'+str(year),
                 temporary='temporary'),
-            overwrite=overwrite)
+            overwrite=overwrite,
+            env=env)
 
         # set color table
         gscript.run_command('r.colors',
             map='landcover_'+str(year),
-            rules=landcover_color)
+            rules=landcover_color,
+            env=env)
 
         # define categories
         gscript.run_command('r.category',
             map='landcover_'+str(year),
             separator='pipe',
-            rules=landcover_categories)
+            rules=landcover_categories,
+            env=env)
 
         # remove temporary maps
         gscript.run_command('g.remove',
             type='raster',
             name='temporary',
-            flags='f')
+            flags='f',
+            env=env)
+
+        # record progress
+        pipeline.record('landcover_analysis',
+            year=year,
+            outputs=pipeline.rasters('landcover_'+str(year)))
 
 def extract_basins():
     """extract each basin by name"""
 
-    # join stream gage station names with basin vector attributes
+    # join stream gage station names with a copy of the basin vector
+    # so that the basins computed by hydrological modeling are unchanged
+    gscript.run_command('g.copy',
+        vector=[basins, basins_named],
+        overwrite=overwrite)
     gscript.run_command('v.db.join',
-        map=basins,
+        map=basins_named,
         column='value',
         other_table=stations,
         other_column='cat',
@@ -300,252 +747,461 @@ def extract_basins():
     # extract basins
     for index, river in enumerate(rivers):
         gscript.run_command('v.extract',
-            input=basins,
+            input=basins_named,
             type='area',
             where='str_1 = "{river}"'.format(river=river),
             output=river_mapnames[index],
             overwrite=overwrite)
 
+        # rasterize basin for masking
+        gscript.run_command('v.to.rast',
+            input=river_mapnames[index],
+            output=river_mapnames[index] + '_mask',
+            use='val',
+            overwrite=overwrite,
+            env=basin_environment(river_mapnames[index]))
+
 def basin_topographic_analysis():
     """compute topographic parameters for each basin"""
 
-    for river in river_mapnames:
+    run_basins(basin_topography)
 
-        local_elevation = river + '_elevation'
-        local_relief = river + '_relief'
-        local_shaded_relief = river + '_shaded_relief'
-        local_skyview = river + '_skyview'
-        local_colorized_skyview = river + '_colorized_skyview'
-        local_shaded_skyview = river + '_shaded_skyview'
-        local_slope = river + '_slope'
-        local_aspect = river + '_aspect'
-        local_contours = river + '_contours'
-
-        # set region
-        gscript.run_command('g.region',
-            vector=river,
-            res=res)
-
-        # set mask
-        gscript.run_command('r.mask',
-            vector=river)
-
-        # clip local elevation
-        gscript.run_command('r.mapcalc',
-            expression='{local_elevation} = {elevation}'.format(local_elevation=local_elevation,
-                elevation=elevation),
-            overwrite=overwrite)
-        gscript.run_command('r.colors',
-            map=local_elevation,
-            color="elevation")
-
-        # compute local slope and aspect
-        gscript.run_command('r.slope.aspect',
-            elevation=local_elevation,
-            slope=local_slope,
-            aspect=local_aspect,
-            overwrite=overwrite)
+def basin_topography(river, env=None):
+    """compute topographic parameters for a basin"""
 
-        # compute local contours
-        gscript.run_command('r.contour',
-            input=local_elevation,
-            output=local_contours,
-            step=step,
-            overwrite=overwrite)
+    local_elevation = river + '_elevation'
+    local_relief = river + '_relief'
+    local_shaded_relief = river + '_shaded_relief'
+    local_skyview = river + '_skyview'
+    local_colorized_skyview = river + '_colorized_skyview'
+    local_shaded_skyview = river + '_shaded_skyview'
+    local_slope = river + '_slope'
+    local_aspect = river + '_aspect'
+    local_contours = river + '_contours'
 
-        # compute local shaded relief
-        gscript.run_command('r.relief',
-            input=local_elevation,
-            output=local_relief,
-            zscale=zscale,
-            overwrite=overwrite)
-        gscript.run_command('r.shade',
-            shade=local_relief,
-            color=local_elevation,
-            output=local_shaded_relief,
-            brighten=brighten,
-            overwrite=overwrite)
+    # skip basins completed by a previous run
+    if pipeline.completed('basin_topographic_analysis', river):
+        return
 
-        # compute local skyview factor
-        gscript.run_command('r.skyview',
-            input=local_elevation,
-            output=local_skyview,
-            colorized_output=local_colorized_skyview,
-            overwrite=overwrite)
+    # set region
+    env = basin_environment(river, env)
+
+    # clip local elevation
+    clip(elevation, local_elevation, river, env)
+    gscript.run_command('r.colors',
+        map=local_elevation,
+        color="elevation",
+        env=env)
+
+    # compute local slope and aspect
+    gscript.run_command('r.slope.aspect',
+        elevation=local_elevation,
+        slope=local_slope,
+        aspect=local_aspect,
+        overwrite=overwrite,
+        env=env)
+
+    # compute local contours
+    gscript.run_command('r.contour',
+        input=local_elevation,
+        output=local_contours,
+        step=step,
+        overwrite=overwrite,
+        env=env)
+
+    # compute local shaded relief
+    gscript.run_command('r.relief',
+        input=local_elevation,
+        output=local_relief,
+        zscale=zscale,
+        overwrite=overwrite,
+        env=env)
+    gscript.run_command('r.shade',
+        shade=local_relief,
+        color=local_elevation,
+        output=local_shaded_relief,
+        brighten=brighten,
+        overwrite=overwrite,
+        env=env)
 
-        # composite relief and skyview factor
-        gscript.run_command('r.shade',
-            shade=local_relief,
-            color=local_colorized_skyview,
-            output=local_shaded_skyview,
-            brighten=skyview_brighten,
-            overwrite=overwrite)
+    # compute local skyview factor
+    gscript.run_command('r.skyview',
+        input=local_elevation,
+        output=local_skyview,
+        colorized_output=local_colorized_skyview,
+        overwrite=overwrite,
+        env=env)
 
-        try:
-            # remove mask
-            gscript.run_command('r.mask', raster='MASK', flags='r')
-        except CalledModuleError:
-            pass
+    # composite relief and skyview factor
+    gscript.run_command('r.shade',
+        shade=local_relief,
+        color=local_colorized_skyview,
+        output=local_shaded_skyview,
+        brighten=skyview_brighten,
+        overwrite=overwrite,
+        env=env)
+
+    # record progress
+    pipeline.record('basin_topographic_analysis',
+        river,
+        outputs=pipeline.rasters(local_elevation,
+            local_slope,
+            local_aspect,
+            local_relief,
+            local_shaded_relief,
+            local_skyview,
+            local_colorized_skyview,
+            local_shaded_skyview)
+            + pipeline.vectors(local_contours))
 
 def basin_landcover_analysis():
     """compute landcover parameters for each basin"""
 
-    # loop through landcover time series
-    for index, year in enumerate(range(start,end)):
+    run_basins(basin_landcover)
 
-        # loop through river basins
-        for river in river_mapnames:
+def basin_landcover(river, env=None):
+    """compute landcover parameters for a basin"""
 
-            local_landcover = river + '_landcover_' + str(year)
-            local_shaded_skyview = river + '_shaded_skyview'
-            local_shaded_landcover = river + '_shaded_landcover_' + str(year)
+    local_shaded_skyview = river + '_shaded_skyview'
 
-            # set region
-            gscript.run_command('g.region',
-                vector=river,
-                res=res)
+    # skip years completed by a previous run
+    years = [year for year in range(start,end)
+        if not pipeline.completed('basin_landcover_analysis', river, year)]
+    if not years:
+        return
+    local_landcovers = [river + '_landcover_' + str(year) for year in years]
 
-            # set mask
-            gscript.run_command('r.mask',
-                vector=river)
+    # set region
+    env = basin_environment(river, env)
 
-            # clip local landcover
-            gscript.run_command('r.mapcalc',
-                expression='{local_landcover} = {landcover}'.format(local_landcover=local_landcover,
-                    landcover='landcover_'+str(year)),
-                overwrite=overwrite)
+    # clip local landcover for all years in one pass unless reading views
+    if not views:
+        clip(['landcover_'+str(year) for year in years],
+            local_landcovers,
+            river,
+            env)
 
-            # set color table
-            gscript.run_command('r.colors',
-                map=local_landcover,
-                rules=landcover_color)
+        # set color tables
+        gscript.run_command('r.colors',
+            map=local_landcovers,
+            rules=landcover_color,
+            env=env)
 
-            # define categories
+    # loop through landcover time series
+    for year, local_landcover in zip(years, local_landcovers):
+
+        local_shaded_landcover = river + '_shaded_landcover_' + str(year)
+
+        # define categories
+        if not views:
             gscript.run_command('r.category',
                 map=local_landcover,
                 separator='pipe',
-                rules=landcover_categories)
+                rules=landcover_categories,
+                env=env)
 
-            # landcover with shaded relief
-            gscript.run_command('r.shade',
-                shade=local_shaded_skyview,
-                color=local_landcover,
-                output=local_shaded_landcover,
-                brighten=skyview_brighten,
-                overwrite=overwrite)
+        # landcover with shaded relief
+        # which is null outside the basin like the shaded skyview
+        gscript.run_command('r.shade',
+            shade=local_shaded_skyview,
+            color=view('landcover_'+str(year), local_landcover),
+            output=local_shaded_landcover,
+            brighten=skyview_brighten,
+            overwrite=overwrite,
+            env=env)
 
-            try:
-                # remove mask
-                gscript.run_command('r.mask', raster='MASK', flags='r')
-            except CalledModuleError:
-                pass
+        # record progress
+        pipeline.record('basin_landcover_analysis',
+            river,
+            year,
+            pipeline.rasters(local_shaded_landcover,
+                *([] if views else [local_landcover])))
 
 
 def basin_climate_analysis():
     """compute climatic parameters for each basin"""
 
-    for river in river_mapnames:
-
-        # set region
-        gscript.run_command('g.region',
-            vector=river,
-            res=res)
-
-        # set mask
-        gscript.run_command('r.mask',
-            vector=river)
-
-        # clip climate data
-
-        try:
-            # remove mask
-            gscript.run_command('r.mask', raster='MASK', flags='r')
-        except CalledModuleError:
-            pass
-
+    # sample basins on a grid much finer than the climate data
+    gscript.run_command('g.region',
+        n=n,
+        s=s,
+        e=e,
+        w=w,
+        res=climate_resolution)
+    zones = garray.array(mapname=basins, null=np.nan)
+    categories = basin_categories()
+    region = gscript.region()
+    x, y = np.meshgrid(
+        region['w'] + (np.arange(region['cols']) + 0.5) * region['ewres'],
+        region['n'] - (np.arange(region['rows']) + 0.5) * region['nsres'])
+    inside = ~np.isnan(zones)
+    zones = zones[inside]
+    basins_hash = pipeline.content_hash('raster', basins)
+    longitude = None
+
+    for name, path in [('precipitation', precipitation_data),
+        ('temperature', temperature_data)]:
+
+        # load or build weights for the overlap of basins and climate cells
+        dataset = climate.open_dataset(path)
+        shape = (dataset.RasterYSize, dataset.RasterXSize)
+        digest = climate.weights_digest(basins_hash,
+            categories,
+            [n, s, e, w, climate_resolution],
+            dataset.GetGeoTransform(),
+            shape)
+        weights_path = os.path.join(results, name + '_weights.npz')
+        weights = climate.load_weights(weights_path, digest)
+        if weights is None:
+            if longitude is None:
+                longitude, latitude = climate.geographic(x[inside],
+                    y[inside],
+                    gscript.read_command('g.proj', flags='wf'))
+            weights = climate.overlap_weights(zones,
+                longitude,
+                latitude,
+                categories,
+                dataset.GetGeoTransform(),
+                shape)
+            climate.save_weights(weights_path, digest, weights)
+
+        # write the mean of each basin for each month
+        units = dataset.GetRasterBand(1).GetMetadata().get('units', '')
+        with open_csv(os.path.join(results, name + '_basins.csv')) as csvfile:
+            stats_writer = csv.writer(csvfile,
+                delimiter=',',
+                quotechar='|',
+                quoting=csv.QUOTE_MINIMAL)
+            stats_writer.writerow(['Time']
+                + [river + (' ({units})'.format(units=units) if units else '')
+                    for river in rivers])
+            for month, means in climate.zone_means(dataset, weights, len(rivers)):
+                stats_writer.writerow([month] + list(means))
 
 def basin_hydrologic_analysis():
     """compute hydrologic parameters for each basin"""
 
-    for river in river_mapnames:
-
-        local_elevation = river + '_elevation'
-        local_streams = river + '_streams'
-        local_direction = river + '_direction'
-        local_accumulation = river + '_accumulation'
-        local_distance = river + '_distance'
-        local_direction = river + '_direction'
-        local_difference = river + '_difference'
-        local_attributes = river + '_attributes'
-        local_order = river + '_order'
-        local_stats = os.path.join(results, river + '_stats.csv')
-
-        # set region
-        gscript.run_command('g.region',
-            vector=river,
-            res=res)
+    run_basins(basin_hydrology)
 
-        # set mask
-        gscript.run_command('r.mask',
-            vector=river)
+def basin_hydrology(river, env=None):
+    """compute hydrologic parameters for a basin"""
 
-        # clip local flow accumulation
-        gscript.run_command('r.mapcalc',
-            expression='{local_accumulation} = {accumulation}'.format(local_accumulation=local_accumulation,
-                accumulation=accumulation),
-            overwrite=overwrite)
+    local_elevation = river + '_elevation'
+    local_streams = river + '_streams'
+    local_direction = river + '_direction'
+    local_accumulation = river + '_accumulation'
+    local_distance = river + '_distance'
+    local_direction = river + '_direction'
+    local_difference = river + '_difference'
+    local_attributes = river + '_attributes'
+    local_order = river + '_order'
+    local_stats = os.path.join(results, river + '_stats.csv')
 
-        # extract stream network
-        gscript.run_command('r.stream.extract',
-            elevation=local_elevation,
-            accumulation=accumulation,
-            threshold=threshold,
-            memory=memory,
-            stream_raster=local_streams,
-            stream_vector=local_streams,
-            direction=local_direction,
-            overwrite=overwrite)
+    # skip basins completed by a previous run
+    if pipeline.completed('basin_hydrologic_analysis', river):
+        return
 
-        # compute stream distance
-        gscript.run_command('r.stream.distance',
-            stream_rast=local_streams,
-            direction=local_direction,
-            elevation=local_elevation,
-            distance=local_distance,
-            difference=local_difference,
-            memory=memory,
-            overwrite=overwrite)
+    # set region
+    env = basin_environment(river, env)
 
-        # compute stream order
-        gscript.run_command('r.stream.order',
-            stream_rast=local_streams,
-            direction=local_direction,
-            elevation=local_elevation,
-            accumulation=local_accumulation,
-            stream_vect=local_attributes,
-            strahler=local_order,
-            memory=memory,
-            overwrite=overwrite)
+    # clip local flow accumulation unless reading it as a view
+    if not views:
+        clip(accumulation, local_accumulation, river, env)
+    basin_accumulation = view(accumulation, local_accumulation)
 
-        # set color table
-        gscript.run_command('r.colors',
-            map=local_order,
-            color='water')
-
-        # compute stream stats
-        gscript.run_command('r.stream.stats',
-            stream_rast=local_streams,
-            direction=local_direction,
-            elevation=local_elevation,
-            output=local_stats,
-            memory=memory,
-            overwrite=overwrite)
+    # extract stream network
+    gscript.run_command('r.stream.extract',
+        elevation=local_elevation,
+        accumulation=basin_accumulation,
+        threshold=threshold,
+        memory=memory,
+        stream_raster=local_streams,
+        stream_vector=local_streams,
+        direction=local_direction,
+        overwrite=overwrite,
+        env=env)
+
+    # compute stream distance
+    gscript.run_command('r.stream.distance',
+        stream_rast=local_streams,
+        direction=local_direction,
+        elevation=local_elevation,
+        distance=local_distance,
+        difference=local_difference,
+        memory=memory,
+        overwrite=overwrite,
+        env=env)
+
+    # compute stream order
+    gscript.run_command('r.stream.order',
+        stream_rast=local_streams,
+        direction=local_direction,
+        elevation=local_elevation,
+        accumulation=basin_accumulation,
+        stream_vect=local_attributes,
+        strahler=local_order,
+        memory=memory,
+        overwrite=overwrite,
+        env=env)
+
+    # set color table
+    gscript.run_command('r.colors',
+        map=local_order,
+        color='water',
+        env=env)
+
+    # compute stream stats
+    gscript.run_command('r.stream.stats',
+        stream_rast=local_streams,
+        direction=local_direction,
+        elevation=local_elevation,
+        output=local_stats,
+        memory=memory,
+        overwrite=overwrite,
+        env=env)
+
+    # record progress
+    pipeline.record('basin_hydrologic_analysis',
+        river,
+        outputs=pipeline.rasters(local_streams,
+            local_direction,
+            local_distance,
+            local_difference,
+            local_order,
+            *([] if views else [local_accumulation]))
+            + pipeline.vectors(local_streams, local_attributes)
+            + pipeline.files(local_stats))
+
+def study_area_environment():
+    """return an environment with the region of the study area"""
+
+    study_env = os.environ.copy()
+    study_env['GRASS_REGION'] = gscript.region_env(n=n,
+        s=s,
+        e=e,
+        w=w,
+        res=res)
+    return study_env
+
+def basin_environment(river, env=None):
+    """return an environment with the region of a basin"""
+
+    basin_env = (env or os.environ).copy()
+    basin_env['GRASS_REGION'] = gscript.region_env(vector=river,
+        res=res,
+        env=env)
+    return basin_env
+
+def clip(rasters, outputs, river, env):
+    """clip one or more rasters to a basin using its mask as an inline mask"""
+
+    if isinstance(rasters, str):
+        rasters = [rasters]
+        outputs = [outputs]
+
+    # compute all outputs in a single pass
+    expressions = ['{output} = if(isnull({mask}), null(), {raster})'.format(output=output,
+            mask=river + '_mask',
+            raster=raster)
+        for raster, output in zip(rasters, outputs)]
+    gscript.write_command('r.mapcalc',
+        file='-',
+        stdin='\n'.join(expressions) + '\n',
+        overwrite=overwrite,
+        env=env)
+
+def view(raster, local):
+    """name the map to read for a basin layer"""
+
+    # in view mode read the study area map within the basin region
+    # where other clipped inputs already limit results to the basin
+    return raster if views else local
+
+def run_basins(function):
+    """run a basin function serially or in a pool of worker mapsets"""
+
+    # run serially in the current mapset
+    # or in this process with the numpy backend
+    if workers < 2 or getattr(gscript, 'in_process', False):
+        for river in river_mapnames:
+            function(river)
+        return
 
-        try:
-            # remove mask
-            gscript.run_command('r.mask', raster='MASK', flags='r')
-        except CalledModuleError:
-            pass
+    # run each basin in its own worker mapset
+    pool = multiprocessing.Pool(workers)
+    try:
+        worker_mapsets = pool.map(basin_worker,
+            [(function.__name__, river) for river in river_mapnames])
+    finally:
+        pool.close()
+        pool.join()
+
+    # merge results into the current mapset
+    for worker_mapset in worker_mapsets:
+        merge_mapset(worker_mapset)
+
+def basin_worker(args):
+    """run a basin function in a temporary mapset"""
+
+    function, river = args
+    worker_mapset = mapset + '_' + river
+    worker_env = create_mapset(worker_mapset)
+    try:
+        globals()[function](river, env=worker_env)
+    finally:
+        os.remove(worker_env['GISRC'])
+    return worker_mapset
+
+def create_mapset(worker_mapset):
+    """create a temporary mapset and return an environment for it"""
+
+    # create mapset with the default region
+    path = os.path.join(gisdbase, location, worker_mapset)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.mkdir(path)
+    shutil.copy(os.path.join(gisdbase, location, 'PERMANENT', 'DEFAULT_WIND'),
+        os.path.join(path, 'WIND'))
+
+    # write a private gisrc for the mapset
+    descriptor, gisrc = tempfile.mkstemp()
+    with os.fdopen(descriptor, 'w') as gisrc_file:
+        gisrc_file.write('GISDBASE: {gisdbase}\n'
+            'LOCATION_NAME: {location}\n'
+            'MAPSET: {mapset}\n'.format(gisdbase=gisdbase,
+                location=location,
+                mapset=worker_mapset))
+
+    # set environment without the temporary region of the current mapset
+    worker_env = os.environ.copy()
+    worker_env['GISRC'] = gisrc
+    worker_env.pop('WIND_OVERRIDE', None)
+
+    # set database connection and access maps in the current mapset
+    gscript.run_command('db.connect',
+        flags='c',
+        env=worker_env)
+    gscript.run_command('g.mapsets',
+        mapset=mapset,
+        operation='add',
+        env=worker_env)
+
+    return worker_env
+
+def merge_mapset(worker_mapset):
+    """copy maps from a worker mapset into the current mapset"""
+
+    for maptype in ['raster', 'vector']:
+        for fullname in gscript.list_strings(maptype, mapset=worker_mapset):
+            name = fullname.split('@')[0]
+            if name == 'MASK':
+                continue
+            gscript.run_command('g.copy',
+                overwrite=overwrite,
+                **{maptype: [fullname, name]})
+
+    # remove worker mapset
+    shutil.rmtree(os.path.join(gisdbase, location, worker_mapset))
 
 def basin_morphometric_analysis():
     """compute morphometric parameters for each basin"""
@@ -608,158 +1264,378 @@ def basin_morphometric_analysis():
 def render():
     """render maps of the study area"""
 
-    # set region
-    gscript.run_command('g.region',
-        n=n,
-        s=s,
-        e=e,
-        w=w,
-        res=res)
+    frames = []
+    region = study_area_environment()['GRASS_REGION']
 
     # render shaded relief with streams
-    gscript.run_command('d.mon',
-        start=driver,
-        width=width,
-        height=height,
-        output=os.path.join(results, shaded_relief+".png"),
-        overwrite=overwrite)
-    gscript.run_command('d.rast',
-        map=shaded_relief)
-    gscript.run_command('d.vect',
-        map=streams,
-        display='shape',
-        #width=1,
-        size=0,
-        color='blue')
-    gscript.run_command('d.legend',
-        raster=elevation,
-        fontsize=fontsize,
-        at=legend_coord)
-    gscript.run_command('d.mon', stop=driver)
-
-    # loop through landcover time series
-    for index, year in enumerate(range(start,end)):
-
-        # render landcover with streams
-        gscript.run_command('d.mon',
-            start=driver,
-            width=width,
-            height=height,
-            output=os.path.join(results, 'landcover_'+str(year)+'.png'),
-            overwrite=overwrite)
-        gscript.run_command('d.shade',
-            shade=relief,
-            color='landcover_'+str(year),
-            brighten=brighten)
-        gscript.run_command('d.vect',
-            map=streams,
-            display='shape',
-            #width=1,
-            size=0,
-            color='blue')
-        gscript.run_command('d.vect',
-            map=snapped_stations,
-            display='shape',
-            icon='basic/circle',
-            size=2,
-            color='blue')
-        gscript.run_command('d.legend',
-            raster='landcover_'+str(year),
-            fontsize=fontsize,
-            range=(1,9),
-            at=legend_coord)
-        gscript.run_command('d.mon', stop=driver)
+    if not pipeline.completed('render'):
+        frames.append(dict(output=os.path.join(results, shaded_relief+".png"),
+            region=region,
+            unit=('render', None, None),
+            layers=[('d.rast', dict(map=shaded_relief)),
+                ('d.vect', dict(map=streams,
+                    display='shape',
+                    size=0,
+                    color='blue')),
+                ('d.legend', dict(raster=elevation,
+                    fontsize=fontsize,
+                    at=legend_coord))]))
+
+    # render landcover with streams
+    years = [year for year in range(start,end)
+        if not pipeline.completed('render', year=year)]
+    if years:
+        frames.append(landcover_composite(years))
+
+    render_frames(frames)
 
 def render_basins():
     """render maps for each basin"""
 
+    frames = []
+
     # loop through river basins
     for river in river_mapnames:
 
         local_elevation = river + '_elevation'
-        local_relief = river + '_relief'
-        local_shaded_relief = river + '_shaded_relief'
-        local_skyview = river + '_skyview'
-        local_colorized_skyview = river + '_colorized_skyview'
         local_shaded_skyview = river + '_shaded_skyview'
         local_streams = river + '_streams'
-        local_accumulation = river + '_accumulation'
         local_order = river + '_order'
-
-        # set region
-        gscript.run_command('g.region',
-            vector=river,
-            res=res)
+        region = basin_environment(river)['GRASS_REGION']
 
         # render shaded relief with streams
-        gscript.run_command('d.mon',
-            start=driver,
-            width=width,
-            height=height,
-            output=os.path.join(results, local_streams+".png"),
-            overwrite=overwrite)
-        gscript.run_command('d.rast',
-            map=local_shaded_skyview)
-        gscript.run_command('d.rast',
-            map=local_order)
-        gscript.run_command('d.vect',
-            map=snapped_stations,
-            display='shape',
-            icon='basic/circle',
-            size=2,
-            color='blue')
-        gscript.run_command('d.legend',
-            raster=local_elevation,
-            fontsize=fontsize,
-            at=legend_coord)
-        gscript.run_command('d.mon', stop=driver)
-
-        # loop through landcover time series
-        for index, year in enumerate(range(start,end)):
-
-            local_landcover = river + '_landcover_' + str(year)
-            local_shaded_landcover = river + '_shaded_landcover_' + str(year)
-
-            # render landcover with streams
-            gscript.run_command('d.mon',
-                start=driver,
-                width=width,
-                height=height,
-                output=os.path.join(results, local_landcover+".png"),
-                overwrite=overwrite)
-            gscript.run_command('d.rast',
-                map=local_shaded_landcover)
-            gscript.run_command('d.rast',
-                map=local_order)
-            gscript.run_command('d.vect',
-                map=snapped_stations,
+        if not pipeline.completed('render_basins', river):
+            frames.append(dict(output=os.path.join(results, local_streams+".png"),
+                region=region,
+                unit=('render_basins', river, None),
+                layers=[('d.rast', dict(map=local_shaded_skyview)),
+                    ('d.rast', dict(map=local_order)),
+                    ('d.vect', dict(map=snapped_stations,
+                        display='shape',
+                        icon='basic/circle',
+                        size=2,
+                        color='blue')),
+                    ('d.legend', dict(raster=local_elevation,
+                        fontsize=fontsize,
+                        at=legend_coord))]))
+
+        # render landcover with streams
+        years = [year for year in range(start,end)
+            if not pipeline.completed('render_basins', river, year)]
+        if years:
+            frames.append(basin_landcover_composite(river, years))
+
+    render_frames(frames)
+
+def landcover_composite(years):
+    """describe landcover frames of the study area over layers rendered once"""
+
+    # render streams, stations and the legend once
+    # and shade each year of landcover under them
+    # since landcover maps share one color table and categories
+    return dict(region=study_area_environment()['GRASS_REGION'],
+        shade=relief,
+        brighten=brighten,
+        layers=[('d.vect', dict(map=streams,
+                display='shape',
+                size=0,
+                color='blue')),
+            ('d.vect', dict(map=snapped_stations,
+                display='shape',
+                icon='basic/circle',
+                size=2,
+                color='blue')),
+            ('d.legend', dict(raster='landcover_'+str(start),
+                fontsize=fontsize,
+                range=(1,9),
+                at=legend_coord))],
+        frames=[dict(output=os.path.join(results, 'landcover_'+str(year)+'.png'),
+                unit=('render', None, year),
+                raster='landcover_'+str(year))
+            for year in years])
+
+def basin_landcover_composite(river, years):
+    """describe landcover frames of a basin over layers rendered once"""
+
+    # render stream order, stations and the legend once
+    # and place each year of shaded landcover under them
+    return dict(region=basin_environment(river)['GRASS_REGION'],
+        layers=[('d.rast', dict(map=river + '_order')),
+            ('d.vect', dict(map=snapped_stations,
                 display='shape',
                 icon='basic/circle',
                 size=2,
-                color='blue')
-            gscript.run_command('d.legend',
-                raster=local_landcover,
+                color='blue')),
+            ('d.legend', dict(raster=view('landcover_'+str(start),
+                    river + '_landcover_' + str(start)),
                 fontsize=fontsize,
                 range=(1,9),
-                at=legend_coord)
-            gscript.run_command('d.mon', stop=driver)
+                at=legend_coord))],
+        frames=[dict(output=os.path.join(results, river + '_landcover_' + str(year) + '.png'),
+                unit=('render_basins', river, year),
+                raster=river + '_shaded_landcover_' + str(year))
+            for year in years])
+
+def render_frames(frames):
+    """render frames serially or in a pool of processes"""
+
+    # render serially
+    # or in this process with the numpy backend
+    if render_workers < 2 or getattr(gscript, 'in_process', False):
+        for frame in frames:
+            for rendered in render_job(frame):
+                record_frame(rendered)
+        return
+
+    # render frames concurrently since each frame has its own file and region
+    pool = multiprocessing.Pool(render_workers)
+    try:
+        for rendered_frames in pool.imap_unordered(render_job, frames):
+            for rendered in rendered_frames:
+                record_frame(rendered)
+    finally:
+        pool.close()
+        pool.join()
+
+def render_job(frame):
+    """render a frame or a composite of frames"""
+
+    if 'frames' in frame:
+        return render_composite(frame)
+    return [render_frame(frame)]
+
+def render_environment(output, region, transparent=False):
+    """return an environment for the display driver to draw into a file"""
+
+    # set the driver, file, size and region of the frame
+    # like a monitor started with d.mon
+    render_env = os.environ.copy()
+    render_env['GRASS_RENDER_IMMEDIATE'] = driver
+    render_env['GRASS_RENDER_FILE'] = output
+    render_env['GRASS_RENDER_FILE_READ'] = 'TRUE'
+    render_env['GRASS_RENDER_WIDTH'] = str(width)
+    render_env['GRASS_RENDER_HEIGHT'] = str(height)
+    render_env['GRASS_RENDER_TRANSPARENT'] = 'TRUE' if transparent else 'FALSE'
+    render_env['GRASS_REGION'] = region
+    return render_env
+
+def render_frame(frame):
+    """render a frame with the display driver writing directly to its file"""
+
+    # start from a blank frame
+    if os.path.exists(frame['output']):
+        os.remove(frame['output'])
+    render_env = render_environment(frame['output'], frame['region'])
+
+    # draw each layer onto the frame
+    for module, options in frame['layers']:
+        gscript.run_command(module,
+            env=render_env,
+            **options)
+    return frame
+
+def render_composite(composite):
+    """render a composite of frames to png files
+
+    Frames are blended and resampled with numpy like d.shade and d.rast
+    rather than drawn by the display driver, so pixels can differ from
+    frames drawn with drawn_frame. Run validate_rendering.py to measure
+    the difference.
+    """
+
+    for frame, image in composite_frames(composite):
+        compositor.write_png(frame['output'], image)
+    return composite['frames']
+
+def drawn_frame(composite, frame):
+    """describe a frame of a composite drawn entirely by the display driver"""
+
+    if composite.get('shade'):
+        base = ('d.shade', dict(shade=composite['shade'],
+            color=frame['raster'],
+            brighten=composite['brighten']))
+    else:
+        base = ('d.rast', dict(map=frame['raster']))
+    return dict(output=frame['output'],
+        region=composite['region'],
+        unit=frame['unit'],
+        layers=[base] + composite['layers'])
+
+def composite_frames(composite):
+    """render static layers once and blend them over a raster for each frame"""
+
+    # render static layers as a transparent image
+    descriptor, overlay_file = tempfile.mkstemp(suffix='.png')
+    os.close(descriptor)
+    os.remove(overlay_file)
+    render_env = render_environment(overlay_file, composite['region'], transparent=True)
+    try:
+        for module, options in composite['layers']:
+            gscript.run_command(module,
+                env=render_env,
+                **options)
+        overlay = compositor.read_png(overlay_file)
+    finally:
+        if os.path.exists(overlay_file):
+            os.remove(overlay_file)
+    region = gscript.region(env=render_env)
+
+    # read the shade once for all frames
+    if composite.get('shade'):
+        intensity, shade_null = raster_colors(composite['shade'], render_env)
+
+    # blend the static layers over each raster
+    for frame in composite['frames']:
+        rgb, null = raster_colors(frame['raster'], render_env)
+        if composite.get('shade'):
+            rgb = compositor.shade(rgb, intensity, composite['brighten'])
+            null = null | shade_null
+        image, empty = compositor.sample(rgb, null, region, width, height)
+        yield frame, compositor.composite(image, empty, overlay)
+
+def animate():
+    """encode landcover animations of the study area and each basin"""
+
+    # describe each animation as a composite of all years
+    years = range(start,end)
+    composites = []
+    if not pipeline.completed('animate'):
+        composites.append(landcover_composite(years))
+        composites[-1]['animation'] = os.path.join(results,
+            'landcover.' + animation_format)
+        composites[-1]['unit'] = ('animate', None, None)
+    for river in river_mapnames:
+        if pipeline.completed('animate', river):
+            continue
+        composites.append(basin_landcover_composite(river, years))
+        composites[-1]['animation'] = os.path.join(results,
+            river + '_landcover.' + animation_format)
+        composites[-1]['unit'] = ('animate', river, None)
+
+    # encode serially
+    # or in this process with the numpy backend
+    if render_workers < 2 or getattr(gscript, 'in_process', False):
+        for composite in composites:
+            record_animation(encode_animation(composite))
+        return
+
+    # encode each animation in its own process
+    pool = multiprocessing.Pool(render_workers)
+    try:
+        for composite in pool.imap_unordered(encode_animation, composites):
+            record_animation(composite)
+    finally:
+        pool.close()
+        pool.join()
+
+def encode_animation(composite):
+    """encode the frames of a composite as they are blended"""
+
+    writer = animation.writer(composite['animation'],
+        len(composite['frames']),
+        frame_delay)
+    for frame, image in composite_frames(composite):
+        writer.add(image)
+    writer.close()
+    return composite
+
+def record_animation(composite):
+    """record an encoded animation in the manifest"""
+
+    stage, basin, year = composite['unit']
+    pipeline.record(stage, basin, year, pipeline.files(composite['animation']))
+
+def export_tiles():
+    """export tile pyramids of shaded relief, shaded skyview and landcover"""
+
+    layers = [shaded_skyview, shaded_relief] \
+        + ['landcover_' + str(year) for year in range(start,end)]
+
+    # export serially
+    # or in this process with the numpy backend
+    if render_workers < 2 or getattr(gscript, 'in_process', False):
+        for layer in layers:
+            export_layer(layer)
+        return
+
+    # export each layer in its own process
+    pool = multiprocessing.Pool(render_workers)
+    try:
+        pool.map(export_layer, layers)
+    finally:
+        pool.close()
+        pool.join()
+
+def export_layer(layer):
+    """export a tile pyramid of a raster over the study area"""
+
+    study_env = study_area_environment()
+    rgb, null = raster_colors(layer, study_env)
+    tiles.export(rgb,
+        null,
+        gscript.region(env=study_env),
+        os.path.join(results, 'tiles', layer),
+        workers=tile_workers)
+
+def raster_colors(raster, env):
+    """read the colors of a raster and its null cells in a region"""
+
+    descriptor, ppm_file = tempfile.mkstemp(suffix='.ppm')
+    os.close(descriptor)
+    try:
+        gscript.run_command('r.out.ppm',
+            input=raster,
+            output=ppm_file,
+            overwrite=overwrite,
+            env=env)
+        rgb = compositor.read_ppm(ppm_file)
+    finally:
+        os.remove(ppm_file)
+    null = np.isnan(garray.array(mapname=raster, null=np.nan, env=env))
+    return rgb, null
+
+def record_frame(frame):
+    """record a rendered frame in the manifest"""
+
+    stage, basin, year = frame['unit']
+    pipeline.record(stage, basin, year, pipeline.files(frame['output']))
+
+def open_csv(path):
+    """open a csv file for writing with python 2 or 3"""
+
+    # the csv module writes bytes in python 2 and text in python 3
+    if sys.version_info[0] < 3:
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
 
 def stats():
     "write stats for each basin as csv file"
 
-    # create lists
-    mean_elevation = []
-    min_elevation = []
-    max_elevation = []
-    mean_slope = []
-    min_slope = []
-    max_slope = []
-
-    # csv filepath
+    # csv filepaths
     topographic_stats = os.path.join(results, 'topograhic_stats.csv')
+    extended_stats = os.path.join(results, 'topographic_stats_extended.csv')
+    landcover_stats = os.path.join(results, 'landcover_stats.csv')
+
+    # read basins once for the study area
+    gscript.run_command('g.region',
+        n=n,
+        s=s,
+        e=e,
+        w=w,
+        res=res)
+    zones = garray.array(mapname=basins, null=np.nan)
+    categories = basin_categories()
+
+    # compute statistics for every basin in one pass over each map
+    elevation_stats = zonal.zonal_statistics(zones,
+        garray.array(mapname=elevation, null=np.nan),
+        categories)
+    slope_stats = zonal.zonal_statistics(zones,
+        garray.array(mapname=slope, null=np.nan),
+        categories)
 
     # write statistics to csv file
-    with open(topographic_stats, 'wb') as csvfile:
+    with open_csv(topographic_stats) as csvfile:
         stats_writer = csv.writer(csvfile,
             delimiter=',',
             quotechar='|',
@@ -774,57 +1650,320 @@ def stats():
             'Max slope',
             'Min slope'])
 
-        # loop through rivers
-        for index, river in enumerate(river_mapnames):
-
-            # set local variables
-            local_elevation = river + '_elevation'
-            local_slope = river + '_slope'
-
-            # set region
-            gscript.run_command('g.region',
-                vector=river,
-                res=res)
-
-            # compute elevation statistics
-            univar = gscript.parse_command('r.univar',
-                map=local_elevation,
-                separator='newline',
-                flags='g')
-            mean_elevation.append(univar['mean'])
-            min_elevation.append(univar['min'])
-            max_elevation.append(univar['max'])
-
-            # compute slope statistics
-            univar = gscript.parse_command('r.univar',
-                map=local_slope,
-                separator='newline',
-                flags='g')
-            mean_slope.append(univar['mean'])
-            min_slope.append(univar['min'])
-            max_slope.append(univar['max'])
-
-            # write data
-            stats_writer.writerow([rivers[index],
-                mean_elevation[index],
-                min_elevation[index],
-                max_elevation[index],
-                mean_slope[index],
-                min_slope[index],
-                max_slope[index]])
-
-            # loop through landcover time series
-            for index, year in enumerate(range(start,end)):
-
-                local_landcover = river + '_landcover_' + str(year)
-
-                # compute landcover statistics
-                gscript.run_command('r.report',
-                    map=local_landcover,
-                    units='me,p',
-                    flags='n',
-                    output=os.path.join(results, local_landcover+".txt"),
-                    overwrite=overwrite)
+        # write data
+        for index, river in enumerate(rivers):
+            stats_writer.writerow([river,
+                elevation_stats[index]['mean'],
+                elevation_stats[index]['min'],
+                elevation_stats[index]['max'],
+                slope_stats[index]['mean'],
+                slope_stats[index]['min'],
+                slope_stats[index]['max']])
+
+    # write extended statistics to csv file
+    with open_csv(extended_stats) as csvfile:
+        stats_writer = csv.writer(csvfile,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL)
+        stats_writer.writerow(['River',
+            'Parameter',
+            'Cells',
+            'Mean',
+            'Min',
+            'Max',
+            'Standard deviation']
+            + ['Percentile {percentile}'.format(percentile=percentile)
+                for percentile in zonal.percentiles])
+        for parameter, parameter_stats in [('elevation', elevation_stats),
+            ('slope', slope_stats)]:
+            for index, river in enumerate(rivers):
+                row = parameter_stats[index]
+                stats_writer.writerow([river,
+                    parameter,
+                    row['cells'],
+                    row['mean'],
+                    row['min'],
+                    row['max'],
+                    row['stddev']]
+                    + [row['percentiles'][percentile]
+                        for percentile in zonal.percentiles])
+
+    # write landcover statistics to csv file
+    region = gscript.region()
+    cell_area = region['nsres'] * region['ewres']
+    with open_csv(landcover_stats) as csvfile:
+        stats_writer = csv.writer(csvfile,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL)
+        stats_writer.writerow(['River',
+            'Year',
+            'Class',
+            'Label',
+            'Cells',
+            'Area (square meters)',
+            'Percent'])
+
+        # count classes in every basin in one pass over each year
+        for year in range(start,end):
+            landcover = 'landcover_'+str(year)
+            labels = category_labels(landcover)
+            classes, counts = zonal.crosstab(zones,
+                garray.array(mapname=landcover, null=np.nan),
+                categories)
+            totals = counts.sum(axis=1)
+            for index, river in enumerate(rivers):
+                for position, value in enumerate(classes):
+                    cells = counts[index, position]
+                    if not cells:
+                        continue
+                    stats_writer.writerow([river,
+                        year,
+                        value,
+                        labels.get(value, ''),
+                        cells,
+                        cells * cell_area,
+                        100.0 * cells / totals[index]])
+
+def delineate_sites():
+    """delineate the nested catchment of every sample site"""
+
+    site_stats = os.path.join(results, 'site_basins.csv')
+
+    # skip without sample sites
+    if not gscript.find_file(sample_sites, element='vector')['name']:
+        gscript.warning('Skipping delineation: {sites} does not exist'.format(
+            sites=sample_sites))
+        return
+
+    # read directions once for the study area
+    gscript.run_command('g.region',
+        n=n,
+        s=s,
+        e=e,
+        w=w,
+        res=res)
+    region = gscript.region()
+    direction_array = np.asarray(garray.array(mapname=direction, null=0), dtype=np.int8)
+    receiver = hydrology.receivers(direction_array)
+    order, levels = flow_order(direction, direction_array, receiver)
+
+    # snap sites to streams
+    snapped = snap_points(read_points(sample_sites), study_area_environment())
+    write_snapping(snapped, os.path.join(results, 'snapped_sites.csv'))
+
+    # label the catchment of every site in one pass upstream
+    categories, outlets = site_cells(snapped, region)
+    labels, outlet_labels, parents = hydrology.delineate(receiver,
+        order,
+        levels,
+        outlets)
+    cells = np.bincount(labels, minlength=len(outlets) + 1)[1:]
+    nested = hydrology.nested_cells(cells, parents)
+
+    # write catchments as one raster with the category of each site
+    catchments = garray.array()
+    catchments[...] = np.append(0, categories)[labels].reshape(direction_array.shape)
+    catchments.write(mapname=site_basins, null=0, overwrite=overwrite)
+
+    # write the area of each catchment and interbasin to csv file
+    cell_area = region['nsres'] * region['ewres']
+    with open_csv(site_stats) as csvfile:
+        stats_writer = csv.writer(csvfile,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL)
+        stats_writer.writerow(['Site',
+            'Downstream site',
+            'Interbasin cells',
+            'Interbasin area (square meters)',
+            'Catchment area (square meters)'])
+        for category, label in zip(categories, outlet_labels):
+            parent = parents[label - 1]
+            stats_writer.writerow([category,
+                categories[parent - 1] if parent else '',
+                cells[label - 1],
+                cells[label - 1] * cell_area,
+                nested[label - 1] * cell_area])
+
+def site_cells(snapped, region):
+    """find the category and cell index of each snapped point in the region"""
+
+    categories = []
+    cells = []
+    for point in snapped:
+        category, x, y = point[0], point[3], point[4]
+        row = int(np.floor((region['n'] - y) / region['nsres']))
+        col = int(np.floor((x - region['w']) / region['ewres']))
+        if not (0 <= row < region['rows'] and 0 <= col < region['cols']):
+            gscript.warning('Site {category} is outside the region'.format(
+                category=category))
+            continue
+        categories.append(category)
+        cells.append(row * int(region['cols']) + col)
+    return categories, cells
+
+def threshold_sweep():
+    """compare stream networks in each basin for several thresholds"""
+
+    sweep_stats = os.path.join(results, 'threshold_sweep.csv')
+
+    # read basins, directions and accumulation once for the study area
+    gscript.run_command('g.region',
+        n=n,
+        s=s,
+        e=e,
+        w=w,
+        res=res)
+    region = gscript.region()
+    categories = basin_categories()
+
+    # measure streams for every threshold in one pass
+    levels, basin_cells, stream_cells, stream_lengths = hydrology.threshold_sweep(
+        garray.array(mapname=direction, null=0),
+        garray.array(mapname=accumulation, null=np.nan),
+        garray.array(mapname=basins, null=np.nan),
+        categories,
+        thresholds,
+        region['nsres'],
+        region['ewres'])
+
+    # write the networks of all thresholds as one raster
+    # where cells are streams for thresholds up to their value
+    network = garray.array()
+    network[...] = levels
+    network.write(mapname=stream_sweep, null=0, overwrite=overwrite)
+
+    # write stream length and drainage density to csv file
+    cell_area = region['nsres'] * region['ewres']
+    with open_csv(sweep_stats) as csvfile:
+        stats_writer = csv.writer(csvfile,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL)
+        stats_writer.writerow(['River',
+            'Threshold',
+            'Stream cells',
+            'Stream length (meters)',
+            'Area (square meters)',
+            'Drainage density (kilometers per square kilometer)'])
+        for index, river in enumerate(rivers):
+            area = basin_cells[index] * cell_area
+            for position, value in enumerate(sorted(thresholds)):
+                stats_writer.writerow([river,
+                    value,
+                    stream_cells[index, position],
+                    stream_lengths[index, position],
+                    area,
+                    stream_lengths[index, position] / 1000.0 / (area / 1000000.0)
+                        if area else np.nan])
+
+def landcover_transitions():
+    """write landcover transitions in each basin as csv files"""
+
+    years = range(start,end)
+    transitions = os.path.join(results, 'landcover_transitions.csv')
+    change = os.path.join(results, 'landcover_change.csv')
+
+    # read basins once for the study area
+    gscript.run_command('g.region',
+        n=n,
+        s=s,
+        e=e,
+        w=w,
+        res=res)
+    zones = garray.array(mapname=basins, null=np.nan)
+    categories = basin_categories()
+    labels = category_labels('landcover_'+str(years[0]))
+    region = gscript.region()
+    cell_area = region['nsres'] * region['ewres']
+
+    # stream through consecutive years with two years in memory
+    with open_csv(transitions) as csvfile:
+        transition_writer = transition_table(csvfile)
+        before = garray.array(mapname='landcover_'+str(years[0]), null=np.nan)
+        for year in years[1:]:
+            after = garray.array(mapname='landcover_'+str(year), null=np.nan)
+            write_transitions(transition_writer,
+                zonal.transitions(zones, before, after, categories),
+                year - 1,
+                year,
+                labels,
+                cell_area)
+            before = after
+
+    # compare the first and last years
+    with open_csv(change) as csvfile:
+        change_writer = transition_table(csvfile)
+        first = garray.array(mapname='landcover_'+str(years[0]), null=np.nan)
+        write_transitions(change_writer,
+            zonal.transitions(zones, first, before, categories),
+            years[0],
+            years[-1],
+            labels,
+            cell_area)
+
+def transition_table(csvfile):
+    """start a csv table of landcover transitions"""
+
+    transition_writer = csv.writer(csvfile,
+        delimiter=',',
+        quotechar='|',
+        quoting=csv.QUOTE_MINIMAL)
+    transition_writer.writerow(['River',
+        'From year',
+        'To year',
+        'From class',
+        'From label',
+        'To class',
+        'To label',
+        'Cells',
+        'Area (square meters)'])
+    return transition_writer
+
+def write_transitions(transition_writer, transitions, from_year, to_year, labels, cell_area):
+    """write landcover transitions between two years"""
+
+    for position, source, target, cells in transitions:
+        transition_writer.writerow([rivers[position],
+            from_year,
+            to_year,
+            source,
+            labels.get(source, ''),
+            target,
+            labels.get(target, ''),
+            cells,
+            cells * cell_area])
+
+def category_labels(raster):
+    """read the category labels of a raster"""
+
+    labels = {}
+    categories = gscript.read_command('r.category',
+        map=raster,
+        separator='pipe')
+    for line in categories.splitlines():
+        if '|' in line:
+            value, label = line.split('|', 1)
+            labels[int(float(value))] = label
+    return labels
+
+def basin_categories():
+    """find the category of each river's basin in the basins raster"""
+
+    # read the station names joined to the basins
+    categories = {}
+    table = gscript.read_command('v.db.select',
+        map=basins_named,
+        columns='value,str_1',
+        separator='pipe',
+        flags='c')
+    for line in table.splitlines():
+        if '|' in line:
+            value, name = line.split('|', 1)
+            categories[name] = int(value)
+    return [categories.get(river) for river in rivers]
 
 def dependencies():
     """try to install required add-ons"""
@@ -841,12 +1980,6 @@ def dependencies():
             operation='add')
     except CalledModuleError:
         pass
-    try:
-        gscript.run_command('g.extension',
-            extension='r.stream.snap',
-            operation='add')
-    except CalledModuleError:
-        pass
     try:
         gscript.run_command('g.extension',
             extension='r.stream.basins',
@@ -889,11 +2022,11 @@ def cleanup():
     except CalledModuleError:
         pass
 
-    try:
-        # stop cairo monitor
-        gscript.run_command('d.mon', stop=driver)
-    except CalledModuleError:
-        pass
+    # remove worker mapsets
+    for river in river_mapnames:
+        path = os.path.join(gisdbase, location, mapset + '_' + river)
+        if os.path.exists(path):
+            shutil.rmtree(path)
 
 if __name__ == "__main__":
     atexit.register(cleanup)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: make-like scheduler for the stages of a GRASS GIS analysis
+
+Tasks declare the maps and files they read and write. A task depends on
+the tasks that write its inputs and is skipped when the content of its
+inputs and its parameters are unchanged since it last ran. Independent
+tasks run concurrently unless they share a resource such as the region
+or the graphics monitor. Within a stage, completed units of work are
+recorded in a run manifest so that an interrupted run can be resumed.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+import grass.script as gscript
+
+# files of a vector map that store its geometry, leaving out metadata
+# such as the header and history which change whenever a map is edited
+vector_files = ['coor']
+
+# a stage of the analysis with its declared inputs and outputs
+# as lists of (element, name) tuples where element is raster, vector or file
+Task = namedtuple('Task', ['name',
+    'function',
+    'inputs',
+    'outputs',
+    'parameters',
+    'resources'])
+
+def task(function, inputs=(), outputs=(), parameters=None, resources=()):
+    """declare a task for a stage function"""
+
+    return Task(function.__name__,
+        function,
+        list(inputs),
+        list(outputs),
+        parameters or {},
+        set(resources))
+
+def rasters(*names):
+    """declare raster maps"""
+
+    return [('raster', name) for name in names]
+
+def vectors(*names):
+    """declare vector maps"""
+
+    return [('vector', name) for name in names]
+
+def files(*paths):
+    """declare files"""
+
+    return [('file', path) for path in paths]
+
+def data_files(element, name):
+    """list the files that store a map or file"""
+
+    if element == 'file':
+        return [name] if os.path.isfile(name) else []
+
+    # find map in the search path
+    found = gscript.find_file(name,
+        element='cell' if element == 'raster' else 'vector')
+    if not found['file']:
+        return []
+
+    # list vector geometry files
+    if element == 'vector':
+        paths = [os.path.join(found['file'], filename) for filename in vector_files]
+        return [path for path in paths if os.path.isfile(path)]
+
+    # list raster files
+    mapset_path = os.path.dirname(os.path.dirname(found['file']))
+    basename = os.path.basename(found['file'])
+    paths = [os.path.join(mapset_path, raster_element, basename)
+        for raster_element in ['cellhd', 'cell', 'fcell', 'colr', 'cats']]
+    misc_path = os.path.join(mapset_path, 'cell_misc', basename)
+    if os.path.isdir(misc_path):
+        paths.extend(os.path.join(misc_path, filename)
+            for filename in sorted(os.listdir(misc_path)))
+    return [path for path in paths if os.path.isfile(path)]
+
+def content_hash(element, name):
+    """compute a hash of the content of a map or file"""
+
+    paths = data_files(element, name)
+    if not paths:
+        return None
+    sha = hashlib.sha1()
+    for path in paths:
+        sha.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as data:
+            for block in iter(lambda: data.read(1 << 20), b''):
+                sha.update(block)
+
+    # attributes of vectors are stored in their database
+    if element == 'vector':
+        for layer in sorted(gscript.vector_db(name)):
+            table = gscript.read_command('v.db.select',
+                map=name,
+                layer=layer)
+            sha.update(table if isinstance(table, bytes) else table.encode('utf-8'))
+    return sha.hexdigest()
+
+def modification_time(element, name):
+    """find when a map or file was last written"""
+
+    paths = data_files(element, name)
+    if not paths:
+        return None
+    return max(os.path.getmtime(path) for path in paths)
+
+def input_hash(task):
+    """compute a hash of the parameters and input content of a task"""
+
+    sha = hashlib.sha1()
+    sha.update(task.name.encode('utf-8'))
+    sha.update(json.dumps(task.parameters, sort_keys=True).encode('utf-8'))
+    for element, name in sorted(task.inputs):
+        sha.update('{element}:{name}:{content}'.format(element=element,
+            name=name,
+            content=content_hash(element, name)).encode('utf-8'))
+    return sha.hexdigest()
+
+def up_to_date(task, state, digest):
+    """check whether a task can be skipped"""
+
+    # outputs must exist
+    output_times = [modification_time(element, name)
+        for element, name in task.outputs]
+    if None in output_times:
+        return False
+
+    # compare with the inputs of the last run
+    if task.name in state:
+        return state[task.name] == digest
+
+    # without a previous run compare timestamps like make
+    input_times = [modification_time(element, name)
+        for element, name in task.inputs]
+    input_times = [mtime for mtime in input_times if mtime is not None]
+    return not input_times or max(input_times) <= min(output_times)
+
+def dependencies(tasks):
+    """find the tasks that write the inputs of each task"""
+
+    producers = {}
+    for each in tasks:
+        for output in each.outputs:
+            producers[output] = each.name
+    return dict((each.name, set(producers[i] for i in each.inputs
+        if i in producers and producers[i] != each.name))
+        for each in tasks)
+
+def select(tasks, targets):
+    """select target tasks and the tasks that they depend on"""
+
+    if not targets:
+        return tasks
+    names = dict((each.name, each) for each in tasks)
+    for target in targets:
+        if target not in names:
+            raise ValueError('unknown task: {target}'.format(target=target))
+    graph = dependencies(tasks)
+    selected = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in selected:
+            selected.add(name)
+            stack.extend(graph[name])
+    return [each for each in tasks if each.name in selected]
+
+def load_state(path):
+    """load the input hashes of previous runs"""
+
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as state_file:
+        return json.load(state_file)
+
+def save_state(path, state):
+    """save the input hashes of completed tasks"""
+
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
+    os.rename(temporary, path)
+
+def run(tasks, state_path, targets=None, jobs=1):
+    """run tasks in dependency order, skipping tasks that are up to date"""
+
+    tasks = select(tasks, targets)
+    graph = dependencies(tasks)
+    state = load_state(state_path)
+    lock = threading.Lock()
+    finished = Queue()
+
+    def build(task):
+        """run a task unless it is up to date"""
+
+        try:
+            digest = input_hash(task)
+            if up_to_date(task, state, digest):
+                gscript.verbose('{task} is up to date'.format(task=task.name))
+            else:
+                gscript.message('Running {task}'.format(task=task.name))
+                stage_digests[task.name] = digest
+                task.function()
+            with lock:
+                state[task.name] = digest
+                save_state(state_path, state)
+            finished.put((task, None))
+        except Exception as error:
+            finished.put((task, error))
+
+    pending = list(tasks)
+    done = set()
+    busy = set()
+    running = 0
+    failure = None
+    pool = ThreadPool(max(jobs, 1))
+    try:
+        while pending or running:
+
+            # start tasks whose dependencies are done and resources are free
+            if failure is None:
+                for each in list(pending):
+                    if running >= jobs:
+                        break
+                    if graph[each.name] <= done and not each.resources & busy:
+                        pending.remove(each)
+                        busy |= each.resources
+                        running += 1
+                        pool.apply_async(build, (each,))
+
+            if not running:
+                break
+
+            # wait for a task to finish
+            each, error = finished.get()
+            running -= 1
+            busy -= each.resources
+            if error is None:
+                done.add(each.name)
+            elif failure is None:
+                failure = error
+    finally:
+        pool.close()
+        pool.join()
+
+    if failure is not None:
+        raise failure
+    if pending:
+        raise RuntimeError('unresolved dependencies: {tasks}'.format(
+            tasks=', '.join(each.name for each in pending)))
+
+# run manifest of completed units of work
+manifest_path = None
+completed_units = {}
+stage_digests = {} # input hash of each stage when it started
+manifest_lock = threading.Lock()
+
+def unit_key(stage, basin, year):
+    """identify a unit of work"""
+
+    return '{stage}/{basin}/{year}'.format(stage=stage, basin=basin, year=year)
+
+def start_manifest(path, resume=False):
+    """start a run manifest, keeping completed units if resuming"""
+
+    global manifest_path, completed_units
+    manifest_path = path
+    completed_units = {}
+
+    # start a new manifest
+    if not resume or not os.path.isfile(path):
+        open(path, 'w').close()
+        return
+
+    # read units completed by previous runs
+    with open(path) as manifest:
+        for line in manifest:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # skip a line cut short by a crash
+                continue
+            completed_units[unit_key(entry['stage'],
+                entry['basin'],
+                entry['year'])] = (entry.get('digest'),
+                    [tuple(output) for output in entry['outputs']])
+
+def completed(stage, basin=None, year=None):
+    """check whether a unit was completed with the same inputs and its outputs exist"""
+
+    unit = completed_units.get(unit_key(stage, basin, year))
+    if unit is None:
+        return False
+    digest, outputs = unit
+    if digest != stage_digests.get(stage):
+        return False
+    return all(data_files(element, name) for element, name in outputs)
+
+def record(stage, basin=None, year=None, outputs=()):
+    """record a completed unit of work and its outputs in the manifest"""
+
+    if manifest_path is None:
+        return
+    line = json.dumps(dict(stage=stage,
+        basin=basin,
+        year=year,
+        digest=stage_digests.get(stage),
+        outputs=list(outputs),
+        time=time.strftime('%Y-%m-%dT%H:%M:%S')))
+    with manifest_lock:
+        with open(manifest_path, 'a') as manifest:
+            manifest.write(line + '\n')
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: profile the GRASS GIS modules called by a python script
+
+Run a script with every call to run_command, read_command, parse_command
+and write_command timed, for example:
+
+    python profiler.py panama_analysis.py stats
+    python profiler.py utilities/import_landcover.py
+
+Each module call is recorded with its wall time, the CPU time and peak
+resident memory of the processes that it ran, its arguments and the
+size of the maps named in its arguments that it wrote. The calls are written
+as a Chrome trace (trace.json) that can be opened in Perfetto or
+chrome://tracing and summarized by stage and module (summary.csv).
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import atexit
+import runpy
+import argparse
+import threading
+import grass.script as gscript
+import grass.script.core as gcore
+
+# profiled functions
+commands = ['run_command', 'read_command', 'parse_command', 'write_command']
+
+# directories of raster and vector data in a mapset
+map_elements = ['cell', 'fcell', 'cellhd', 'cell_misc', 'vector']
+
+# profiling state
+output_path = None
+script_path = None
+calls = threading.local()
+lock = threading.Lock()
+
+def install(output, script):
+    """profile calls to grass modules"""
+
+    global output_path, script_path
+    output_path = output
+    script_path = os.path.abspath(script)
+
+    # remove events from previous runs
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+    for path in glob.glob(os.path.join(output_path, 'events-*.jsonl')):
+        os.remove(path)
+
+    # measure each module process as it is reaped
+    gcore.Popen = ProfiledPopen
+
+    # wrap functions in the package and the core module
+    # that the package functions call internally
+    for command in commands:
+        profiled = wrap(getattr(gcore, command))
+        setattr(gcore, command, profiled)
+        setattr(gscript, command, profiled)
+
+def wrap(function):
+    """wrap a function that runs a grass module"""
+
+    def profiled(*args, **kwargs):
+
+        # only time the outermost call
+        if getattr(calls, 'active', False):
+            return function(*args, **kwargs)
+        calls.active = True
+        calls.cpu_time = 0.0
+        calls.max_rss_kb = 0
+
+        module = args[0] if args else kwargs.get('prog')
+        mapset_path = find_mapset(kwargs.get('env'))
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            end = time.time()
+            calls.active = False
+            record(module=module,
+                kwargs=kwargs,
+                start=start,
+                end=end,
+                cpu_time=calls.cpu_time,
+                max_rss_kb=calls.max_rss_kb,
+                outputs=written_maps(mapset_path, map_names(module, kwargs), start))
+
+    profiled.__name__ = function.__name__
+    profiled.__doc__ = function.__doc__
+    return profiled
+
+class ProfiledPopen(gcore.Popen):
+    """a module process that measures its own resource usage when reaped"""
+
+    def wait(self, *args, **kwargs):
+        if self.returncode is None:
+            try:
+                pid, status, usage = os.wait4(self.pid, 0)
+            except OSError:
+                # reaped elsewhere
+                pass
+            else:
+                self._handle_exitstatus(status)
+                calls.cpu_time = getattr(calls, 'cpu_time', 0.0) \
+                    + usage.ru_utime + usage.ru_stime
+                calls.max_rss_kb = max(getattr(calls, 'max_rss_kb', 0),
+                    usage.ru_maxrss)
+        return super(ProfiledPopen, self).wait(*args, **kwargs)
+
+def find_mapset(env=None):
+    """find the mapset directory that a module writes to"""
+
+    gisrc = (env or os.environ).get('GISRC')
+    if not gisrc or not os.path.isfile(gisrc):
+        return None
+    variables = {}
+    with open(gisrc) as gisrc_file:
+        for line in gisrc_file:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                variables[key.strip()] = value.strip()
+    try:
+        return os.path.join(variables['GISDBASE'],
+            variables['LOCATION_NAME'],
+            variables['MAPSET'])
+    except KeyError:
+        return None
+
+def map_names(module, kwargs):
+    """find the names of maps in the arguments of a module"""
+
+    names = set()
+    for key, value in kwargs.items():
+        if key in ('env', 'flags', 'overwrite', 'quiet', 'verbose', 'superquiet'):
+            continue
+        if key == 'stdin' and module != 'r.mapcalc':
+            continue
+
+        # map algebra names its outputs before each equals sign
+        if key in ('expression', 'stdin'):
+            items = [statement.split('=', 1)[0]
+                for statement in str(value).replace(';', '\n').splitlines()
+                if '=' in statement]
+        elif isinstance(value, (list, tuple)):
+            items = value
+        else:
+            items = str(value).split(',')
+        for item in items:
+            name = str(item).strip().split('@')[0]
+            if name and not any(character in name for character in ' /\\'):
+                names.add(name)
+    return names
+
+def written_maps(mapset_path, names, since):
+    """find the size in bytes of the named maps written since a time"""
+
+    sizes = {}
+    if not mapset_path:
+        return sizes
+    for name in names:
+        for element in map_elements:
+            for filepath in data_files(os.path.join(mapset_path, element, name)):
+                try:
+                    status = os.stat(filepath)
+                except OSError:
+                    continue
+                if status.st_mtime >= since:
+                    sizes[name] = sizes.get(name, 0) + status.st_size
+    return sizes
+
+def data_files(path):
+    """list the files of a map element"""
+
+    if not os.path.isdir(path):
+        return [path]
+    return [os.path.join(path, name) for name in os.listdir(path)]
+
+def stage():
+    """name the stage of the script that is running"""
+
+    # find the outermost function in the script
+    names = []
+    frame = sys._getframe(2)
+    while frame is not None:
+        if os.path.abspath(frame.f_code.co_filename) == script_path:
+            names.append(frame.f_code.co_name)
+        frame = frame.f_back
+
+    # forked worker processes keep the frames of the stage that started them
+    names = [name for name in reversed(names) if name not in ('<module>', 'main')]
+    if names:
+        return names[0]
+    return os.path.splitext(os.path.basename(script_path))[0]
+
+def record(module, kwargs, start, end, cpu_time, max_rss_kb, outputs):
+    """write an event for a module call"""
+
+    arguments = dict((key, str(value)[:200]) for key, value in kwargs.items()
+        if key not in ('env', 'stdin'))
+    event = dict(name=module,
+        cat=stage(),
+        ph='X',
+        ts=int(start * 1e6),
+        dur=int((end - start) * 1e6),
+        pid=os.getpid(),
+        tid=threading.current_thread().ident,
+        args=dict(arguments=arguments,
+            cpu_time=cpu_time,
+            max_rss_kb=max_rss_kb,
+            outputs=outputs))
+    path = os.path.join(output_path,
+        'events-{pid}.jsonl'.format(pid=os.getpid()))
+    with lock:
+        with open(path, 'a') as events:
+            events.write(json.dumps(event) + '\n')
+
+def read_events():
+    """read events written by all processes"""
+
+    events = []
+    for path in glob.glob(os.path.join(output_path, 'events-*.jsonl')):
+        with open(path) as event_file:
+            for line in event_file:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+    return sorted(events, key=lambda event: event['ts'])
+
+def report(main_pid):
+    """write a trace and a summary table"""
+
+    # only report from the main process
+    if os.getpid() != main_pid:
+        return
+    events = read_events()
+
+    # write chrome trace
+    with open(os.path.join(output_path, 'trace.json'), 'w') as trace:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), trace)
+
+    # summarize by stage and module
+    summary = {}
+    for event in events:
+        key = (event['cat'], event['name'])
+        row = summary.setdefault(key, dict(calls=0,
+            wall_time=0.0,
+            cpu_time=0.0,
+            max_rss_kb=0,
+            output_bytes=0))
+        row['calls'] += 1
+        row['wall_time'] += event['dur'] / 1e6
+        row['cpu_time'] += event['args']['cpu_time']
+        row['max_rss_kb'] = max(row['max_rss_kb'], event['args']['max_rss_kb'])
+        row['output_bytes'] += sum(event['args']['outputs'].values())
+
+    # write summary sorted by time
+    with open(os.path.join(output_path, 'summary.csv'), 'w') as csvfile:
+        summary_writer = csv.writer(csvfile,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL)
+        summary_writer.writerow(['Stage',
+            'Module',
+            'Calls',
+            'Wall time (s)',
+            'CPU time (s)',
+            'Peak memory (MB)',
+            'Output size (MB)'])
+        for (stage_name, module), row in sorted(summary.items(),
+            key=lambda item: -item[1]['wall_time']):
+            summary_writer.writerow([stage_name,
+                module,
+                row['calls'],
+                round(row['wall_time'], 3),
+                round(row['cpu_time'], 3),
+                round(row['max_rss_kb'] / 1024.0, 1),
+                round(row['output_bytes'] / 1048576.0, 1)])
+
+def main():
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description='profile the grass modules '
+        'called by a python script')
+    parser.add_argument('--output',
+        default='profile',
+        help='directory for the trace and summary')
+    parser.add_argument('script',
+        help='python script to run')
+    parser.add_argument('arguments',
+        nargs=argparse.REMAINDER,
+        help='arguments for the script')
+    args = parser.parse_args()
+
+    # profile the script
+    install(args.output, args.script)
+    atexit.register(report, os.getpid())
+    sys.argv = [args.script] + args.arguments
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    runpy.run_path(args.script, run_name='__main__')
+
+if __name__ == "__main__":
+    main()
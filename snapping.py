@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: snap points to the stream cells with the most flow nearby
+
+Stream cells are indexed once in square buckets as wide as the search
+radius, so the candidates for a point are the cells in the 3 by 3
+buckets around it. Points snap to the candidate within the radius
+with the highest accumulation, so they move onto the main stem rather
+than a tributary, and to the nearest of equal candidates. Batches of
+points are snapped together with arrays of pairs of points and
+candidates. The index is cached on disk with a digest of the streams.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import numpy as np
+
+def build_index(x, y, accumulation, bucket):
+    """index stream cells in buckets of a given width"""
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # without stream cells a single empty bucket snaps no points
+    if not x.size:
+        west, south, columns, rows = 0.0, 0.0, 1, 1
+    else:
+        west, south = x.min(), y.min()
+        columns = int((x.max() - west) // bucket) + 1
+        rows = int((y.max() - south) // bucket) + 1
+
+    # sort cells by bucket
+    keys = ((y - south) // bucket).astype(np.int64) * columns \
+        + ((x - west) // bucket).astype(np.int64)
+    order = np.argsort(keys, kind='mergesort')
+    starts = np.searchsorted(keys[order], np.arange(rows * columns + 1))
+    return dict(x=x[order],
+        y=y[order],
+        accumulation=np.abs(np.asarray(accumulation, dtype=np.float64))[order],
+        starts=starts,
+        origin=np.array([west, south]),
+        shape=np.array([rows, columns]),
+        bucket=np.array(bucket, dtype=np.float64))
+
+def snap(index, x, y, radius):
+    """snap points to stream cells within a radius
+
+    Returns the position of the chosen cell in the index, or -1 if
+    there is no stream cell within the radius, and the snap distance.
+    """
+
+    if radius > index['bucket']:
+        raise ValueError('radius is wider than the buckets of the index')
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    rows, columns = index['shape']
+    point_rows = np.floor((y - index['origin'][1]) / index['bucket']).astype(np.int64)
+    point_columns = np.floor((x - index['origin'][0]) / index['bucket']).astype(np.int64)
+
+    # pair each point with the cells in the buckets around it
+    pair_points = []
+    pair_cells = []
+    for row_offset in (-1, 0, 1):
+        for column_offset in (-1, 0, 1):
+            bucket_rows = point_rows + row_offset
+            bucket_columns = point_columns + column_offset
+            inside = (bucket_rows >= 0) & (bucket_rows < rows) \
+                & (bucket_columns >= 0) & (bucket_columns < columns)
+            keys = np.where(inside, bucket_rows * columns + bucket_columns, 0)
+            first = index['starts'][keys]
+            counts = np.where(inside, index['starts'][keys + 1] - first, 0)
+            points = np.repeat(np.arange(x.size), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            pair_points.append(points)
+            pair_cells.append(np.repeat(first, counts) + offsets)
+    pair_points = np.concatenate(pair_points)
+    pair_cells = np.concatenate(pair_cells)
+
+    # keep candidates within the radius
+    distances = np.hypot(index['x'][pair_cells] - x[pair_points],
+        index['y'][pair_cells] - y[pair_points])
+    near = distances <= radius
+    pair_points = pair_points[near]
+    pair_cells = pair_cells[near]
+    distances = distances[near]
+
+    # choose the most flow then the shortest distance for each point
+    ranking = np.lexsort((distances, -index['accumulation'][pair_cells], pair_points))
+    first = np.ones(ranking.size, dtype=bool)
+    first[1:] = pair_points[ranking][1:] != pair_points[ranking][:-1]
+    chosen = ranking[first]
+    cells = np.full(x.size, -1, dtype=np.int64)
+    snapped = np.full(x.size, np.nan)
+    cells[pair_points[chosen]] = pair_cells[chosen]
+    snapped[pair_points[chosen]] = distances[chosen]
+    return cells, snapped
+
+def load_index(path, digest):
+    """load a cached index if it was built from the same streams"""
+
+    if not os.path.isfile(path):
+        return None
+    cached = np.load(path)
+    if str(cached['digest']) != digest:
+        return None
+    return dict((key, cached[key]) for key in cached.files if key != 'digest')
+
+def save_index(path, digest, index):
+    """cache an index on disk"""
+
+    temporary = path + '.tmp.npz'
+    np.savez(temporary, digest=digest, **index)
+    os.rename(temporary, path)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: tests of the in-process numpy backend
+
+Run from the root of the repository with:
+
+    python -m pytest tests
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy_backend
+numpy_backend.install()
+
+import grass.script as gscript
+from grass.script import array as garray
+from grass.exceptions import CalledModuleError
+
+@pytest.fixture(autouse=True)
+def session():
+    """start each test with no maps in a 3 by 3 region"""
+
+    numpy_backend.rasters.clear()
+    numpy_backend.vectors.clear()
+    gscript.run_command('g.region', n=3, s=0, e=3, w=0, res=1)
+    yield
+
+def calc(expression, env=None):
+    """evaluate map algebra and read the result with nulls as nan"""
+
+    gscript.run_command('r.mapcalc',
+        expression='result = ' + expression,
+        env=env)
+    return garray.array(mapname='result', null=np.nan, env=env)
+
+def test_precedence():
+    gscript.run_command('r.mapcalc', expression='a = col()')
+    gscript.run_command('r.mapcalc', expression='b = row()')
+    mask = calc('a > 1 && b < 3')
+    assert mask.tolist() == [[0, 1, 1], [0, 1, 1], [0, 0, 0]]
+    assert calc('1 + 2 * 3')[0, 0] == 7
+    assert calc('-2 ^ 2')[0, 0] == 4
+    assert calc('2 ^ 3 ^ 2')[0, 0] == 512
+    assert calc('1 || 0 && 0')[0, 0] == 1
+    assert calc('6 & 3 == 2')[0, 0] == 0
+
+def test_bitwise():
+    gscript.run_command('r.mapcalc', expression='f = 4')
+    assert calc('f & 2')[0, 0] == 0
+    assert calc('f | 3')[0, 0] == 7
+    assert calc('4 & 6')[0, 0] == 4
+
+def test_constants():
+    assert calc('4 && 2').tolist() == [[1] * 3] * 3
+    assert calc('4 < 2').tolist() == [[0] * 3] * 3
+    assert calc('!4').tolist() == [[0] * 3] * 3
+
+def test_null_propagation():
+    gscript.run_command('r.mapcalc', expression='x = if(row() == 1, null(), col())')
+    for expression in ['x + 1', 'x > 1', 'x && 1', 'x | 1', '!x', 'round(x)']:
+        result = calc(expression)
+        assert np.isnan(result[0]).all(), expression
+        assert not np.isnan(result[1:]).any(), expression
+    assert calc('isnull(x)')[:, 0].tolist() == [1, 0, 0]
+    assert calc('if(isnull(x), 5, x)')[0].tolist() == [5, 5, 5]
+
+def test_round_and_int():
+    assert calc('round(2.5)')[0, 0] == 3
+    assert calc('round(-2.5)')[0, 0] == -3
+    assert calc('round(-2.4)')[0, 0] == -2
+    assert calc('int(-2.7)')[0, 0] == -2
+    assert calc('7 / 2')[0, 0] == 3
+    assert calc('-7 / 2')[0, 0] == -3
+    assert calc('7.0 / 2')[0, 0] == 3.5
+
+def test_syntax_errors():
+    for expression in ['(1', '1 +', 'max(1,', '1 1']:
+        with pytest.raises(CalledModuleError):
+            calc(expression)
+
+def test_mask():
+    gscript.run_command('r.mapcalc', expression='values = col()')
+    gscript.run_command('r.mapcalc', expression='zone = if(col() < 3, 1, null())')
+    gscript.run_command('r.mask', raster='zone')
+    masked = garray.array(mapname='values', null=np.nan)
+    assert np.isnan(masked[:, 2]).all()
+    assert masked[:, :2].tolist() == [[1, 2]] * 3
+    univar = gscript.parse_command('r.univar', map='values', flags='g')
+    assert int(univar['n']) == 6
+    gscript.run_command('r.mask', flags='r')
+    assert not np.isnan(garray.array(mapname='values', null=np.nan)).any()
+
+def test_region_environment():
+    gscript.run_command('r.mapcalc', expression='values = row() * 10 + col()')
+
+    # read a window at a finer resolution through GRASS_REGION
+    env = os.environ.copy()
+    env['GRASS_REGION'] = gscript.region_env(n=3, s=1, e=2, w=0, res=0.5)
+    window = garray.array(mapname='values', null=np.nan, env=env)
+    assert window.shape == (4, 4)
+    assert window[:, 0].tolist() == [11, 11, 21, 21]
+    assert window[0].tolist() == [11, 11, 12, 12]
+
+    # the current region is unchanged
+    assert gscript.region()['rows'] == 3
+    assert calc('values', env=env).shape == (4, 4)
+
+def test_recode():
+    gscript.run_command('r.mapcalc', expression='values = col() + (row() - 1) * 3')
+    gscript.write_command('r.recode',
+        input='values',
+        output='recoded',
+        rules='-',
+        stdin='1:3:10\n4:6:20\n')
+    recoded = garray.array(mapname='recoded', null=np.nan)
+    assert recoded[:2].tolist() == [[10, 10, 10], [20, 20, 20]]
+    assert np.isnan(recoded[2]).all()
+
+def test_univar():
+    gscript.run_command('r.mapcalc', expression='values = if(row() == 1, null(), col())')
+    univar = gscript.parse_command('r.univar', map='values', flags='ge')
+    assert int(univar['n']) == 6
+    assert int(univar['null_cells']) == 3
+    assert float(univar['min']) == 1
+    assert float(univar['max']) == 3
+    assert float(univar['mean']) == 2
+    assert float(univar['sum']) == 12
+    assert float(univar['median']) == 2
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: export colored rasters as pyramids of png tiles
+
+Each level of a pyramid halves the resolution of the level below it
+until the raster fits in a single tile, with tiles named
+level/column/row.png from the top left corner of the raster in its
+projection. A digest of every block of the raster at full resolution
+is kept with the pyramid so that only tiles over blocks that changed
+since the last export are written again.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import json
+import hashlib
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import compositor
+
+# pixels on each side of a tile
+size = 256
+
+def rgba(rgb, null):
+    """combine colors and null cells into an RGBA image"""
+
+    alpha = np.where(null, 0, 255).astype(np.uint8)
+    return np.dstack([np.where(null[..., None], 0, rgb), alpha]).astype(np.uint8)
+
+def downsample(image):
+    """halve the resolution of an RGBA image weighting colors by alpha"""
+
+    # pad to an even number of rows and columns with transparent pixels
+    rows, cols = image.shape[:2]
+    padded = np.zeros((rows + rows % 2, cols + cols % 2, 4))
+    padded[:rows, :cols] = image
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2, 4)
+
+    alpha = blocks[..., 3].sum(axis=(1, 3))
+    colors = (blocks[..., :3] * blocks[..., 3:4]).sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        colors = np.where(alpha[..., None] > 0, colors / alpha[..., None], 0)
+    return np.round(np.dstack([colors, alpha / 4.0])).astype(np.uint8)
+
+def tile(image, column, row):
+    """cut a tile from an image padding it with transparent pixels"""
+
+    block = image[row * size:(row + 1) * size, column * size:(column + 1) * size]
+    padded = np.zeros((size, size, 4), dtype=np.uint8)
+    padded[:block.shape[0], :block.shape[1]] = block
+    return padded
+
+def block_digests(image):
+    """compute a digest of each full resolution block of an image"""
+
+    digests = {}
+    rows, cols = image.shape[:2]
+    for row in range((rows + size - 1) // size):
+        for column in range((cols + size - 1) // size):
+            digests['{column}/{row}'.format(column=column, row=row)] = \
+                hashlib.sha1(tile(image, column, row).tobytes()).hexdigest()
+    return digests
+
+def export(rgb, null, region, directory, workers=1):
+    """write the tiles of a pyramid over blocks that changed"""
+
+    image = rgba(rgb, null)
+    levels = 1
+    while max(image.shape[:2]) > size << (levels - 1):
+        levels += 1
+
+    # compare blocks with the last export
+    digest_path = os.path.join(directory, 'blocks.json')
+    previous = {}
+    if os.path.isfile(digest_path):
+        with open(digest_path) as digest_file:
+            previous = json.load(digest_file)
+    digests = block_digests(image)
+    changed = set(tuple(int(part) for part in key.split('/'))
+        for key, digest in digests.items() if previous.get(key) != digest)
+
+    # write changed or missing tiles from the finest level to the coarsest
+    pool = ThreadPool(max(workers, 1))
+    try:
+        for level in reversed(range(levels)):
+            paths = []
+            rows, cols = image.shape[:2]
+            for row in range((rows + size - 1) // size):
+                for column in range((cols + size - 1) // size):
+                    path = os.path.join(directory, str(level), str(column), str(row) + '.png')
+                    if (column, row) in changed or not os.path.isfile(path):
+                        paths.append((path, tile(image, column, row)))
+            pool.map(write_tile, paths)
+
+            # tiles of the next level cover the changed tiles of this level
+            changed = set((column // 2, row // 2) for column, row in changed)
+            if level:
+                image = downsample(image)
+    finally:
+        pool.close()
+        pool.join()
+
+    # describe the pyramid
+    with open(os.path.join(directory, 'tilemap.json'), 'w') as tilemap_file:
+        json.dump(dict(north=region['n'],
+            south=region['s'],
+            east=region['e'],
+            west=region['w'],
+            tile_size=size,
+            resolutions=[region['ewres'] * 2 ** (levels - 1 - level)
+                for level in range(levels)]),
+            tilemap_file, indent=2, sort_keys=True)
+
+    # record blocks once all tiles are written
+    temporary = digest_path + '.tmp'
+    with open(temporary, 'w') as digest_file:
+        json.dump(digests, digest_file, indent=2, sort_keys=True)
+    os.rename(temporary, digest_path)
+
+def write_tile(args):
+    """write a tile as a png image"""
+
+    path, image = args
+    if not os.path.isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+    compositor.write_png(path, image)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: compute monthly means directly from netcdf climate data
+
+Reads the months of a netcdf climate dataset in chunks of bands,
+only within the window that covers the current region, and computes
+the regional mean and optionally the mean for each zone of a raster
+for every month in one pass without importing any rasters.
+Cells are sampled at the centers of the cells of the current region
+like r.univar on an imported map. For example:
+
+    python climate_stats.py precip.mon.mean.nc --label 'Precipitation(mm/day)'
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import sys
+import csv
+import datetime
+import argparse
+import numpy as np
+import grass.script as gscript
+from grass.script import array as garray
+
+# share the netcdf and zonal functions of the analysis
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import climate
+import zonal
+
+# number of months to read at a time
+chunk = 24
+
+def main():
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description='compute monthly means '
+        'directly from netcdf climate data')
+    parser.add_argument('input',
+        help='netcdf file with a band for each month')
+    parser.add_argument('--output',
+        default='climate_stats.csv',
+        help='csv file for the monthly means')
+    parser.add_argument('--label',
+        default='Mean',
+        help='header for the regional mean')
+    parser.add_argument('--factor',
+        type=float,
+        default=1.0,
+        help='factor to multiply values by')
+    parser.add_argument('--start',
+        default='1998-01',
+        help='first month as year-month')
+    parser.add_argument('--end',
+        default='2016-01',
+        help='month after the last month as year-month')
+    parser.add_argument('--zones',
+        help='raster with zones such as basins to compute means for')
+    args = parser.parse_args()
+
+    start = [int(part) for part in args.start.split('-')]
+    end = [int(part) for part in args.end.split('-')]
+    missing = write_stats(args.input,
+        args.output,
+        args.label,
+        months(start[0], start[1], end[0], end[1]),
+        factor=args.factor,
+        zones=args.zones)
+    return 1 if missing else 0
+
+def months(start_year, start_month, end_year, end_month):
+    """list the months from a start month until an end month"""
+
+    dates = []
+    time = datetime.date(start_year, start_month, 1)
+    while (time.year, time.month) < (end_year, end_month):
+        dates.append(time)
+        time = datetime.date(time.year + time.month // 12, time.month % 12 + 1, 1)
+    return dates
+
+def sample_window(dataset, region):
+    """find the window of the dataset and the cells sampled by the region"""
+
+    x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+    x = region['w'] + (np.arange(int(region['cols'])) + 0.5) * region['ewres']
+    y = region['n'] - (np.arange(int(region['rows'])) + 0.5) * region['nsres']
+
+    # wrap longitudes for datasets from 0 to 360 degrees
+    x = np.where(x < x0, x + 360, x)
+    columns = np.floor((x - x0) / dx).astype(int)
+    rows = np.floor((y - y0) / dy).astype(int)
+    if columns.min() < 0 or columns.max() >= dataset.RasterXSize \
+        or rows.min() < 0 or rows.max() >= dataset.RasterYSize:
+        raise ValueError('region extends beyond the dataset')
+    window = (columns.min(), rows.min(),
+        columns.max() - columns.min() + 1,
+        rows.max() - rows.min() + 1)
+    return window, rows - rows.min(), columns - columns.min()
+
+def read_months(dataset, bands, window, rows, columns, factor):
+    """read bands within a window and sample them at the region's cells"""
+
+    values = np.empty((len(bands), len(rows), len(columns)))
+    for position, index in enumerate(bands):
+        block = climate.read_band(dataset.GetRasterBand(index),
+            *[int(item) for item in window])
+        values[position] = block[rows[:, None], columns[None, :]] * factor
+    return values
+
+def zone_means(values, zones, ids):
+    """compute the mean of each zone for each month"""
+
+    # index cells by zone in the list of zone ids
+    index = zonal.zone_index(zones, ids).ravel()
+    inside = index >= 0
+
+    # sum values by month and zone
+    count = len(ids)
+    flat = values.reshape(len(values), -1)[:, inside]
+    valid = ~np.isnan(flat)
+    keys = (np.arange(len(values))[:, None] * count + index[inside][None, :])[valid]
+    sums = np.bincount(keys, weights=flat[valid], minlength=len(values) * count)
+    cells = np.bincount(keys, minlength=len(values) * count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / cells).reshape(len(values), count)
+
+def zone_labels(zones):
+    """list the zones of a raster with their labels"""
+
+    labels = {}
+    categories = gscript.read_command('r.category',
+        map=zones,
+        separator='pipe')
+    for line in categories.splitlines():
+        if '|' in line:
+            value, label = line.split('|', 1)
+            labels[int(float(value))] = label or value
+    return labels
+
+def write_stats(input, output, label, dates, factor=1.0, zones=None):
+    """write the monthly means of a netcdf dataset to a csv file"""
+
+    region = gscript.region()
+    dataset = climate.open_dataset(input)
+    band_dates = dict(climate.band_months(dataset))
+    window, rows, columns = sample_window(dataset, region)
+
+    # read zones once in the current region
+    ids = []
+    labels = {}
+    if zones:
+        zone_values = garray.array(mapname=zones, null=np.nan)
+        labels = zone_labels(zones)
+        ids = sorted(int(zone) for zone in np.unique(zone_values[~np.isnan(zone_values)]))
+
+    # report months without data
+    missing = [date for date in dates if date not in band_dates]
+    present = [date for date in dates if date in band_dates]
+
+    # the csv module writes bytes in python 2 and text in python 3
+    csvfile = open(output, 'wb') if sys.version_info[0] < 3 \
+        else open(output, 'w', newline='')
+    with csvfile:
+        stats_writer = csv.writer(csvfile,
+            delimiter=',',
+            quotechar='|',
+            quoting=csv.QUOTE_MINIMAL)
+
+        # write headers
+        stats_writer.writerow(['Time', label]
+            + [labels.get(zone, str(zone)) for zone in ids])
+
+        # process months in chunks
+        for first in range(0, len(present), chunk):
+            chunk_dates = present[first:first + chunk]
+            values = read_months(dataset,
+                [band_dates[date] for date in chunk_dates],
+                window,
+                rows,
+                columns,
+                factor)
+            flat = values.reshape(len(values), -1)
+            cells = (~np.isnan(flat)).sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = np.nansum(flat, axis=1) / cells
+            basin_means = zone_means(values, zone_values, ids) if ids else None
+
+            # write data
+            for position, date in enumerate(chunk_dates):
+                if not cells[position]:
+                    missing.append(date)
+                    continue
+                stats_writer.writerow([date, means[position]]
+                    + (list(basin_means[position]) if ids else []))
+
+    if missing:
+        gscript.warning('No data for {count} months: {months}'.format(
+            count=len(missing),
+            months=', '.join(date.strftime('%Y-%m') for date in sorted(missing))))
+    return sorted(missing)
+
+if __name__ == "__main__":
+    sys.exit(main())
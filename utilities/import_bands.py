@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: import the monthly bands of a netcdf file in GRASS GIS in parallel
+
+Imports each band as a raster named prefix_year_month with a pool of
+worker processes that each write to their own temporary mapset before
+the maps are copied into the current mapset. The checksum of each
+imported band is recorded so that bands that are unchanged since the
+last import are skipped. With the lazy option bands are linked with
+r.external instead of copied. Bands can be registered in a space time
+raster dataset. For example:
+
+    python import_bands.py precip.mon.mean.nc --prefix precipitation --start 1979-01 --workers 4
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+import datetime
+import multiprocessing
+from osgeo import gdal
+import grass.script as gscript
+from grass.exceptions import CalledModuleError
+
+# set environment
+env = gscript.gisenv()
+gisdbase = env['GISDBASE']
+location = env['LOCATION_NAME']
+mapset = env['MAPSET']
+
+# state of each worker process
+worker = {}
+
+def main():
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description='import the monthly bands '
+        'of a netcdf file in parallel')
+    parser.add_argument('input',
+        help='netcdf file with a band for each month')
+    parser.add_argument('--prefix',
+        required=True,
+        help='prefix of the imported raster names')
+    parser.add_argument('--start',
+        required=True,
+        help='month of the first band as year-month')
+    parser.add_argument('--workers',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of import processes')
+    parser.add_argument('--memory',
+        type=int,
+        default=6000,
+        help='memory for each import in MB')
+    parser.add_argument('--lazy',
+        action='store_true',
+        help='link bands with r.external instead of importing them')
+    parser.add_argument('--strds',
+        help='space time raster dataset to register the bands in')
+    args = parser.parse_args()
+
+    start = [int(part) for part in args.start.split('-')]
+    import_bands(args.input,
+        args.prefix,
+        start[0],
+        start[1],
+        workers=args.workers,
+        memory=args.memory,
+        lazy=args.lazy,
+        strds=args.strds)
+
+def band_names(prefix, count, start_year, start_month):
+    """name a raster for each monthly band"""
+
+    names = []
+    time = datetime.date(start_year, start_month, 1)
+    for band in range(count):
+        names.append('{prefix}_{year}_{month}'.format(prefix=prefix,
+            year=time.year,
+            month=time.strftime('%m')))
+        time = datetime.date(time.year + time.month // 12, time.month % 12 + 1, 1)
+    return names
+
+def band_checksum(dataset, band):
+    """compute a checksum of the values of a band"""
+
+    return hashlib.sha1(dataset.GetRasterBand(band).ReadRaster()).hexdigest()
+
+def load_checksums(path):
+    """load the checksums of previously imported bands"""
+
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as checksum_file:
+        return json.load(checksum_file)
+
+def save_checksums(path, checksums):
+    """save the checksums of imported bands"""
+
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as checksum_file:
+        json.dump(checksums, checksum_file, indent=2, sort_keys=True)
+    os.rename(temporary, path)
+
+def import_bands(input, prefix, start_year, start_month, workers=1,
+    memory=6000, lazy=False, strds=None):
+    """import the bands of a netcdf file that changed since the last import"""
+
+    # find bands that are new or changed
+    dataset = gdal.Open(input)
+    if dataset is None:
+        raise IOError('cannot open {input}'.format(input=input))
+    names = band_names(prefix, dataset.RasterCount, start_year, start_month)
+    checksum_path = os.path.join(gisdbase, location, mapset,
+        '{prefix}_bands.json'.format(prefix=prefix))
+    checksums = load_checksums(checksum_path)
+    pending = []
+    for band, name in enumerate(names, 1):
+        checksum = band_checksum(dataset, band)
+        if checksums.get(name) == checksum \
+            and gscript.find_file(name, element='cellhd', mapset=mapset)['file']:
+            continue
+        pending.append((input, band, name, checksum, memory))
+    dataset = None
+    gscript.message('Importing {count} of {total} bands'.format(
+        count=len(pending),
+        total=len(names)))
+
+    # link bands in the current mapset
+    if lazy:
+        for input, band, name, checksum, memory in pending:
+            gscript.run_command('r.external',
+                input=input,
+                band=band,
+                output=name,
+                flags='o',
+                overwrite=True)
+            checksums[name] = checksum
+            save_checksums(checksum_path, checksums)
+
+    # import bands in worker mapsets
+    elif pending:
+        pool = multiprocessing.Pool(max(workers, 1), initializer=start_worker)
+        try:
+            for name, checksum, worker_mapset in pool.imap_unordered(import_band, pending):
+                gscript.run_command('g.copy',
+                    raster=['{name}@{mapset}'.format(name=name, mapset=worker_mapset), name],
+                    overwrite=True)
+                checksums[name] = checksum
+                save_checksums(checksum_path, checksums)
+        finally:
+            pool.close()
+            pool.join()
+            remove_worker_mapsets()
+
+    # register bands in a space time raster dataset
+    if strds:
+        register(strds, names, start_year, start_month)
+
+def start_worker():
+    """create a temporary mapset for a worker process"""
+
+    worker_mapset = '{mapset}_import_{pid}'.format(mapset=mapset, pid=os.getpid())
+    mapset_path = os.path.join(gisdbase, location, worker_mapset)
+    if not os.path.isdir(mapset_path):
+        os.makedirs(mapset_path)
+    shutil.copy(os.path.join(gisdbase, location, 'PERMANENT', 'DEFAULT_WIND'),
+        os.path.join(mapset_path, 'WIND'))
+
+    # point a private gisrc at the worker mapset
+    gisrc = os.path.join(mapset_path, 'gisrc')
+    with open(gisrc, 'w') as gisrc_file:
+        gisrc_file.write('GISDBASE: {gisdbase}\n'
+            'LOCATION_NAME: {location}\n'
+            'MAPSET: {mapset}\n'.format(gisdbase=gisdbase,
+                location=location,
+                mapset=worker_mapset))
+    worker_env = os.environ.copy()
+    worker_env['GISRC'] = gisrc
+    worker_env.pop('WIND_OVERRIDE', None)
+    worker_env.pop('GRASS_REGION', None)
+    worker['mapset'] = worker_mapset
+    worker['env'] = worker_env
+
+def import_band(args):
+    """import a band in the mapset of this worker"""
+
+    input, band, name, checksum, memory = args
+    gscript.run_command('r.in.gdal',
+        input=input,
+        output=name,
+        band=band,
+        memory=memory,
+        flags='o',
+        overwrite=True,
+        env=worker['env'])
+    return name, checksum, worker['mapset']
+
+def remove_worker_mapsets():
+    """remove the temporary mapsets of worker processes"""
+
+    prefix = '{mapset}_import_'.format(mapset=mapset)
+    location_path = os.path.join(gisdbase, location)
+    for name in os.listdir(location_path):
+        if name.startswith(prefix):
+            shutil.rmtree(os.path.join(location_path, name), ignore_errors=True)
+
+def register(strds, names, start_year, start_month):
+    """register monthly rasters in a space time raster dataset"""
+
+    try:
+        gscript.run_command('t.create',
+            output=strds,
+            type='strds',
+            temporaltype='absolute',
+            semantictype='mean',
+            title=strds,
+            description=strds)
+    except CalledModuleError:
+        pass
+    gscript.run_command('t.register',
+        input=strds,
+        maps=','.join(names),
+        start='{year}-{month:02d}-01'.format(year=start_year, month=start_month),
+        increment='1 months',
+        overwrite=True)
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,13 @@ This program is free software under the GNU General Public License
 """
 
 import os
+import re
 import sys
 import csv
+import json
 import atexit
+import hashlib
+from multiprocessing.pool import ThreadPool
 import grass.script as gscript
 from grass.exceptions import CalledModuleError
 
@@ -40,23 +44,109 @@ gscript.run_command('g.region',
     save='region',
     overwrite=overwrite)
 
-# set path
+# set paths
 landcover_path = os.path.join(gisdbase, 'esa_landcover')
+manifest_path = os.path.join(gisdbase, location, mapset, 'landcover_import.json')
 
-landcover_files = []
-for (dirpath, dirnames, filenames) in os.walk(landcover_path):
-    landcover_files.extend(sorted(filenames))
-    break
+# set import parameters
+years = range(1998,2016)
+workers = 4 # number of concurrent imports
 
-for index, year in enumerate(range(1998,2016)):
+def file_year(filename):
+    """find the year in a landcover filename"""
 
-    # set path
-    landcover_filepath = os.path.join(landcover_path, landcover_files[index])
-    print landcover_filepath
+    match = re.search(r'(?<!\d)(19|20)\d{2}(?!\d)', filename)
+    return int(match.group(0)) if match else None
 
-    # import
+def file_hash(filepath):
+    """compute a hash of the content of a file"""
+
+    sha = hashlib.sha1()
+    with open(filepath, 'rb') as data:
+        for block in iter(lambda: data.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_manifest():
+    """load the record of imported files"""
+
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as manifest:
+        return json.load(manifest)
+
+def save_manifest(manifest):
+    """save the record of imported files"""
+
+    temporary = manifest_path + '.tmp'
+    with open(temporary, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.rename(temporary, manifest_path)
+
+def changed(filename, manifest, output):
+    """check whether a file differs from its last import"""
+
+    filepath = os.path.join(landcover_path, filename)
+    status = os.stat(filepath)
+    entry = manifest.get(filename)
+    if not entry or not gscript.find_file(output, element='cell', mapset=mapset)['file']:
+        return True
+    if entry['size'] == status.st_size and entry['mtime'] == status.st_mtime:
+        return False
+    if entry['hash'] != file_hash(filepath):
+        return True
+
+    # record the new size and time of an unchanged file
+    entry['size'] = status.st_size
+    entry['mtime'] = status.st_mtime
+    save_manifest(manifest)
+    return False
+
+def import_file(job):
+    """import a landcover file for a year"""
+
+    filename, year = job
+    filepath = os.path.join(landcover_path, filename)
+    status = os.stat(filepath)
     gscript.run_command('r.import',
         extent='region',
-        input=landcover_filepath,
+        input=filepath,
         output='landcover_'+str(year),
         overwrite=overwrite)
+    return filename, dict(year=year,
+        size=status.st_size,
+        mtime=status.st_mtime,
+        hash=file_hash(filepath))
+
+# map files to years by filename
+landcover_files = {}
+for filename in sorted(os.listdir(landcover_path)):
+    year = file_year(filename)
+    if year in years:
+        if year in landcover_files:
+            gscript.fatal('More than one file for {year}: {first}, {second}'.format(
+                year=year,
+                first=landcover_files[year],
+                second=filename))
+        landcover_files[year] = filename
+for year in years:
+    if year not in landcover_files:
+        gscript.warning('No landcover file for {year}'.format(year=year))
+
+# find new or changed files
+manifest = load_manifest()
+jobs = [(filename, year) for year, filename in sorted(landcover_files.items())
+    if changed(filename, manifest, 'landcover_'+str(year))]
+gscript.message('Importing {count} of {total} files'.format(count=len(jobs),
+    total=len(landcover_files)))
+
+# import concurrently and record each import
+pool = ThreadPool(workers)
+try:
+    for filename, entry in pool.imap_unordered(import_file, jobs):
+        gscript.message(os.path.join(landcover_path, filename))
+        manifest[filename] = entry
+        save_manifest(manifest)
+finally:
+    pool.close()
+    pool.join()
@@ -18,6 +18,7 @@ import datetime
 from dateutil.relativedelta import relativedelta
 import grass.script as gscript
 from grass.exceptions import CalledModuleError
+import import_bands
 
 # temporary region
 gscript.use_temp_region()
@@ -41,24 +42,18 @@ start_year = 1948
 start_month = 1
 end_year = 2018
 end_month = 4
-time = datetime.date(start_year, start_month, 1)
 
-# print number of bands
-bands = gscript.read_command('r.in.gdal',
-    input=temperature,
-    output='temperature',
+# set import parameters
+workers = 4 # number of import processes
+lazy = False # link bands with r.external instead of importing them
+strds = None # name of a space time raster dataset to register bands in
+
+# import bands that changed since the last import
+import_bands.import_bands(temperature,
+    'temperature',
+    start_year,
+    start_month,
+    workers=workers,
     memory=6000,
-    flags='p')
-
-# import temperature data
-for band in enumerate(range(int(bands)), 1):
-    gscript.run_command('r.in.gdal',
-        input=temperature,
-        output='temperature_{year}_{month}'.format(year=time.year, month=time.strftime('%m')),
-        band=band[0],
-        memory=6000,
-        flags='o',
-        overwrite=overwrite)
-
-    # advance time
-    time = time + relativedelta(months=+1)
+    lazy=lazy,
+    strds=strds)
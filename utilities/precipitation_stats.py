@@ -18,6 +18,7 @@ import datetime
 from dateutil.relativedelta import relativedelta
 import grass.script as gscript
 from grass.exceptions import CalledModuleError
+import climate_stats
 
 # temporary region
 gscript.use_temp_region()
@@ -43,6 +44,9 @@ end_year = 2016
 end_month = 13
 time = datetime.date(start_year, start_month, 1)
 
+# read the netcdf file directly instead of imported rasters
+direct = True
+
 # set region
 gscript.run_command('g.region',
     n=10,
@@ -51,12 +55,21 @@ gscript.run_command('g.region',
     w=-80,
     res=2)
 
-# create list
+# create lists
 mean_precipitation = []
+missing = []
 
 # csv filepath
 precipitation_stats = os.path.join(gisdbase, 'precipitation_stats.csv')
 
+# compute statistics directly from the netcdf file
+if direct:
+    climate_stats.write_stats(precipitation,
+        precipitation_stats,
+        'Precipitation(mm/day)',
+        climate_stats.months(start_year, start_month, end_year, 1))
+    sys.exit(0)
+
 # write statistics to csv file
 with open(precipitation_stats, 'wb') as csvfile:
     stats_writer = csv.writer(csvfile,
@@ -99,9 +112,16 @@ with open(precipitation_stats, 'wb') as csvfile:
                 stats_writer.writerow([time,
                     mean_precipitation[i]])
 
-                # advance
                 i = i + 1
-                time = time + relativedelta(months=+1)
 
-            except:
-                pass
+            except (CalledModuleError, KeyError):
+                missing.append(time)
+
+            # advance
+            time = time + relativedelta(months=+1)
+
+# report months without data
+if missing:
+    gscript.warning('No data for {count} months: {months}'.format(
+        count=len(missing),
+        months=', '.join(month.strftime('%Y-%m') for month in missing)))
@@ -12,10 +12,15 @@ This program is free software under the GNU General Public License
 
 import os
 import sys
-import csv
+import json
 import atexit
+import hashlib
+import tempfile
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from osgeo import osr
 import grass.script as gscript
-from grass.exceptions import CalledModuleError
+from grass.script import array as garray
 
 # temporary region
 gscript.use_temp_region()
@@ -31,19 +36,180 @@ gisdbase = env['GISDBASE']
 location = env['LOCATION_NAME']
 mapset = env['MAPSET']
 
+# set reprojection parameters
+source_location = 'ESACCI-LC'
+source_mapset = 'PERMANENT'
+years = range(1998,2016)
+cached_index = True # gather through a cached nearest neighbour index instead of r.proj
+workers = 4 # number of years to reproject at once
+index_path = os.path.join(gisdbase, location, mapset, 'landcover_reprojection.npz')
+
+def source_environment():
+    """return an environment for the source location"""
+
+    descriptor, gisrc = tempfile.mkstemp()
+    with os.fdopen(descriptor, 'w') as gisrc_file:
+        gisrc_file.write('GISDBASE: {gisdbase}\n'
+            'LOCATION_NAME: {location}\n'
+            'MAPSET: {mapset}\n'.format(gisdbase=gisdbase,
+                location=source_location,
+                mapset=source_mapset))
+    atexit.register(os.remove, gisrc)
+    source_env = os.environ.copy()
+    source_env['GISRC'] = gisrc
+    source_env.pop('WIND_OVERRIDE', None)
+    source_env.pop('GRASS_REGION', None)
+    return source_env
+
+def source_grid(raster, source_env):
+    """read the grid of a raster in the source location"""
+
+    info = gscript.parse_command('r.info',
+        map=raster,
+        flags='g',
+        env=source_env)
+    return dict((key, float(info[key]))
+        for key in ['north', 'south', 'east', 'west', 'nsres', 'ewres', 'rows', 'cols'])
+
+def build_index(grid, source_env):
+    """find the nearest source cell for the center of each target cell"""
+
+    # transform target cell centers to the source projection
+    region = gscript.region()
+    x, y = np.meshgrid(
+        region['w'] + (np.arange(region['cols']) + 0.5) * region['ewres'],
+        region['n'] - (np.arange(region['rows']) + 0.5) * region['nsres'])
+    source = osr.SpatialReference()
+    source.ImportFromWkt(gscript.read_command('g.proj', flags='wf'))
+    target = osr.SpatialReference()
+    target.ImportFromWkt(gscript.read_command('g.proj', flags='wf', env=source_env))
+    for reference in (source, target):
+        if hasattr(reference, 'SetAxisMappingStrategy'):
+            reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    points = np.array(osr.CoordinateTransformation(source, target).TransformPoints(
+        np.column_stack([x.ravel(), y.ravel()]).tolist()))
+
+    # find source cells with -1 outside the source grid
+    columns = np.floor((points[:, 0] - grid['west']) / grid['ewres']).astype(np.int64)
+    rows = np.floor((grid['north'] - points[:, 1]) / grid['nsres']).astype(np.int64)
+    outside = (columns < 0) | (columns >= grid['cols']) | (rows < 0) | (rows >= grid['rows'])
+    columns[outside] = -1
+    rows[outside] = -1
+    return rows.reshape(x.shape), columns.reshape(x.shape)
+
+def load_index(grid, source_env):
+    """load the cached index or build it for a new grid or region"""
+
+    digest = hashlib.sha1(json.dumps([grid,
+        gscript.region(),
+        gscript.read_command('g.proj', flags='wf'),
+        gscript.read_command('g.proj', flags='wf', env=source_env)],
+        sort_keys=True).encode('utf-8')).hexdigest()
+    if os.path.isfile(index_path):
+        cached = np.load(index_path)
+        if str(cached['digest']) == digest:
+            return cached['rows'], cached['columns']
+    rows, columns = build_index(grid, source_env)
+    np.savez(index_path, digest=digest, rows=rows, columns=columns)
+    return rows, columns
+
+def gather(raster, grid, rows, columns, source_env):
+    """reproject a raster by gathering its nearest cells through an index"""
+
+    # read the window of the source raster that the index covers
+    valid = rows >= 0
+    top, bottom = rows[valid].min(), rows[valid].max()
+    left, right = columns[valid].min(), columns[valid].max()
+    window_env = source_env.copy()
+    window_env['GRASS_REGION'] = gscript.region_env(
+        n=grid['north'] - top * grid['nsres'],
+        s=grid['north'] - (bottom + 1) * grid['nsres'],
+        w=grid['west'] + left * grid['ewres'],
+        e=grid['west'] + (right + 1) * grid['ewres'],
+        nsres=grid['nsres'],
+        ewres=grid['ewres'],
+        env=source_env)
+    descriptor, path = tempfile.mkstemp()
+    os.close(descriptor)
+    try:
+        gscript.run_command('r.out.bin',
+            input=raster,
+            output=path,
+            bytes=4,
+            null=-1,
+            flags='i',
+            overwrite=True,
+            env=window_env)
+        block = np.fromfile(path, dtype=np.int32).reshape(bottom - top + 1,
+            right - left + 1)
+    finally:
+        os.remove(path)
+
+    # gather into the target region
+    output = garray.array(dtype=np.int32)
+    output[...] = np.where(valid, block[np.where(valid, rows - top, 0),
+        np.where(valid, columns - left, 0)], -1)
+    output.write(mapname=raster, null=-1, overwrite=overwrite)
+
+    # carry over the color table and categories like r.proj
+    # by copying them from the source location as rules
+    colors = gscript.read_command('r.colors.out',
+        map=raster,
+        env=source_env)
+    gscript.write_command('r.colors',
+        map=raster,
+        rules='-',
+        stdin=colors)
+    categories = gscript.read_command('r.category',
+        map=raster,
+        separator='pipe',
+        env=source_env)
+    if categories.strip():
+        gscript.write_command('r.category',
+            map=raster,
+            rules='-',
+            separator='pipe',
+            stdin=categories)
+    return raster
+
 # set region
 gscript.run_command('g.region',
     raster='panama_30m_dem',
     res=300,
     overwrite=overwrite)
 
+# reproject landcover rasters through a cached index
+if cached_index:
+    source_env = source_environment()
+    grid = source_grid('landcover_'+str(years[0]), source_env)
+    rows, columns = load_index(grid, source_env)
+
+    # check that every year shares the source grid
+    for year in years:
+        if source_grid('landcover_'+str(year), source_env) != grid:
+            gscript.fatal('landcover_{year} is not on the same grid'.format(year=year))
+
+    # gather years in parallel
+    pool = ThreadPool(workers)
+    try:
+        pool.map(lambda year: gather('landcover_'+str(year),
+            grid,
+            rows,
+            columns,
+            source_env),
+            years)
+    finally:
+        pool.close()
+        pool.join()
+    sys.exit(0)
+
 # reproject landcover rasters
-for index, year in enumerate(range(1998,2016)):
+for index, year in enumerate(years):
 
     # import
     gscript.run_command('r.proj',
-        location='ESACCI-LC',
-        mapset='PERMANENT',
+        location=source_location,
+        mapset=source_mapset,
         input='landcover_'+str(year),
         output='landcover_'+str(year),
         method='nearest',
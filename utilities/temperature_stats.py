@@ -18,6 +18,11 @@ import datetime
 from dateutil.relativedelta import relativedelta
 import grass.script as gscript
 from grass.exceptions import CalledModuleError
+import climate_stats
+
+# share the netcdf functions of the analysis
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import climate
 
 # temporary region
 gscript.use_temp_region()
@@ -34,7 +39,7 @@ location = env['LOCATION_NAME']
 mapset = env['MAPSET']
 
 # set path
-temperature = os.path.join(gisdbase, 'climate_data','precip.mon.mean.nc')
+temperature = os.path.join(gisdbase, 'climate_data','air.mon.mean.nc')
 
 # set temporal parameters
 start_year = 1998
@@ -43,6 +48,9 @@ end_year = 2016
 end_month = 13
 time = datetime.date(start_year, start_month, 1)
 
+# read the netcdf file directly instead of imported rasters
+direct = True
+
 # set region
 gscript.run_command('g.region',
     n=10,
@@ -51,12 +59,27 @@ gscript.run_command('g.region',
     w=-80,
     res=0.3)
 
-# create list
+# create lists
 mean_temperature = []
+missing = []
 
 # csv filepath
 temperature_stats = os.path.join(gisdbase, 'temperature_stats.csv')
 
+# compute statistics directly from the netcdf file
+if direct:
+    climate_stats.write_stats(temperature,
+        temperature_stats,
+        'Temperature(degC)',
+        climate_stats.months(start_year, start_month, end_year, 1))
+    sys.exit(0)
+
+# unpack imported values with the scale factor and offset of the netcdf file
+# like the direct mode and the basin climate analysis
+band = climate.open_dataset(temperature).GetRasterBand(1)
+scale = band.GetScale() or 1.0
+offset = band.GetOffset() or 0.0
+
 # write statistics to csv file
 with open(temperature_stats, 'wb') as csvfile:
     stats_writer = csv.writer(csvfile,
@@ -82,12 +105,12 @@ with open(temperature_stats, 'wb') as csvfile:
                     month=time.strftime('%m'),
                     mapset=mapset)
 
-                # import to mapset, crop map to region, and divide by ten
-                # since integer versions of temperature grids
-                # are stored in tenths of degrees C
+                # import to mapset, crop map to region, and unpack values
                 gscript.run_command('r.mapcalc',
-                    expression='{new} = {old}*0.1'.format(old=old,
-                        new=new),
+                    expression='{new} = {old} * {scale} + {offset}'.format(old=old,
+                        new=new,
+                        scale=scale,
+                        offset=offset),
                     overwrite=overwrite)
 
                 # compute statistics
@@ -101,9 +124,16 @@ with open(temperature_stats, 'wb') as csvfile:
                 stats_writer.writerow([time,
                     mean_temperature[i]])
 
-                # advance
                 i = i + 1
-                time = time + relativedelta(months=+1)
 
-            except:
-                pass
+            except (CalledModuleError, KeyError):
+                missing.append(time)
+
+            # advance
+            time = time + relativedelta(months=+1)
+
+# report months without data
+if missing:
+    gscript.warning('No data for {count} months: {months}'.format(
+        count=len(missing),
+        months=', '.join(month.strftime('%Y-%m') for month in missing)))
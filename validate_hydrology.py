@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: validate the numpy flow engine against r.watershed
+
+Generate synthetic elevation models, remove their depressions with
+r.fill.dir, and compare the flow directions and flow accumulation of
+hydrology.py with those of r.watershed with single flow directions.
+Run in a temporary location, for example:
+
+    grass --tmp-location EPSG:32617 --exec python validate_hydrology.py --size 500
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+import grass.script as gscript
+from grass.script import array as garray
+import hydrology
+
+# synthetic data parameters
+res = 30
+
+# synthetic elevation models as map algebra
+surfaces = {
+    'valleys': '0.02 * y() + 30 * (1 + cos(x() / {spacing} * 360))'
+        ' + 2 * sin(x() * 0.7) * cos(y() * 1.3)',
+    'cone': 'sqrt((x() - {center}) ^ 2 + (y() - {center}) ^ 2) / 10',
+    'terraces': 'round(0.01 * x() + 0.005 * y()) * 5',
+    'noise': '0.01 * y() + rand(0, 20)'}
+
+def main():
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description='validate the numpy '
+        'flow engine against r.watershed')
+    parser.add_argument('--size',
+        type=int,
+        default=500,
+        help='number of rows and columns of the synthetic rasters')
+    parser.add_argument('--tolerance',
+        type=float,
+        default=0.9,
+        help='fraction of cells that must have the same direction')
+    parser.add_argument('--accumulation-tolerance',
+        type=float,
+        default=0.9,
+        help='fraction of cells that must have the same accumulation')
+    args = parser.parse_args()
+
+    env = os.environ.copy()
+    env['GRASS_REGION'] = gscript.region_env(n=args.size * res,
+        s=0,
+        e=args.size * res,
+        w=0,
+        res=res)
+
+    # compare each surface
+    failed = []
+    for name, surface in sorted(surfaces.items()):
+        comparison = compare(name, surface, args.size, env)
+        gscript.message('{name}: {directions:.1%} of directions and '
+            '{accumulation:.1%} of accumulation match, '
+            'correlation of log accumulation {correlation:.3f}'.format(
+                name=name, **comparison))
+        if comparison['directions'] < args.tolerance \
+            or comparison['accumulation'] < args.accumulation_tolerance:
+            failed.append(name)
+    if failed:
+        gscript.warning('Flow differs for {names}'.format(
+            names=', '.join(failed)))
+    return 1 if failed else 0
+
+def compare(name, surface, size, env):
+    """compare the flow of a synthetic surface with r.watershed"""
+
+    # generate a surface without depressions
+    dem = 'validation_' + name
+    gscript.run_command('r.mapcalc',
+        expression='{dem}_raw = {surface}'.format(dem=dem,
+            surface=surface.format(spacing=size * res / 8.0,
+                center=size * res / 2.0)),
+        seed=1,
+        overwrite=True,
+        env=env)
+    gscript.run_command('r.fill.dir',
+        input=dem + '_raw',
+        output=dem,
+        direction=dem + '_fill_direction',
+        overwrite=True,
+        env=env)
+
+    # reference flow with single flow directions like the engine
+    gscript.run_command('r.watershed',
+        elevation=dem,
+        accumulation=dem + '_accumulation',
+        drainage=dem + '_drainage',
+        flags='sb',
+        overwrite=True,
+        env=env)
+    reference_direction = garray.array(mapname=dem + '_drainage', null=0, env=env)
+    reference_accumulation = garray.array(mapname=dem + '_accumulation', null=np.nan, env=env)
+
+    # numpy flow
+    elevation = np.array(garray.array(mapname=dem, null=np.nan, env=env))
+    direction = np.zeros(elevation.shape, dtype=np.int8)
+    hydrology.flow_direction(elevation, direction, res, res)
+    receiver = hydrology.receivers(direction)
+    order, levels = hydrology.topological_order(receiver)
+    null = np.isnan(elevation).ravel()
+    accumulation = hydrology.flow_accumulation(receiver,
+        order,
+        levels,
+        ~null,
+        hydrology.edge_cells(elevation)).reshape(elevation.shape)
+
+    # compare cells with data
+    valid = ~np.isnan(elevation) & ~np.isnan(reference_accumulation)
+    same_direction = np.abs(direction[valid]) == np.abs(reference_direction[valid])
+    reference = np.abs(reference_accumulation[valid])
+    computed = np.abs(accumulation[valid])
+    same_accumulation = np.abs(computed - reference) <= 0.01 * reference
+    correlation = np.corrcoef(np.log(computed), np.log(reference))[0, 1]
+
+    gscript.run_command('g.remove',
+        type='raster',
+        pattern=dem + '*',
+        flags='f',
+        env=env)
+    return dict(directions=same_direction.mean(),
+        accumulation=same_accumulation.mean(),
+        correlation=correlation)
+
+if __name__ == "__main__":
+    sys.exit(main())
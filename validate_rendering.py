@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: compare composited frames with frames drawn by the display driver
+
+Landcover frames are composited with numpy from a colored raster and
+layers rendered once, blending and resampling like d.shade and d.rast.
+Render a frame of the study area and of a basin both ways and report
+how many pixels differ. Run in the mapset of the analysis once the
+landcover maps exist, for example:
+
+    python validate_rendering.py --year 2000
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+import numpy as np
+import grass.script as gscript
+import compositor
+import panama_analysis as analysis
+
+def main():
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description='compare composited frames '
+        'with frames drawn by the display driver')
+    parser.add_argument('--year',
+        type=int,
+        default=analysis.start,
+        help='year of landcover to render')
+    parser.add_argument('--basin',
+        default=analysis.river_mapnames[0],
+        help='basin to render')
+    parser.add_argument('--threshold',
+        type=int,
+        default=8,
+        help='difference in a color channel for a pixel to differ')
+    parser.add_argument('--tolerance',
+        type=float,
+        default=0.01,
+        help='fraction of pixels that may differ')
+    args = parser.parse_args()
+
+    # compare the frames of the study area and a basin
+    directory = tempfile.mkdtemp()
+    failed = []
+    try:
+        for name, composite in [('study area', analysis.landcover_composite([args.year])),
+            (args.basin, analysis.basin_landcover_composite(args.basin, [args.year]))]:
+            comparison = compare(composite, directory, args.threshold)
+            gscript.message('{name}: {different:.2%} of pixels differ, '
+                'mean difference {mean:.2f}, maximum difference {maximum}'.format(
+                    name=name, **comparison))
+            if comparison['different'] > args.tolerance:
+                failed.append(name)
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        gscript.warning('Frames differ for {names}'.format(
+            names=', '.join(failed)))
+    return 1 if failed else 0
+
+def compare(composite, directory, threshold):
+    """render a frame both ways and measure the difference of their pixels"""
+
+    # composite the frame with numpy
+    frame = dict(composite['frames'][0],
+        output=os.path.join(directory, 'composited.png'))
+    composite = dict(composite, frames=[frame])
+    analysis.render_composite(composite)
+
+    # draw the frame with the display driver
+    drawn = analysis.drawn_frame(composite,
+        dict(frame, output=os.path.join(directory, 'drawn.png')))
+    analysis.render_frame(drawn)
+
+    composited = compositor.read_png(frame['output'])[..., :3].astype(np.int64)
+    reference = compositor.read_png(drawn['output'])[..., :3].astype(np.int64)
+    difference = np.abs(composited - reference).max(axis=-1)
+    return dict(different=(difference > threshold).mean(),
+        mean=difference.mean(),
+        maximum=int(difference.max()))
+
+if __name__ == "__main__":
+    sys.exit(main())
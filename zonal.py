@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@brief: statistics, class counts and class transitions in many zones
+
+Values are grouped by zone with bincount so that the cost of a pass
+does not grow with the number of zones. Percentiles are interpolated
+from a histogram of each zone and are accurate to within one bin.
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Brendan Harmon (brendanharmon@gmail.com)
+"""
+
+import numpy as np
+
+# percentiles computed for each zone
+percentiles = [5, 25, 50, 75, 95]
+
+# number of histogram bins for percentiles
+bins = 1000
+
+def zone_index(zones, ids):
+    """map zone values to positions in a list of zone ids, or -1 if not listed"""
+
+    ids = np.array([np.nan if i is None else i for i in ids], dtype=np.float64)
+    zones = np.asarray(zones, dtype=np.float64)
+    if not ids.size:
+        return np.full(zones.shape, -1, dtype=np.int64)
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+    position = np.clip(np.searchsorted(sorted_ids, zones), 0, ids.size - 1)
+    return np.where(sorted_ids[position] == zones, order[position], -1)
+
+def zonal_statistics(zones, values, ids):
+    """compute count, mean, min, max, stddev and percentiles for each zone"""
+
+    # keep cells with a value in a listed zone
+    index = zone_index(zones, ids).ravel()
+    values = np.asarray(values, dtype=np.float64).ravel()
+    valid = (index >= 0) & ~np.isnan(values)
+    index = index[valid]
+    values = values[valid]
+    count = len(ids)
+
+    # moments
+    cells = np.bincount(index, minlength=count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(index, weights=values, minlength=count) / cells
+        deviations = values - mean[index]
+        stddev = np.sqrt(np.bincount(index,
+            weights=deviations * deviations,
+            minlength=count) / cells)
+
+    # extremes
+    minimum = np.full(count, np.inf)
+    maximum = np.full(count, -np.inf)
+    np.minimum.at(minimum, index, values)
+    np.maximum.at(maximum, index, values)
+
+    # percentiles from a histogram of each zone
+    quantiles = dict((percentile, np.full(count, np.nan))
+        for percentile in percentiles)
+    if values.size:
+        low = values.min()
+        width = (values.max() - low) / bins or 1.0
+        bin_index = np.minimum(((values - low) / width).astype(np.int64), bins - 1)
+        histogram = np.bincount(index * bins + bin_index,
+            minlength=count * bins).reshape(count, bins)
+        cumulative = np.cumsum(histogram, axis=1)
+        filled = cells > 0
+        rows = np.arange(count)
+        for percentile in percentiles:
+            rank = percentile / 100.0 * cells
+            found = np.argmax(cumulative >= rank[:, None], axis=1)
+            below = cumulative[rows, found] - histogram[rows, found]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fraction = (rank - below) / histogram[rows, found]
+            estimate = np.clip(low + (found + fraction) * width, minimum, maximum)
+            quantiles[percentile] = np.where(filled, estimate, np.nan)
+
+    # collect statistics by zone
+    statistics = []
+    for position in range(count):
+        empty = cells[position] == 0
+        statistics.append(dict(cells=int(cells[position]),
+            mean=np.nan if empty else mean[position],
+            min=np.nan if empty else minimum[position],
+            max=np.nan if empty else maximum[position],
+            stddev=np.nan if empty else stddev[position],
+            percentiles=dict((percentile, quantiles[percentile][position])
+                for percentile in percentiles)))
+    return statistics
+
+def crosstab(zones, classes, ids):
+    """count the cells of each class in each zone"""
+
+    # keep cells with a class in a listed zone
+    index = zone_index(zones, ids).ravel()
+    classes = np.asarray(classes, dtype=np.float64).ravel()
+    valid = (index >= 0) & ~np.isnan(classes)
+    index = index[valid]
+    classes = classes[valid].astype(np.int64)
+    count = len(ids)
+    if not classes.size:
+        return np.array([], dtype=np.int64), np.zeros((count, 0), dtype=np.int64)
+
+    # count pairs of zone and class
+    low = classes.min()
+    span = classes.max() - low + 1
+    counts = np.bincount(index * span + (classes - low),
+        minlength=count * span).reshape(count, span)
+
+    # keep classes that occur
+    present = counts.any(axis=0)
+    return np.arange(low, low + span)[present], counts[:, present]
+
+def transitions(zones, before, after, ids):
+    """count the cells in each zone that changed from one class to another"""
+
+    # keep cells with classes in both maps in a listed zone
+    index = zone_index(zones, ids).ravel()
+    before = np.asarray(before, dtype=np.float64).ravel()
+    after = np.asarray(after, dtype=np.float64).ravel()
+    valid = (index >= 0) & ~np.isnan(before) & ~np.isnan(after)
+    index = index[valid]
+    before = before[valid].astype(np.int64)
+    after = after[valid].astype(np.int64)
+    if not index.size:
+        return []
+
+    # count triples of zone, class before and class after
+    low = min(before.min(), after.min())
+    span = max(before.max(), after.max()) - low + 1
+    counts = np.bincount((index * span + (before - low)) * span + (after - low),
+        minlength=len(ids) * span * span).reshape(len(ids), span, span)
+
+    # list the transitions that occur as (zone position, from, to, cells)
+    positions, sources, targets = np.nonzero(counts)
+    return [(int(position), int(source + low), int(target + low),
+        int(counts[position, source, target]))
+        for position, source, target in zip(positions, sources, targets)]